@@ -0,0 +1,355 @@
+"""Benchmarks for the tiling and encoding pipeline on synthetic rasters.
+
+Each benchmark runs in a fresh process so that peak memory can be measured
+independently.  Results are written as JSON, for comparison across versions:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json --output new_results.json
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+import numpy as np
+import rasterio
+
+from pymbtiles import MBtiles
+
+from benchmarks.synthetic import get_values, write_synthetic_tif
+from datatiles.encoding import encode_tifs
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.metrics import get_peak_memory
+from datatiles.png import to_paletted_png, to_smallest_png
+from datatiles.raster import unique_to_indexed
+from datatiles.tiles import read_tiles
+
+
+ZOOM = 10
+MIN_ZOOM = 4
+
+DENSITIES = {"sparse": 0.1, "dense": 1.0}
+CLASSES = {"few": 4, "many": 200}
+DTYPES = ("uint8", "uint16", "uint32")
+SIZES = (512, 2048)
+
+BENCHMARKS = (
+    "encode_tifs",
+    "unique_to_indexed",
+    "read_tiles",
+    "to_smallest_png",
+    "to_paletted_png",
+    "tif_to_mbtiles",
+)
+
+
+def to_memory_mb(nbytes):
+    """Convert peak memory in bytes from datatiles.metrics.get_peak_memory to MB,
+    or None if it is not available"""
+
+    if nbytes is None:
+        return None
+    return nbytes / 1024.0 / 1024.0
+
+
+def get_raster_bytes(filename):
+    """Get the size of the uncompressed data of a raster, in bytes"""
+
+    with rasterio.open(filename) as src:
+        return src.width * src.height * src.count * np.dtype(src.dtypes[0]).itemsize
+
+
+def read_tile_arrays(filename):
+    """Read non-empty tiles at max zoom, for benchmarking renderers."""
+
+    with rasterio.open(filename) as src:
+        return [
+            data
+            for _, data, _ in read_tiles(src, min_zoom=ZOOM, max_zoom=ZOOM)
+            if not np.all(data == src.nodata)
+        ]
+
+
+def bench_encode_tifs(files, workdir):
+    sources = {
+        "layer{}".format(i): {"source": filename}
+        for i, filename in enumerate(files["sources"])
+    }
+
+    start = perf_counter()
+    encode_tifs(sources, os.path.join(workdir, "encoded.tif"))
+    elapsed = perf_counter() - start
+
+    nbytes = sum(get_raster_bytes(filename) for filename in files["sources"])
+    return elapsed, {"mb": nbytes / 1e6}
+
+
+def bench_unique_to_indexed(files, workdir):
+    with rasterio.open(files["sources"][0]) as src:
+        data = src.read(1, masked=True)
+
+    start = perf_counter()
+    unique_to_indexed(data)
+    elapsed = perf_counter() - start
+
+    return elapsed, {"mb": data.nbytes / 1e6}
+
+
+def bench_read_tiles(files, workdir):
+    tiles = 0
+    nbytes = 0
+    start = perf_counter()
+    with rasterio.open(files["encoded"]) as src:
+        for _, data, _ in read_tiles(src, min_zoom=MIN_ZOOM, max_zoom=ZOOM):
+            tiles += 1
+            nbytes += data.nbytes
+    elapsed = perf_counter() - start
+
+    return elapsed, {"tiles": tiles, "mb": nbytes / 1e6}
+
+
+def bench_to_smallest_png(files, workdir):
+    arrays = read_tile_arrays(files["encoded"])
+
+    start = perf_counter()
+    out_bytes = sum(len(to_smallest_png(data)) for data in arrays)
+    elapsed = perf_counter() - start
+
+    return (
+        elapsed,
+        {
+            "tiles": len(arrays),
+            "mb": sum(data.nbytes for data in arrays) / 1e6,
+            "output_mb": out_bytes / 1e6,
+        },
+    )
+
+
+def bench_to_paletted_png(files, workdir):
+    values = np.array(files["values"])
+    palette = np.random.randint(0, 256, (len(values), 3)).astype("uint8")
+    arrays = [
+        np.ma.masked_equal(np.searchsorted(values, data), len(values)).astype("uint8")
+        for data in read_tile_arrays(files["sources"][0])
+    ]
+
+    start = perf_counter()
+    out_bytes = sum(len(to_paletted_png(data, palette)) for data in arrays)
+    elapsed = perf_counter() - start
+
+    return (
+        elapsed,
+        {
+            "tiles": len(arrays),
+            "mb": sum(data.nbytes for data in arrays) / 1e6,
+            "output_mb": out_bytes / 1e6,
+        },
+    )
+
+
+def bench_tif_to_mbtiles(files, workdir):
+    outfilename = os.path.join(workdir, "encoded.mbtiles")
+
+    start = perf_counter()
+    tif_to_mbtiles(files["encoded"], outfilename, MIN_ZOOM, ZOOM)
+    elapsed = perf_counter() - start
+
+    with MBtiles(outfilename) as mbtiles:
+        tiles = len(mbtiles.list_tiles())
+
+    return (
+        elapsed,
+        {
+            "tiles": tiles,
+            "mb": get_raster_bytes(files["encoded"]) / 1e6,
+            "output_mb": os.path.getsize(outfilename) / 1e6,
+        },
+    )
+
+
+def run_benchmark(name, files, workdir):
+    """Run a benchmark and calculate its throughput.  Called in a new process."""
+
+    baseline_memory = to_memory_mb(get_peak_memory())
+
+    # keep progress messages out of results written to stdout
+    with redirect_stdout(sys.stderr):
+        elapsed, result = globals()["bench_{}".format(name)](files, workdir)
+
+    result.update(
+        {
+            "seconds": elapsed,
+            "peak_memory_mb": to_memory_mb(get_peak_memory()),
+            # such as the worker processes of encode_tifs
+            "peak_memory_workers_mb": to_memory_mb(get_peak_memory(children=True)),
+            "baseline_memory_mb": baseline_memory,
+        }
+    )
+    if "tiles" in result:
+        result["tiles_per_sec"] = result["tiles"] / elapsed
+    if "mb" in result:
+        result["mb_per_sec"] = result["mb"] / elapsed
+
+    return result
+
+
+def get_environment():
+    """Get versions of the code and dependencies under test."""
+
+    try:
+        version = subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+        )
+        version = version.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = None
+
+    return {
+        "version": version,
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+    }
+
+
+def get_configs(sizes, quick=False):
+    """Get all combinations of benchmark configurations"""
+
+    densities = ["dense"] if quick else list(DENSITIES)
+    classes = ["few"] if quick else list(CLASSES)
+    dtypes = ["uint8"] if quick else list(DTYPES)
+
+    for size, density, num_classes, dtype in itertools.product(
+        sizes, densities, classes, dtypes
+    ):
+        yield {
+            "size": size,
+            "density": density,
+            "classes": num_classes,
+            "dtype": dtype,
+        }
+
+
+def prepare_files(config, workdir):
+    """Write synthetic sources and the encoded tif used by the benchmarks"""
+
+    sources = []
+    for seed in range(3):
+        filename = os.path.join(workdir, "source{}.tif".format(seed))
+        write_synthetic_tif(
+            filename,
+            config["size"],
+            dtype=config["dtype"],
+            num_classes=CLASSES[config["classes"]],
+            density=DENSITIES[config["density"]],
+            zoom=ZOOM,
+            seed=seed,
+        )
+        sources.append(filename)
+
+    encoded = os.path.join(workdir, "prepared_encoded.tif")
+    encode_tifs(
+        {"layer{}".format(i): {"source": f} for i, f in enumerate(sources)}, encoded
+    )
+
+    return {
+        "sources": sources,
+        "encoded": encoded,
+        "values": get_values(config["dtype"], CLASSES[config["classes"]]).tolist(),
+    }
+
+
+def compare(results, previous):
+    """Print the change in time of each benchmark relative to previous results"""
+
+    def key(result):
+        return (result["benchmark"], json.dumps(result["config"], sort_keys=True))
+
+    previous = {key(r): r for r in previous["results"]}
+    for result in results["results"]:
+        prev = previous.get(key(result))
+        if prev is None:
+            continue
+
+        change = (result["seconds"] - prev["seconds"]) / prev["seconds"]
+        click.echo(
+            "{:<20} {:<70} {:+.1%}".format(
+                result["benchmark"],
+                json.dumps(result["config"], sort_keys=True),
+                change,
+            ),
+            err=True,
+        )
+
+
+@click.command()
+@click.option(
+    "--benchmark",
+    "-b",
+    "benchmarks",
+    multiple=True,
+    type=click.Choice(BENCHMARKS),
+    help="Benchmark to run; may be repeated.  Default: all",
+)
+@click.option(
+    "--size", "sizes", multiple=True, type=int, help="Raster size; may be repeated"
+)
+@click.option("--quick", is_flag=True, help="Only run dense, few class, uint8 rasters")
+@click.option("--output", "-o", type=click.Path(), help="Output JSON filename")
+@click.option(
+    "--compare",
+    "previous",
+    type=click.File("r"),
+    help="Previous results JSON file to compare against",
+)
+def main(benchmarks, sizes, quick, output, previous):
+    benchmarks = benchmarks or BENCHMARKS
+    sizes = sizes or SIZES
+
+    results = {"environment": get_environment(), "results": []}
+    context = multiprocessing.get_context("spawn")
+
+    for config in get_configs(sizes, quick=quick):
+        with TemporaryDirectory() as workdir:
+            with redirect_stdout(sys.stderr):
+                files = prepare_files(config, workdir)
+
+            for name in benchmarks:
+                click.echo("{} {}".format(name, config), err=True)
+
+                # Use a fresh process per benchmark to measure peak memory.
+                # Its workers are not daemonic, so benchmarks can start their
+                # own pools of processes.
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_benchmark, name, files, workdir).result()
+
+                result.update({"benchmark": name, "config": config})
+                results["results"].append(result)
+
+    if previous is not None:
+        compare(results, json.load(previous))
+
+    if output:
+        with open(output, "w") as out:
+            json.dump(results, out, indent=2)
+    else:
+        click.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
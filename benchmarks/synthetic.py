@@ -0,0 +1,78 @@
+"""Synthetic GeoTIFFs for benchmarks"""
+
+import math
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from datatiles.raster import WEB_MERCATOR_CIRCUMFERENCE
+
+
+NODATA = {"uint8": 255, "uint16": 65535, "uint32": 4294967295}
+
+
+def get_values(dtype, num_classes):
+    """Get the class values used for a synthetic raster.
+
+    Values are spread across the range of dtype, so that the raster requires
+    that dtype.
+
+    Parameters
+    ----------
+    dtype : str, one of "uint8", "uint16", "uint32"
+    num_classes : int
+
+    Returns
+    -------
+    numpy array of values
+    """
+
+    max_value = NODATA[dtype] - 1
+    return np.linspace(0, max_value, num_classes).astype(dtype)
+
+
+def write_synthetic_tif(
+    filename, size, dtype="uint8", num_classes=4, density=1.0, zoom=10, seed=0
+):
+    """Write a single band GeoTIFF of random classes in Web Mercator.
+
+    Classes are assigned in blocks of 8 x 8 pixels, so that the data have some
+    spatial structure, similar to classified rasters.  Pixels match the resolution
+    of 256 x 256 tiles at zoom.
+
+    Parameters
+    ----------
+    filename : output tif filename
+    size : int
+        width and height of raster
+    dtype : str, optional (default "uint8")
+    num_classes : int, optional (default 4)
+    density : float, optional (default 1.0)
+        proportion of blocks that have data; the rest are nodata
+    zoom : int, optional (default 10)
+    seed : int, optional (default 0)
+    """
+
+    rng = np.random.RandomState(seed)
+    blocks = int(math.ceil(size / 8.0))
+
+    values = get_values(dtype, num_classes)
+    data = values[rng.randint(0, num_classes, (blocks, blocks))]
+    data[rng.random_sample((blocks, blocks)) >= density] = NODATA[dtype]
+    data = np.kron(data, np.ones((8, 8), dtype=dtype))[:size, :size]
+
+    res = WEB_MERCATOR_CIRCUMFERENCE / (256 * math.pow(2, zoom))
+    with rasterio.open(
+        filename,
+        "w",
+        driver="GTiff",
+        width=size,
+        height=size,
+        count=1,
+        dtype=dtype,
+        nodata=NODATA[dtype],
+        crs="EPSG:3857",
+        transform=from_origin(0, size * res, res, res),
+    ) as out:
+        out.write(data, 1)
@@ -0,0 +1,447 @@
+"""Single file tile archives.
+
+An archive stores each unique tile once, contiguously in order of tile id, followed
+by a binary index of tile ids and the offset and length of each tile, and JSON
+metadata.  Tile ids number tiles along a Hilbert curve within each zoom level, so
+that tiles that are near each other are also stored near each other in the file.
+
+Layout:
+    header (HEADER)
+    tile data
+    index (INDEX_DTYPE), sorted by tile id
+    metadata (UTF-8 JSON)
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from tempfile import TemporaryFile
+
+import numpy as np
+
+from datatiles.metrics import NULL_METRICS
+from datatiles.png import to_smallest_png
+from datatiles.raster import (
+    get_default_max_zoom,
+    get_geo_bounds,
+    get_mbtiles_meta,
+    open_source,
+    overviews_source,
+)
+from datatiles.tiles import get_descendants, read_tiles
+
+
+MAGIC = b"DTARCHIV"
+VERSION = 1
+
+# magic, version, number of index entries, index offset, metadata offset,
+# metadata length
+HEADER = struct.Struct("<8sIQQQQ")
+
+INDEX_DTYPE = np.dtype([("tile_id", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+
+MAX_ZOOM = 31
+
+# tile id of the first tile at each zoom level: sum of 4 ** z for lower zooms
+ZOOM_STARTS = np.array([(4 ** z - 1) // 3 for z in range(MAX_ZOOM + 2)], dtype="uint64")
+
+
+def _rotate(n, x, y, rx, ry):
+    """Rotate and flip quadrants of a Hilbert curve of size n, as arrays"""
+
+    flip = (ry == 0) & (rx == 1)
+    x = np.where(flip, n - 1 - x, x)
+    y = np.where(flip, n - 1 - y, y)
+
+    swap = ry == 0
+    return np.where(swap, y, x), np.where(swap, x, y)
+
+
+def get_tile_ids(zoom, x, y):
+    """Calculate tile ids from tile coordinates.
+
+    Parameters
+    ----------
+    zoom : int
+    x : numpy array of tile x values
+    y : numpy array of tile y values (XYZ scheme)
+
+    Returns
+    -------
+    numpy uint64 array of tile ids
+    """
+
+    if zoom > MAX_ZOOM:
+        raise ValueError("zoom must be <= {}".format(MAX_ZOOM))
+
+    n = 2 ** zoom
+    x = np.asarray(x, dtype="uint64")
+    y = np.asarray(y, dtype="uint64")
+    d = np.zeros(x.shape, dtype="uint64")
+
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype("uint64")
+        ry = ((y & s) > 0).astype("uint64")
+        d += np.uint64(s * s) * ((3 * rx) ^ ry)
+        x, y = _rotate(np.uint64(n), x, y, rx, ry)
+        s //= 2
+
+    return ZOOM_STARTS[zoom] + d
+
+
+def get_tiles(tile_ids):
+    """Calculate tile coordinates from tile ids.
+
+    Parameters
+    ----------
+    tile_ids : numpy array of tile ids
+
+    Returns
+    -------
+    tuple of numpy arrays of zoom, x, y (XYZ scheme)
+    """
+
+    tile_ids = np.asarray(tile_ids, dtype="uint64")
+    zooms = np.searchsorted(ZOOM_STARTS, tile_ids, side="right") - 1
+    t = tile_ids - ZOOM_STARTS[zooms]
+    x = np.zeros(t.shape, dtype="uint64")
+    y = np.zeros(t.shape, dtype="uint64")
+
+    s = 1
+    max_n = 2 ** int(zooms.max()) if zooms.size else 1
+    while s < max_n:
+        active = s < 2 ** zooms.astype("uint64")
+        rx = np.uint64(1) & (t // np.uint64(2))
+        ry = np.uint64(1) & (t ^ rx)
+        rotated_x, rotated_y = _rotate(np.uint64(s), x, y, rx, ry)
+        x = np.where(active, rotated_x + s * rx, x)
+        y = np.where(active, rotated_y + s * ry, y)
+        t = np.where(active, t // np.uint64(4), t)
+        s *= 2
+
+    return zooms.astype("int64"), x.astype("int64"), y.astype("int64")
+
+
+class TileArchiveWriter(object):
+    """
+    Write tiles to a single file tile archive.
+
+    Tiles can be written in any order.  Unique tiles are written to a temporary
+    file as they are added, and copied into the archive in order of tile id
+    when it is closed.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : path to output archive file
+        """
+
+        self.filename = filename
+        self.meta = {}
+
+        self._tmpfile = TemporaryFile(dir=os.path.dirname(os.path.abspath(filename)))
+        self._tile_ids = []
+        self._blobs = []
+        # offset and length in temporary file of each unique tile, by hash
+        self._hashes = {}
+        self._offsets = []
+        self._lengths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._tmpfile.close()
+
+    def write_tile(self, z, x, y, data):
+        """Add a tile to the archive.
+
+        Parameters
+        ----------
+        z : int
+            zoom level
+        x : int
+            tile column
+        y : int
+            tile row (XYZ scheme)
+        data : bytes
+            tile data bytes
+        """
+
+        key = hashlib.sha1(data).digest()
+        blob = self._hashes.get(key)
+        if blob is None:
+            blob = len(self._offsets)
+            self._hashes[key] = blob
+            self._offsets.append(self._tmpfile.tell())
+            self._lengths.append(len(data))
+            self._tmpfile.write(data)
+
+        self._tile_ids.append(int(get_tile_ids(z, x, y)))
+        self._blobs.append(blob)
+
+    def close(self):
+        """Write the archive and remove temporary data."""
+
+        tile_ids = np.array(self._tile_ids, dtype="uint64")
+        blobs = np.array(self._blobs, dtype="int64")
+
+        order = np.argsort(tile_ids, kind="stable")
+        tile_ids = tile_ids[order]
+        blobs = blobs[order]
+
+        if len(np.unique(tile_ids)) < len(tile_ids):
+            self._tmpfile.close()
+            raise ValueError("Tiles must only be written once to an archive")
+
+        src_offsets = np.array(self._offsets, dtype="uint64")
+        lengths = np.array(self._lengths, dtype="uint64")
+        offsets = np.zeros(len(src_offsets), dtype="uint64")
+        written = np.zeros(len(src_offsets), dtype="bool")
+
+        index = np.empty(len(tile_ids), dtype=INDEX_DTYPE)
+        index["tile_id"] = tile_ids
+
+        with open(self.filename, "wb") as out:
+            out.write(b"\0" * HEADER.size)
+
+            # write unique tiles in the order they are first used
+            for blob in blobs:
+                if written[blob]:
+                    continue
+
+                offsets[blob] = out.tell()
+                self._tmpfile.seek(int(src_offsets[blob]))
+                out.write(self._tmpfile.read(int(lengths[blob])))
+                written[blob] = True
+
+            index["offset"] = offsets[blobs]
+            index["length"] = lengths[blobs]
+
+            index_offset = out.tell()
+            out.write(index.tobytes())
+
+            meta = json.dumps(self.meta).encode("utf-8")
+            meta_offset = out.tell()
+            out.write(meta)
+
+            out.seek(0)
+            out.write(
+                HEADER.pack(
+                    MAGIC, VERSION, len(index), index_offset, meta_offset, len(meta)
+                )
+            )
+
+        self._tmpfile.close()
+
+
+class TileArchive(object):
+    """
+    Read tiles from a single file tile archive.
+
+    Tiles are returned as memoryviews of the memory mapped archive, without
+    copying.  These must be released (or no longer referenced) before the archive
+    is closed; use bytes() to keep a copy of a tile.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : path to archive file
+        """
+
+        self._file = open(filename, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, index_offset, meta_offset, meta_length = HEADER.unpack(
+            self._mmap[: HEADER.size]
+        )
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a tile archive: {}".format(filename))
+
+        self._buffer = memoryview(self._mmap)
+        self._index = np.frombuffer(
+            self._buffer, dtype=INDEX_DTYPE, count=count, offset=index_offset
+        )
+        self.meta = json.loads(
+            bytes(self._buffer[meta_offset : meta_offset + meta_length]).decode("utf-8")
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def read_tile(self, z, x, y):
+        """Read a tile from the archive.
+
+        Parameters
+        ----------
+        z : int
+            zoom level
+        x : int
+            tile column
+        y : int
+            tile row (XYZ scheme)
+
+        Returns
+        -------
+        memoryview of tile data, or None if the tile is not present
+        """
+
+        if z > MAX_ZOOM:
+            return None
+
+        tile_id = get_tile_ids(z, x, y)
+        i = np.searchsorted(self._index["tile_id"], tile_id)
+        if i == len(self._index) or self._index["tile_id"][i] != tile_id:
+            return None
+
+        offset = int(self._index["offset"][i])
+        return self._buffer[offset : offset + int(self._index["length"][i])]
+
+    def list_tiles(self):
+        """List the tiles in the archive, in order of tile id.
+
+        Returns
+        -------
+        list of (z, x, y) tuples (XYZ scheme)
+        """
+
+        return list(zip(*(a.tolist() for a in get_tiles(self._index["tile_id"]))))
+
+    def close(self):
+        """Close the archive."""
+
+        if hasattr(self, "_index"):
+            del self._index
+            self._buffer.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def tif_to_archive(
+    infilename,
+    outfilename,
+    min_zoom,
+    max_zoom,
+    tile_size=256,
+    metadata=None,
+    tile_renderer=to_smallest_png,
+    overview_resampling=None,
+    metrics=None,
+    prune=None,
+):
+    """Convert a tif to a single file tile archive, rendering each tile using
+    tile_renderer.
+
+    Identical tiles are stored once, so prune="duplicate" adds little to the size
+    of the archive.
+
+    Parameters
+    ----------
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
+    outfilename : path to output archive file
+    min_zoom : int
+    max_zoom : int or None
+        if None, it is calculated from the resolution of infilename
+    tile_size : int, optional (default: 256)
+    metadata : dict, optional
+        metadata dictionary to add to the archive metadata
+    tile_renderer : function, optional (default: to_smallest_png)
+        function that takes as input the data array for the tile and returns a PNG,
+        or None to not write the tile.
+    overview_resampling : str, optional (default: None)
+        one of "nearest", "mode".  If provided and infilename does not have
+        overviews, overviews are built using this resampling method in a temporary
+        copy of infilename, which is used to create tiles.
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of each stage of reading and writing tiles, and counts
+        of tiles read, skipped, and written and bytes written
+    prune : str, optional (default: None)
+        one of "overzoom", "duplicate".  See datatiles.mbtiles.tif_to_mbtiles.
+    """
+
+    if prune not in (None, "overzoom", "duplicate"):
+        raise ValueError("prune must be one of: overzoom, duplicate")
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    with overviews_source(infilename, overview_resampling, metrics) as infilename:
+        with open_source(infilename) as src:
+            if max_zoom is None:
+                max_zoom = get_default_max_zoom(src)
+
+            if max_zoom > MAX_ZOOM:
+                raise ValueError("max_zoom must be <= {}".format(MAX_ZOOM))
+
+            with TileArchiveWriter(outfilename) as archive:
+                meta = {
+                    "tilejson": "2.0.0",
+                    "version": "1.0.0",
+                    "minzoom": min_zoom,
+                    "maxzoom": max_zoom,
+                }
+                meta.update(get_mbtiles_meta(src, min_zoom))
+                if metadata is not None:
+                    meta.update(metadata)
+                archive.meta = meta
+
+                bounds = get_geo_bounds(src)
+
+                # tiles whose descendants were not read
+                pruned = set()
+
+                for tile, data, transform in read_tiles(
+                    src,
+                    min_zoom=min_zoom,
+                    max_zoom=max_zoom,
+                    tile_size=tile_size,
+                    metrics=metrics,
+                    prune=prune is not None,
+                    reuse_buffers=True,
+                    pruned=pruned,
+                ):
+                    # Only write out non-empty tiles
+                    with metrics.timer("empty"):
+                        empty = np.all(data == src.nodata)
+
+                    if empty:
+                        metrics.count("skipped")
+                        continue
+
+                    with metrics.timer("render"):
+                        png = tile_renderer(data)
+
+                    # the renderer returns None for tiles that are not written
+                    if png is None:
+                        metrics.count("skipped")
+                        continue
+
+                    tiles = [tile]
+                    if prune == "duplicate" and tile in pruned:
+                        # descendants were not read; they have the same data
+                        tiles.extend(get_descendants(tile, max_zoom, bounds))
+
+                    with metrics.timer("write"):
+                        for t in tiles:
+                            archive.write_tile(t.z, t.x, t.y, png)
+
+                    metrics.count("written", len(tiles))
+                    metrics.count("bytes", len(png) * len(tiles))
@@ -0,0 +1,224 @@
+"""Run many encoding and tiling jobs on one shared pool of processes"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import multiprocessing
+import os
+
+from datatiles.encoding import encode_tifs
+from datatiles.mbtiles import render_tif_to_mbtiles, tif_to_mbtiles
+from datatiles.metrics import TimingMetrics
+from datatiles.png import to_smallest_png
+from datatiles.webp import to_smallest_webp
+
+
+JOB_TYPES = ("encode", "tiles", "render")
+
+TILE_RENDERERS = {"png": to_smallest_png, "webp": to_smallest_webp}
+
+
+def read_manifest(manifest):
+    """Read and validate a manifest of jobs.
+
+    Each job is a dict with a unique "id" and a "type", which is one of:
+    "encode": encode the "sources" to the "encoded" tif using encode_tifs, and
+        if "mbtiles" is provided, create data tiles from it at "min_zoom" to
+        "max_zoom" using tif_to_mbtiles, with the encoding stored in the
+        metadata.
+    "tiles": create data tiles from the "source" tif to "mbtiles" at "min_zoom"
+        to "max_zoom" using tif_to_mbtiles.
+    "render": render the "source" tif to "mbtiles" according to the "colormap"
+        at "min_zoom" to "max_zoom" using render_tif_to_mbtiles.
+
+    "min_zoom" defaults to 0 and "max_zoom" to None, which is calculated from the
+    extent of the source.  Data tiles are written as PNG, or lossless WebP if
+    "format" is "webp".  "metadata" is added to the mbtiles metadata.
+
+    Parameters
+    ----------
+    manifest : list of job dicts, or path to JSON file containing them
+
+    Returns
+    -------
+    list of job dicts
+    """
+
+    if isinstance(manifest, str):
+        with open(manifest) as infile:
+            manifest = json.load(infile)
+
+    ids = set()
+    jobs = []
+    for job in manifest:
+        job = dict(job)
+        id = job.get("id")
+        if id is None or id in ids:
+            raise ValueError("each job must have a unique id: {}".format(id))
+        ids.add(id)
+
+        job_type = job.get("type")
+        if job_type not in JOB_TYPES:
+            raise ValueError(
+                "job type must be one of: {}: {}".format(", ".join(JOB_TYPES), id)
+            )
+
+        required = {
+            "encode": ("sources", "encoded"),
+            "tiles": ("source", "mbtiles"),
+            "render": ("source", "mbtiles", "colormap"),
+        }[job_type]
+        missing = [key for key in required if key not in job]
+        if missing:
+            raise ValueError("job {} is missing: {}".format(id, ", ".join(missing)))
+
+        if job.get("format", "png") not in TILE_RENDERERS:
+            raise ValueError(
+                "format must be one of: {}: {}".format(", ".join(TILE_RENDERERS), id)
+            )
+
+        if "colormap" in job:
+            # keys of JSON objects are always strings
+            job["colormap"] = {
+                (json.loads(value) if isinstance(value, str) else value): color
+                for value, color in job["colormap"].items()
+            }
+
+        jobs.append(job)
+
+    return jobs
+
+
+def _tile_job(args):
+    """Create the tiles of a job.
+
+    Called in a separate process.
+
+    Returns
+    -------
+    datatiles.metrics.TimingMetrics
+    """
+
+    job, infilename, encoding = args
+    metrics = TimingMetrics()
+
+    if job["type"] == "render":
+        render_tif_to_mbtiles(
+            infilename,
+            job["mbtiles"],
+            job["colormap"],
+            job.get("min_zoom", 0),
+            job.get("max_zoom"),
+            metadata=job.get("metadata"),
+            metrics=metrics,
+        )
+
+    else:
+        tif_to_mbtiles(
+            infilename,
+            job["mbtiles"],
+            job.get("min_zoom", 0),
+            job.get("max_zoom"),
+            metadata=job.get("metadata"),
+            tile_renderer=TILE_RENDERERS[job.get("format", "png")],
+            encoding=encoding,
+            metrics=metrics,
+        )
+
+    return metrics
+
+
+def _run_job(job, executor, processes, progress):
+    """Run the stages of a job, submitting their work to executor.
+
+    Called in a separate thread for each job.
+    """
+
+    result = {"outputs": [], "encoding": None, "metrics": {}, "error": None}
+
+    try:
+        infilename = job.get("source")
+        if job["type"] == "encode":
+            progress(job["id"], "encode")
+            metrics = TimingMetrics()
+            result["encoding"] = encode_tifs(
+                job["sources"],
+                job["encoded"],
+                metrics=metrics,
+                processes=processes,
+                executor=executor,
+            )
+            result["metrics"]["encode"] = metrics
+            result["outputs"].append(job["encoded"])
+            infilename = job["encoded"]
+
+        if "mbtiles" in job:
+            progress(job["id"], "tiles")
+            result["metrics"]["tiles"] = executor.submit(
+                _tile_job, (job, infilename, result["encoding"])
+            ).result()
+            result["outputs"].append(job["mbtiles"])
+
+        progress(job["id"], "done")
+
+    except Exception as e:
+        result["error"] = e
+        progress(job["id"], "failed")
+
+    return result
+
+
+def _print_progress(id, stage):
+    print("{}: {}".format(id, stage))
+
+
+def run_batch(manifest, processes=None, max_jobs=None, progress=_print_progress):
+    """Run a manifest of encoding and tiling jobs, with the work of all jobs
+    submitted to one shared pool of processes.
+
+    Jobs are run concurrently, so that the pool is kept busy while each job is
+    in stages that are not parallel, such as writing the encoded tif or
+    creating the tiles of a raster, which is done in a single process for
+    each job.  Encoded windows from encode_tifs are computed in the same pool.
+
+    A job that fails does not stop the other jobs; its error is included in
+    the results.
+
+    Parameters
+    ----------
+    manifest : list of job dicts, or path to JSON file containing them;
+        see read_manifest
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+    max_jobs : int, optional (default: None)
+        maximum number of jobs to run at once.  If None, the number of processes
+        is used.
+    progress : function, optional (default: prints progress)
+        called with the job id and stage ("encode", "tiles", "done", or "failed")
+        as each job starts a stage
+
+    Returns
+    -------
+    dict of {<job id>: {"outputs": [<filename>, ...], "encoding": <encoding
+    metadata or None>, "metrics": {<stage>: TimingMetrics, ...},
+    "error": <exception or None>}, ...}
+    """
+
+    jobs = read_manifest(manifest)
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    if max_jobs is None:
+        max_jobs = processes
+
+    # worker processes are started by a new interpreter rather than forked, as
+    # forking while the threads of other jobs are running is not safe
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor, ThreadPoolExecutor(max_workers=max_jobs) as jobs_executor:
+        futures = [
+            jobs_executor.submit(_run_job, job, executor, processes, progress)
+            for job in jobs
+        ]
+
+        return {job["id"]: future.result() for job, future in zip(jobs, futures)}
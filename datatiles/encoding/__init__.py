@@ -1,31 +1,207 @@
-
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, nullcontext
+import os
+from tempfile import TemporaryDirectory
 
 import numpy as np
 import rasterio
-from rasterio.windows import get_data_window, union, transform as transform_window
+from rasterio.io import MemoryFile
+from rasterio.windows import (
+    Window,
+    get_data_window,
+    union,
+    transform as transform_window,
+)
 
 from datatiles.encoding.exponential import (
     ExponentialDecoder,
     ExponentialEncoder,
     encode as exponential_encode,
 )
-from datatiles.raster import has_matching_attributes, unique_to_indexed
-from datatiles.utils import get_dtype, get_nodata_value
+from datatiles.metrics import NULL_METRICS, get_peak_memory
+from datatiles.raster import (
+    build_overviews,
+    has_matching_attributes,
+)
+from datatiles.utils import get_dtype, get_nodata_value, map_ordered
+
+
+def _read_unique(args):
+    """Read the unique values within a window of a source.
+
+    Called in a separate process.
+    """
+
+    filename, window = args
+    with rasterio.open(filename) as src:
+        return np.unique(src.read(1, window=window, masked=True).compressed())
+
+
+def _read_range(args):
+    """Read the minimum and maximum values within a window of a source.
+
+    Called in a separate process.
+    """
+
+    filename, window = args
+    with rasterio.open(filename) as src:
+        data = src.read(1, window=window, masked=True).compressed()
+
+    if not data.size:
+        return None
+
+    return data.min(), data.max()
+
+
+def get_bin_edges(bins, ranges=None):
+    """Get the edges of bins used to quantize a continuous layer.
+
+    Parameters
+    ----------
+    bins : int or list-like of increasing bin edges
+        if an int, the range of values is divided into this many bins of equal width
+    ranges : list of (min, max) tuples, or None where windows have no data
+        minimum and maximum values within each window of the source.  Only used
+        if bins is an int.
+
+    Returns
+    -------
+    numpy array of bin edges, one more than the number of bins
+    """
+
+    if isinstance(bins, (int, np.integer)):
+        if bins < 1:
+            raise ValueError("Number of bins must be at least 1")
+
+        ranges = [r for r in ranges or [] if r is not None]
+        if not ranges:
+            raise ValueError("Cannot calculate bins for a source with no data")
+
+        mins, maxs = zip(*ranges)
+        return np.linspace(min(mins), max(maxs), bins + 1)
+
+    edges = np.asarray(bins)
+    if edges.size < 2 or np.any(np.diff(edges) <= 0):
+        raise ValueError("Bin edges must be at least 2 increasing values")
+
+    return edges
+
+
+def _encode_window(args):
+    """Read a window from each source, convert the values to their index within
+    the unique values or bins of that source, and encode them.
+
+    If scratch is provided, the encoded values are written in place into the
+    window of the memory-mapped scratch file and None is returned.
+
+    Called in a separate process.
+    """
+
+    filenames, window, tables, base, target_dtype, nodata, scratch = args
+
+    shape = (int(window.height), int(window.width))
+    if scratch is None:
+        out = np.empty(shape, dtype=target_dtype)
+    else:
+        filename, scratch_shape = scratch
+        memmap = np.memmap(filename, dtype=target_dtype, mode="r+", shape=scratch_shape)
+        out = memmap[window.toslices()]
+
+    layer_nodata = base - 1
+    encoder = ExponentialEncoder(base=base, dtype=target_dtype, out=out)
+    mask = None  # nodata present across all layers
+    for filename, (layer_type, table) in zip(filenames, tables):
+        with rasterio.open(filename) as src:
+            data = src.read(1, window=window, masked=True)
 
+        data_mask = np.ma.getmaskarray(data)
+        if mask is None:
+            mask = data_mask.copy()
+        else:
+            mask &= data_mask
+
+        if layer_type == "quantized":
+            # table is the interior bin edges
+            indexed = np.digitize(data.data, table).astype(target_dtype)
+        else:
+            indexed = np.searchsorted(table, data.data).astype(target_dtype)
+        indexed[data_mask] = layer_nodata
+        del data
+        encoder.add(indexed)
+        del indexed
+
+    out[mask] = nodata
+
+    if scratch is not None:
+        memmap.flush()
+        return None
 
-def encode_tifs(sources, outfilename, encoding="exponential"):
+    return out
+
+
+def encode_tifs(
+    sources,
+    outfilename,
+    encoding="exponential",
+    blocksize=256,
+    compress="deflate",
+    overview_resampling="nearest",
+    metrics=None,
+    processes=None,
+    scratch_dir=None,
+    executor=None,
+):
     """Stack and encode tifs using encoding and write to outfilename.
 
-    TODO: eventually, each source could be of a different type.  Right now, the default type is indexed.
-    
+    The sources are read and encoded one row of blocks at a time in a pool of
+    processes, so that only a few rows of blocks are held in memory at once.
+    The unique values of each source are first determined in the same way.
+
+    The output is written as an internally tiled and compressed GeoTIFF, with
+    internal overviews.  Blocks are written one row of blocks at a time, in order,
+    and compressed using all available CPUs.
+
+    Each source is one of these types:
+    "indexed" (default): each unique value is converted to its index within the
+        sorted unique values of the source.
+    "quantized": each value is converted to the index of the bin that contains it,
+        for continuous data.  "bins" is required, either as a list of increasing
+        bin edges, or the number of bins of equal width between the minimum and
+        maximum values of the source.  Values outside the bin edges are assigned
+        to the first or last bin.  The bin edges are stored in the layer metadata
+        as "bins", and the lower edge of each bin as "values".
+
     Parameters
     ----------
     sources : dictionary of sources:  {"id": {"source": "<path to file>"}, ...}
-        All sources must be single band tifs
-    outfilename : name of output tif
+        or {"id": {"source": "<path to file>", "type": "quantized", "bins": 10}, ...}
+        All sources must be single band tifs on disk, because they are read in
+        separate processes
+    outfilename : name of output tif, or rasterio.io.MemoryFile to write the
+        output in memory, such as to pass to tif_to_mbtiles
     encoding : str, optional (default: "exponential")
-    
+    blocksize : int, optional (default: 256)
+        width and height of internal tiles of output tif, must be a multiple of 16
+    compress : str, optional (default: "deflate")
+        compression method of output tif
+    overview_resampling : str, optional (default: "nearest")
+        resampling method used to build overviews, one of "nearest", "mode"
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of the "validate", "parameters", "encode", "write", and
+        "overviews" stages, the count of "bytes" written, the "base", "dtype",
+        and "nodata" of the encoding, and the "peak_memory" of this process and
+        "peak_memory_workers" of the largest worker process
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+    scratch_dir : str, optional (default: None)
+        if provided, encoded windows are written to a memory-mapped scratch file
+        in this directory instead of being returned from worker processes
+    executor : concurrent.futures.ProcessPoolExecutor, optional (default: None)
+        pool of processes to use, such as one shared with other jobs.  If None,
+        a pool of processes is created.  "peak_memory_workers" is only recorded
+        if None.
+
     Returns
     -------
     dict : encoding metadata
@@ -33,104 +209,207 @@ def encode_tifs(sources, outfilename, encoding="exponential"):
 
     # TODO: validation: every element in sources must have a "source" key
 
-    inputs = {k: rasterio.open(v["source"]) for k, v in sources["sources"].items()}
-    rasters = inputs.values()
+    if overview_resampling not in ("nearest", "mode"):
+        raise ValueError("Overview resampling must be one of: nearest, mode")
 
-    print("Validating rasters...")
+    if encoding != "exponential":
+        raise NotImplementedError("other encoding types not yet supported")
 
-    # All rasters must be single band
-    for src in rasters:
-        if src.count > 1:
-            raise ValueError("Source must be single band: {}".format(src.name))
+    for id, source in sources.items():
+        source_type = source.get("type", "indexed")
+        if source_type == "quantized":
+            if "bins" not in source:
+                raise ValueError(
+                    "bins are required for quantized source: {}".format(id)
+                )
 
-    # All rasters must have matching attributes
-    atts = ("crs", "transform", "width", "height")
-    for att in atts:
-        if not has_matching_attributes(rasters, att):
-            raise ValueError("Sources have different values for {}".format(att))
+        elif source_type != "indexed":
+            raise NotImplementedError(
+                "source type {} not implemented".format(source_type)
+            )
 
-    print("Calculating encoding parameters...")
+    if metrics is None:
+        metrics = NULL_METRICS
 
-    # Figure out the max value for each raster, based on its type
-    # for indexed types, the max value is len(unique_values) - 1
+    filenames = [source["source"] for source in sources.values()]
+    rasters = [rasterio.open(filename) for filename in filenames]
 
-    max_values = []
-    for key, src in inputs:
-        data = src.read(1, masked=True)
+    try:
+        with metrics.timer("validate"):
+            # All rasters must be single band
+            for src in rasters:
+                if src.count > 1:
+                    raise ValueError("Source must be single band: {}".format(src.name))
 
-        if sources[key].get("type", "indexed") == "indexed":
-            # we reserve the last value as nodata for each set of unique values
-            max_value = np.unique(data).compressed().size
+            # All rasters must have matching attributes
+            atts = ("crs", "transform", "width", "height")
+            for att in atts:
+                if not has_matching_attributes(rasters, att):
+                    raise ValueError("Sources have different values for {}".format(att))
 
-        # TODO: generalize to other types
-        else:
-            raise NotImplementedError(
-                "source type {} not implemented".format(sources[key]["type"])
-            )
+        profile = rasters[0].profile.copy()
+
+    finally:
+        for src in rasters:
+            src.close()
 
-        max_values.append(max_value)
+    width = profile["width"]
+    height = profile["height"]
+    windows = [
+        Window(0, row, width, min(blocksize, height - row))
+        for row in range(0, height, blocksize)
+    ]
 
-    if encoding == "exponential":
+    if processes is None:
+        processes = os.cpu_count()
+
+    # limit the number of windows read ahead of those being written
+    max_pending = 2 * processes
+
+    if executor is None:
+        pool = ProcessPoolExecutor(max_workers=processes)
+    else:
+        pool = nullcontext(executor)
+
+    with pool as executor:
+        # Figure out the max value for each raster, based on its type
+        # for indexed types, the max value is len(unique_values) - 1
+        # for quantized types, the max value is the number of bins - 1
+
+        with metrics.timer("parameters"):
+            window_results = {}
+            for id, source in sources.items():
+                if source.get("type", "indexed") == "indexed":
+                    read_window = _read_unique
+                elif isinstance(source["bins"], (int, np.integer)):
+                    read_window = _read_range
+                else:
+                    continue
+
+                window_results[id] = [
+                    executor.submit(read_window, (source["source"], window))
+                    for window in windows
+                ]
+
+            tables = []
+            layers = []
+            for id, source in sources.items():
+                results = [future.result() for future in window_results.get(id, [])]
+
+                if source.get("type", "indexed") == "indexed":
+                    unique = np.unique(np.concatenate(results))
+                    tables.append(("indexed", unique))
+                    layers.append(
+                        {
+                            "id": id,
+                            "nodata": None,
+                            "type": "indexed",
+                            "values": unique.tolist(),
+                        }
+                    )
+
+                else:
+                    edges = get_bin_edges(source["bins"], results)
+                    tables.append(("quantized", edges[1:-1]))
+                    # each bin is represented by its lower edge
+                    layers.append(
+                        {
+                            "id": id,
+                            "nodata": None,
+                            "type": "quantized",
+                            "bins": edges.tolist(),
+                            "values": edges[:-1].tolist(),
+                        }
+                    )
+
+            # we reserve the last value as nodata for each set of values
+            max_values = [len(layer["values"]) for layer in layers]
 
         # add 1 to this to save spot for NODATA, which will be max value per slot
         base = max(max_values) + 1
-        print("base", base)
 
-        max_encoded_value = exponential_encode(max_values) + 1
+        # the largest encoded value is where every layer is nodata (base - 1)
+        max_encoded_value = base ** len(layers) - 1
         target_dtype = get_dtype(max_encoded_value)
         nodata = get_nodata_value(max_encoded_value)
         layer_nodata = base - 1
-        print("target dtype", target_dtype, "nodata", nodata)
+        metrics.record("base", base)
+        metrics.record("dtype", target_dtype)
+        metrics.record("nodata", nodata)
+
+        for layer in layers:
+            layer["nodata"] = layer_nodata
 
-        print("Encoding data...")
-        encoder = ExponentialEncoder(base=base, dtype=target_dtype)
-        mask = None  # nodata present across all layers
         encoding = {
             "type": "exponential",
             "base": base,
             "dtype": target_dtype,
             "nodata": nodata,
-            "layers": [],
+            "layers": layers,
         }
-        for i, (id, src) in enumerate(inputs.items()):
-            print("encoding {0}".format(id))
-            data = src.read(1, masked=True)
 
-            if mask is None:
-                mask = data.mask
-            else:
-                mask = mask & data.mask
-
-            # convert to indexed.  TODO: handle other types
-            if sources[key].get("type", "indexed") == "indexed":
-                data, unique = unique_to_indexed(data)
-                data = data.filled(layer_nodata).as_type(target_dtype)
-
-                encoding["layers"].append(
-                    {
-                        "id": id,
-                        "nodata": layer_nodata,
-                        "type": "indexed",
-                        "values": unique.tolist(),
-                    }
+        profile.update(
+            {
+                "driver": "GTiff",
+                "dtype": target_dtype,
+                "nodata": nodata,
+                "tiled": True,
+                "blockxsize": blocksize,
+                "blockysize": blocksize,
+                "compress": compress,
+                "num_threads": "ALL_CPUS",
+            }
+        )
+        # remove striped layout options inherited from the source
+        profile.pop("interleave", None)
+
+        with ExitStack() as stack:
+            scratch = None
+            if scratch_dir is not None:
+                tmpdir = stack.enter_context(TemporaryDirectory(dir=scratch_dir))
+                scratch = (os.path.join(tmpdir, "encoded.dat"), (height, width))
+                memmap = np.memmap(
+                    scratch[0], dtype=target_dtype, mode="w+", shape=scratch[1]
                 )
 
-            # else: already raised as error above
+            encoded_windows = map_ordered(
+                executor,
+                _encode_window,
+                (
+                    (filenames, window, tables, base, target_dtype, nodata, scratch)
+                    for window in windows
+                ),
+                max_pending,
+            )
 
-            encoder.add(data)
+            if isinstance(outfilename, MemoryFile):
+                out = outfilename.open(**profile)
+            else:
+                out = rasterio.open(outfilename, "w", **profile)
 
-        # Apply mask to final encoded data and fill with nodata value
-        encoded = np.ma.MaskedArray(encoder.values, mask).filled(nodata)
+            with out:
+                for window in windows:
+                    with metrics.timer("encode"):
+                        encoded = next(encoded_windows)
+                        if scratch is not None:
+                            encoded = memmap[window.toslices()]
 
-    else:
-        raise NotImplementedError("other encoding types not yet supported")
+                    with metrics.timer("write"):
+                        out.write(encoded, 1, window=window)
 
-    # Write tif of encoded data
-    template_raster = list(rasters.values())[0]
-    profile = template_raster.profile.copy()
-    profile.update({"driver": "GTiff", "dtype": target_dtype, "nodata": nodata})
+                with metrics.timer("overviews"):
+                    build_overviews(out, overview_resampling, blocksize)
 
-    with rasterio.open(outfilename, "w", **profile) as out:
-        out.write(encoded, 1)
+            if scratch is not None:
+                del encoded, memmap
+
+    if isinstance(outfilename, MemoryFile):
+        metrics.count("bytes", outfilename.getbuffer().nbytes)
+    else:
+        metrics.count("bytes", os.path.getsize(outfilename))
+    metrics.record("peak_memory", get_peak_memory())
+    if not isinstance(pool, nullcontext):
+        # worker processes have finished once the pool is shut down
+        metrics.record("peak_memory_workers", get_peak_memory(children=True))
 
     return encoding
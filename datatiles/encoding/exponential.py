@@ -1,6 +1,7 @@
 """Exponential encoding and decoding classes"""
 
-import collections
+from collections.abc import Iterable
+
 import numpy as np
 
 
@@ -22,7 +23,7 @@ def encode(values, base=10):
     int : encoded value
     """
 
-    if not isinstance(values, collections.Iterable):
+    if not isinstance(values, Iterable):
         raise ValueError("values must be an iterable")
 
     if not len(values):
@@ -75,6 +76,32 @@ def decode(encoded, base=10, size=1):
     return values
 
 
+def decode_array(encoded, base=10, size=1):
+    """Decode all values from an array of encoded values at once.
+
+    Unlike ExponentialDecoder, this uses integer division and returns the
+    values in the order they were encoded.
+
+    Parameters
+    ----------
+    encoded : numpy array of encoded values
+    base : int, optional (default: 10)
+        base that was used for encoding.
+    size : int, optional (default: 1)
+        number of values to decode.  Must be equal to the number of values that were encoded.
+
+    Returns
+    -------
+    numpy array of shape (size, ) + encoded.shape
+    """
+
+    encoded = np.asarray(encoded, dtype="int64")
+    factors = np.array([base ** i for i in range(size)], dtype="int64")
+    factors = factors.reshape((size,) + (1,) * encoded.ndim)
+
+    return (encoded // factors) % base
+
+
 class ExponentialEncoder(object):
     """
     Use exponential encoding method to iteratively encode and decode 2D arrays.
@@ -83,7 +110,7 @@ class ExponentialEncoder(object):
     popped off the encoder to decode.
     """
 
-    def __init__(self, dtype="uint32", base=10):
+    def __init__(self, dtype="uint32", base=10, out=None):
         """Initialize the encoder.
 
         To decode, you must provide the encoded and the number of arrays that
@@ -96,11 +123,14 @@ class ExponentialEncoder(object):
         base : int, optional
             base to use for encoding (default 10); base is raised to a value for each array
             added to the encoder.  All values of the array to encode must fit between 0 and base. 
+        out : numpy array, optional (default: None)
+            array of dtype to encode into in place, such as a numpy.memmap.  If None,
+            a new array is allocated when the first array is added.
         """
 
         self._dtype = dtype
         self._base = base
-        self._encoded = None
+        self._encoded = out
         self._index = 0
 
     def add(self, arr):
@@ -120,14 +150,19 @@ class ExponentialEncoder(object):
         # TODO: validate that values are between 0 and slot_size
         # TODO: nodata filling?
 
-        if self._index == 0:
-            self._encoded = arr.copy().astype(self._dtype)
+        if self._index == 0 and self._encoded is None:
+            self._encoded = arr.astype(self._dtype)
 
         else:
             if arr.shape != self._encoded.shape:
                 raise ValueError("all arrays must be the same shape to encode")
 
-            self._encoded += arr * (self._base ** self._index)
+            if self._index == 0:
+                np.copyto(self._encoded, arr, casting="unsafe")
+
+            else:
+                factor = np.array(self._base ** self._index, dtype=self._dtype)
+                self._encoded += arr * factor
 
         self._index += 1
 
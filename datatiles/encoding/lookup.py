@@ -0,0 +1,243 @@
+"""Lookup table decoding of encoded values"""
+
+import numpy as np
+
+from datatiles.encoding.exponential import decode_array
+
+
+# Maximum number of encoded values in a lookup table
+MAX_TABLE_SIZE = 2 ** 24
+
+
+class LookupDecoder(object):
+    """
+    Decode encoded values to layer values using a precomputed lookup table.
+
+    The table has one row per encoded value, and a final row that is used for
+    nodata and for any encoded values not in the table.  Decoding an array is a
+    single gather from the table.
+    """
+
+    def __init__(self, layers, indexes, values, masks, codes=None):
+        """Initialize the decoder from precomputed tables.
+
+        Use LookupDecoder.from_encoding to create the tables from encoding metadata.
+
+        Parameters
+        ----------
+        layers : list of layer ids
+        indexes : numpy array of shape (num codes + 1, num layers)
+            encoded index of each layer for each encoded value
+        values : numpy array of shape (num codes + 1, num layers)
+            original value of each layer for each encoded value
+        masks : numpy bool array of shape (num codes + 1, num layers)
+            True where layer is nodata for that encoded value
+        codes : numpy array, optional (default: None)
+            sorted encoded values represented by each row of the table.  If None,
+            the row number is the encoded value.
+        """
+
+        self.layers = list(layers)
+        self.indexes = indexes
+        self.values = values
+        self.masks = masks
+        self.codes = codes
+
+    @classmethod
+    def from_encoding(cls, encoding, codes=None):
+        """Create the lookup tables from the encoding metadata returned by encode_tifs.
+
+        Parameters
+        ----------
+        encoding : dict
+            encoding metadata
+        codes : list-like, optional (default: None)
+            encoded values actually present in the data.  If None, the table
+            includes all possible encoded values, which may be too large for
+            RGB encodings with large bases.
+
+        Returns
+        -------
+        LookupDecoder
+        """
+
+        if encoding["type"] != "exponential":
+            raise NotImplementedError("other encoding types not yet supported")
+
+        layers = encoding["layers"]
+        base = encoding["base"]
+
+        if codes is None:
+            size = base ** len(layers)
+            if size > MAX_TABLE_SIZE:
+                raise ValueError(
+                    "Lookup table is too large ({} values); codes must be provided".format(
+                        size
+                    )
+                )
+            table_codes = np.arange(size)
+
+        else:
+            codes = np.unique(np.asarray(codes))
+            codes = codes[codes != encoding["nodata"]]
+            table_codes = codes
+
+        indexes = decode_array(table_codes, base=base, size=len(layers)).T
+        # add row for nodata and values not in table
+        indexes = np.append(indexes, [[0] * len(layers)], axis=0)
+
+        masks = np.zeros(indexes.shape, dtype="bool")
+        masks[-1] = True
+        if codes is None and encoding["nodata"] < len(table_codes):
+            masks[encoding["nodata"]] = True
+
+        values = []
+        for i, layer in enumerate(layers):
+            masks[:, i] |= indexes[:, i] == layer["nodata"]
+            layer_values = indexes[:, i]
+
+            if "values" in layer:
+                layer_values = np.asarray(layer["values"])
+                # indexes past the end of values are not valid encoded values
+                masks[:, i] |= indexes[:, i] >= len(layer_values)
+                if len(layer_values):
+                    layer_values = layer_values.take(
+                        np.where(masks[:, i], 0, indexes[:, i])
+                    )
+                else:
+                    layer_values = np.zeros(len(indexes), dtype=layer_values.dtype)
+
+            values.append(layer_values)
+
+        dtype = np.result_type(*[v.dtype for v in values])
+        values = np.stack([v.astype(dtype) for v in values], axis=1)
+
+        index_dtype = "uint8" if base <= 256 else "uint16"
+        return cls(
+            [layer["id"] for layer in layers],
+            indexes.astype(index_dtype),
+            values,
+            masks,
+            codes=codes,
+        )
+
+    def _rows(self, encoded):
+        """Calculate the table row for each encoded value.
+
+        Parameters
+        ----------
+        encoded : numpy array of encoded values
+
+        Returns
+        -------
+        numpy array of row indexes
+        """
+
+        nodata_row = len(self.masks) - 1
+
+        if self.codes is None:
+            # values outside the table are clipped to the nodata row
+            return np.clip(encoded, 0, nodata_row)
+
+        rows = np.searchsorted(self.codes, encoded)
+        found = rows < nodata_row
+        found[found] = self.codes[rows[found]] == encoded[found]
+        rows[~found] = nodata_row
+        return rows
+
+    def decode_indexes(self, encoded):
+        """Decode encoded values to the encoded index of each layer.
+
+        Parameters
+        ----------
+        encoded : numpy array of encoded values
+
+        Returns
+        -------
+        numpy MaskedArray of shape encoded.shape + (num layers, )
+        """
+
+        rows = self._rows(np.asarray(encoded))
+        return np.ma.MaskedArray(self.indexes[rows], mask=self.masks[rows])
+
+    def decode(self, encoded):
+        """Decode encoded values to the original values of each layer.
+
+        Parameters
+        ----------
+        encoded : numpy array of encoded values
+
+        Returns
+        -------
+        dict of {<layer id>: numpy MaskedArray of values}
+        """
+
+        rows = self._rows(np.asarray(encoded))
+        values = self.values[rows]
+        masks = self.masks[rows]
+
+        return {
+            layer: np.ma.MaskedArray(values[..., i], mask=masks[..., i])
+            for i, layer in enumerate(self.layers)
+        }
+
+    def to_dict(self):
+        """Serialize the lookup tables to a JSON-compatible dictionary.
+
+        Tables are stored per layer, with null for nodata.  The final entry of
+        each table is used for nodata and any encoded values not in codes.
+
+        Returns
+        -------
+        dict
+        """
+
+        layers = []
+        for i, layer in enumerate(self.layers):
+            mask = self.masks[:, i]
+            layers.append(
+                {
+                    "id": layer,
+                    "indexes": np.where(mask, None, self.indexes[:, i]).tolist(),
+                    "values": np.where(mask, None, self.values[:, i]).tolist(),
+                }
+            )
+
+        return {
+            "type": "lookup",
+            "codes": None if self.codes is None else self.codes.tolist(),
+            "layers": layers,
+        }
+
+    @classmethod
+    def from_dict(cls, table):
+        """Create a decoder from lookup tables serialized with to_dict.
+
+        Parameters
+        ----------
+        table : dict
+
+        Returns
+        -------
+        LookupDecoder
+        """
+
+        masks = np.array(
+            [[v is None for v in layer["indexes"]] for layer in table["layers"]]
+        ).T
+        indexes = np.array(
+            [[v or 0 for v in layer["indexes"]] for layer in table["layers"]]
+        ).T
+        values = np.array(
+            [[v or 0 for v in layer["values"]] for layer in table["layers"]]
+        ).T
+        codes = table["codes"]
+
+        index_dtype = "uint8" if indexes.max() < 256 else "uint16"
+        return cls(
+            [layer["id"] for layer in table["layers"]],
+            indexes.astype(index_dtype),
+            values,
+            masks,
+            codes=None if codes is None else np.array(codes),
+        )
@@ -0,0 +1,253 @@
+"""Choose the order of layers in an encoding that produces the smallest tiles"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import itertools
+import math
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from datatiles.encoding.exponential import ExponentialEncoder
+from datatiles.png import to_smallest_png
+from datatiles.utils import get_dtype, get_nodata_value
+
+
+def get_orderings(ids, max_orderings=24, seed=0):
+    """Get candidate orderings of layer ids.
+
+    If there are more permutations of ids than max_orderings, a random sample
+    of permutations is returned.  The original order is always included first.
+
+    Parameters
+    ----------
+    ids : list of layer ids
+    max_orderings : int, optional (default: 24)
+    seed : int, optional (default: 0)
+
+    Returns
+    -------
+    list of tuples of layer ids
+    """
+
+    ids = tuple(ids)
+    if math.factorial(len(ids)) <= max_orderings:
+        return list(itertools.permutations(ids))
+
+    rng = np.random.RandomState(seed)
+    orderings = [ids]
+    while len(orderings) < max_orderings:
+        ordering = tuple(ids[i] for i in rng.permutation(len(ids)))
+        if ordering not in orderings:
+            orderings.append(ordering)
+
+    return orderings
+
+
+def sample_windows(sources, window_size=256, samples=16):
+    """Sample windows with data from each of the sources, and convert them to
+    the indexed values used by encode_tifs.
+
+    Each source is read once in full to determine its unique values and which
+    windows contain data.  Windows with data in any source are sampled evenly
+    across the rasters.
+
+    Raises ValueError if none of the sources have any data.
+
+    Parameters
+    ----------
+    sources : dictionary of sources:  {"id": {"source": "<path to file>"}, ...}
+    window_size : int, optional (default: 256)
+        width and height of each sample window
+    samples : int, optional (default: 16)
+        maximum number of windows to sample
+
+    Returns
+    -------
+    tuple of ({<id>: [numpy masked array per window, ...], ...},
+    {<id>: <number of unique values>, ...})
+    """
+
+    uniques = {}
+    has_data = None
+    for id, source in sources.items():
+        if source.get("type", "indexed") != "indexed":
+            raise NotImplementedError(
+                "source type {} not implemented".format(source["type"])
+            )
+
+        with rasterio.open(source["source"]) as src:
+            data = src.read(1, masked=True)
+
+        uniques[id] = np.unique(data).compressed()
+
+        valid_shape = data.shape
+
+        # reduce the data mask to whether or not each window has data
+        valid = ~np.ma.getmaskarray(data)
+        rows = np.arange(0, valid.shape[0], window_size)
+        cols = np.arange(0, valid.shape[1], window_size)
+        valid = np.logical_or.reduceat(
+            np.logical_or.reduceat(valid, rows, axis=0), cols, axis=1
+        )
+        has_data = valid if has_data is None else has_data | valid
+
+    rows, cols = np.nonzero(has_data)
+    indexes = np.unique(
+        np.linspace(0, len(rows) - 1, min(samples, len(rows))).astype("int64")
+    )
+    windows = [
+        Window(
+            cols[i] * window_size, rows[i] * window_size, window_size, window_size
+        ).intersection(Window(0, 0, valid_shape[1], valid_shape[0]))
+        for i in indexes
+    ]
+
+    # each window is read once here and shared by every candidate ordering
+    sampled = {id: [] for id in sources}
+    with ExitStack() as stack:
+        srcs = {
+            id: stack.enter_context(rasterio.open(source["source"]))
+            for id, source in sources.items()
+        }
+
+        for window in windows:
+            window_data = {
+                id: src.read(1, window=window, masked=True) for id, src in srcs.items()
+            }
+            if all(np.ma.getmaskarray(data).all() for data in window_data.values()):
+                continue
+
+            for id, data in window_data.items():
+                # masked values are indexed arbitrarily; they are encoded as nodata
+                indexed = np.searchsorted(uniques[id], data.data)
+                sampled[id].append(
+                    np.ma.MaskedArray(indexed, mask=np.ma.getmaskarray(data))
+                )
+
+    if not any(sampled.values()):
+        raise ValueError("sources do not have any data to sample")
+
+    counts = {id: len(unique) for id, unique in uniques.items()}
+    return sampled, counts
+
+
+def _get_tile_bytes(args):
+    """Encode the sampled windows of each layer in order and render them.
+
+    Called in a separate process.
+    """
+
+    layers, base, tile_renderer = args
+
+    # same as encode_tifs: the largest encoded value is where every layer is nodata
+    max_encoded_value = base ** len(layers) - 1
+    target_dtype = get_dtype(max_encoded_value)
+    nodata = get_nodata_value(max_encoded_value)
+
+    total = 0
+    for windows in zip(*layers):
+        encoder = ExponentialEncoder(base=base, dtype=target_dtype)
+        mask = None
+        for data in windows:
+            encoder.add(data.filled(base - 1).astype(target_dtype))
+            data_mask = np.ma.getmaskarray(data)
+            mask = data_mask if mask is None else mask & data_mask
+
+        encoded = np.ma.MaskedArray(encoder.values, mask).filled(nodata)
+        total += len(tile_renderer(encoded))
+
+    return total
+
+
+def tune_encoding(
+    sources,
+    encodings=("exponential",),
+    window_size=256,
+    samples=16,
+    max_orderings=24,
+    tile_renderer=to_smallest_png,
+    processes=None,
+):
+    """Rank orderings of layers and encodings by the total size of sample tiles.
+
+    The order of layers determines which layer varies fastest in the encoded
+    values, which affects how well tiles compress.  Sample windows of the sources
+    are encoded in each candidate order and rendered using tile_renderer.
+
+    Parameters
+    ----------
+    sources : dictionary of sources:  {"id": {"source": "<path to file>"}, ...}
+        as passed to encode_tifs
+    encodings : list of str, optional (default: ("exponential", ))
+        candidate encodings
+    window_size : int, optional (default: 256)
+        width and height of each sample window
+    samples : int, optional (default: 16)
+        maximum number of windows to sample
+    max_orderings : int, optional (default: 24)
+        maximum number of orderings of layers to try
+    tile_renderer : function, optional (default: to_smallest_png)
+        function that takes as input the data array for the tile and returns a PNG.
+        Must be picklable.
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+
+    Returns
+    -------
+    list of dicts of {"encoding": <encoding>, "order": [<id>, ...], "bytes": <bytes>},
+    sorted from smallest to largest bytes
+    """
+
+    for encoding in encodings:
+        if encoding != "exponential":
+            raise NotImplementedError("other encoding types not yet supported")
+
+    sampled, counts = sample_windows(sources, window_size=window_size, samples=samples)
+    # we reserve the last value as nodata for each set of values
+    base = max(counts.values()) + 1
+
+    candidates = [
+        (encoding, order)
+        for encoding in encodings
+        for order in get_orderings(list(sources), max_orderings)
+    ]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        sizes = executor.map(
+            _get_tile_bytes,
+            [
+                (
+                    [sampled[id] for id in order],
+                    base,
+                    tile_renderer,
+                )
+                for _, order in candidates
+            ],
+        )
+
+        results = [
+            {"encoding": encoding, "order": list(order), "bytes": size}
+            for (encoding, order), size in zip(candidates, sizes)
+        ]
+
+    # stable sort keeps the original order first among ties
+    return sorted(results, key=lambda result: result["bytes"])
+
+
+def apply_tuning(sources, result):
+    """Reorder sources according to a result from tune_encoding.
+
+    Parameters
+    ----------
+    sources : dictionary of sources:  {"id": {"source": "<path to file>"}, ...}
+    result : dict
+        result returned by tune_encoding
+
+    Returns
+    -------
+    tuple of (dictionary of sources in tuned order, encoding) to pass to encode_tifs
+    """
+
+    return {id: sources[id] for id in result["order"]}, result["encoding"]
@@ -0,0 +1,200 @@
+"""Estimate the number of tiles, output size, and runtime of creating tiles"""
+
+import math
+from time import perf_counter
+
+import mercantile
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
+
+from datatiles.png import to_smallest_png
+from datatiles.raster import (
+    WEB_MERCATOR_CIRCUMFERENCE,
+    get_default_max_zoom,
+    get_geo_bounds,
+    get_overview_levels,
+    open_source,
+)
+from datatiles.tiles import get_tile_range, open_tile_vrt, read_tile
+
+
+def read_footprint(src, footprint_size=1024):
+    """Read a coarse resolution mask of the data in src, in Web Mercator.
+
+    Parameters
+    ----------
+    src : rasterio.DatasetReader
+    footprint_size : int, optional (default 1024)
+        maximum width or height of the mask
+
+    Returns
+    -------
+    tuple of (numpy bool array, True where there are data; affine.Affine transform)
+    """
+
+    transform, width, height = calculate_default_transform(
+        src.crs, "EPSG:3857", src.width, src.height, *src.bounds
+    )
+    scale = max(width, height) / float(footprint_size)
+    if scale > 1:
+        width = int(math.ceil(width / scale))
+        height = int(math.ceil(height / scale))
+        transform = transform * transform.scale(scale, scale)
+
+    with WarpedVRT(
+        src,
+        crs="EPSG:3857",
+        transform=transform,
+        width=width,
+        height=height,
+        nodata=src.nodata,
+        resampling=Resampling.nearest,
+    ) as vrt:
+        mask = vrt.read_masks(1) > 0
+
+    return mask, transform
+
+
+def get_footprint_tiles(mask, transform, zoom):
+    """Determine the tiles at zoom that have data according to the footprint mask.
+
+    If the footprint pixels are smaller than tiles, the tiles that contain the center
+    of a pixel with data are returned.  Otherwise, one tile within each pixel with
+    data is returned, and the number of tiles is estimated from the area of
+    those pixels.
+
+    Parameters
+    ----------
+    mask : numpy bool array
+        True where there are data, returned by read_footprint
+    transform : affine.Affine
+        transform of mask
+    zoom : int
+
+    Returns
+    -------
+    tuple of (tile x, tile y arrays, sorted by x then y; estimated number of tiles)
+    """
+
+    tile_meters = WEB_MERCATOR_CIRCUMFERENCE / math.pow(2, zoom)
+    num_tiles = int(math.pow(2, zoom))
+    origin = WEB_MERCATOR_CIRCUMFERENCE / 2
+
+    rows, cols = np.nonzero(mask)
+    x, y = transform * (cols + 0.5, rows + 0.5)
+    tile_x = np.clip(((x + origin) // tile_meters).astype("int64"), 0, num_tiles - 1)
+    tile_y = np.clip(((origin - y) // tile_meters).astype("int64"), 0, num_tiles - 1)
+
+    keys = np.unique(tile_x * num_tiles + tile_y)
+    pixel_area = abs(transform.a * transform.e)
+    count = len(keys)
+    if pixel_area > tile_meters ** 2:
+        count = int(round(len(rows) * pixel_area / tile_meters ** 2))
+
+    return keys // num_tiles, keys % num_tiles, count
+
+
+def estimate_tiles(
+    infilename,
+    min_zoom,
+    max_zoom,
+    tile_size=256,
+    tile_renderer=to_smallest_png,
+    samples=20,
+    footprint_size=1024,
+):
+    """Estimate the number of tiles, output size, and runtime of creating tiles
+    from infilename, without creating them.
+
+    The number of non-empty tiles at each zoom is estimated from a coarse resolution
+    footprint of the data.  A sample of non-empty tiles spread evenly across the
+    footprint is read and rendered at each zoom, and the size and time to read
+    and render are extrapolated to all tiles.  Time to write tiles is not included.
+
+    Parameters
+    ----------
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
+    min_zoom : int
+    max_zoom : int or None
+        if None, it is calculated from the resolution of infilename
+    tile_size : int, optional (default: 256)
+    tile_renderer : function, optional (default: to_smallest_png)
+        function that takes as input the data array for the tile and returns a PNG
+    samples : int, optional (default: 20)
+        maximum number of tiles to sample at each zoom
+    footprint_size : int, optional (default: 1024)
+        maximum width or height of the footprint of the data
+
+    Returns
+    -------
+    dict of {"tiles": <total tiles read>, "nonempty": <tiles written>, "bytes": <bytes>,
+    "seconds": <seconds>, "zooms": {<zoom>: {...}, ...}}
+    """
+
+    results = {"tiles": 0, "nonempty": 0, "bytes": 0, "seconds": 0, "zooms": {}}
+
+    with open_source(infilename) as src:
+        if max_zoom is None:
+            max_zoom = get_default_max_zoom(src)
+
+        zooms = range(min_zoom, max_zoom + 1)
+        bounds = get_geo_bounds(src)
+
+        overview_levels = {zoom: None for zoom in zooms}
+        if src.overviews(1):
+            overview_levels = get_overview_levels(src, zooms, tile_size)
+
+        mask, transform = read_footprint(src, footprint_size)
+
+        for zoom in zooms:
+            ul, lr = get_tile_range(bounds, zoom)
+            num_tiles = (lr.x - ul.x + 1) * (lr.y - ul.y + 1)
+
+            tile_x, tile_y, nonempty = get_footprint_tiles(mask, transform, zoom)
+            nonempty = min(nonempty, num_tiles)
+
+            # sample evenly across the footprint
+            indexes = np.unique(
+                np.linspace(0, len(tile_x) - 1, min(samples, len(tile_x))).astype(
+                    "int64"
+                )
+            )
+
+            read_seconds = []
+            render_seconds = []
+            sizes = []
+            with open_tile_vrt(src, overview_levels[zoom], tile_size) as vrt:
+                for i in indexes:
+                    tile = mercantile.Tile(int(tile_x[i]), int(tile_y[i]), zoom)
+
+                    start = perf_counter()
+                    data, _ = read_tile(vrt, tile, tile_size)
+                    read_seconds.append(perf_counter() - start)
+
+                    if np.all(data == src.nodata):
+                        continue
+
+                    start = perf_counter()
+                    sizes.append(len(tile_renderer(data)))
+                    render_seconds.append(perf_counter() - start)
+
+            # all tiles in the extent are read, only non-empty tiles are rendered
+            seconds = num_tiles * (np.mean(read_seconds) if read_seconds else 0)
+            if sizes:
+                seconds += nonempty * np.mean(render_seconds)
+
+            zoom_results = {
+                "tiles": num_tiles,
+                "nonempty": nonempty,
+                "sampled": len(indexes),
+                "bytes": int(round(nonempty * np.mean(sizes))) if sizes else 0,
+                "seconds": float(seconds),
+            }
+            results["zooms"][zoom] = zoom_results
+            for key in ("tiles", "nonempty", "bytes", "seconds"):
+                results[key] += zoom_results[key]
+
+    return results
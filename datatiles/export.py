@@ -0,0 +1,302 @@
+"""Export layers of encoded data tiles back to GeoTIFFs"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import json
+import math
+import os
+import sqlite3
+
+from affine import Affine
+import numpy as np
+from pymbtiles import MBtiles
+import rasterio
+from rasterio.dtypes import get_minimum_dtype
+from rasterio.windows import Window
+
+from datatiles.metrics import NULL_METRICS, get_peak_memory
+from datatiles.raster import WEB_MERCATOR_CIRCUMFERENCE
+from datatiles.utils import map_ordered
+from datatiles.webp import decode_tile
+
+
+def get_layer_values(layer, base):
+    """Create a lookup table from the encoded index of a layer to its value.
+
+    Integer values are stored in the smallest data type that can also hold
+    a nodata value one greater than the maximum value.  Other values, such
+    as the lower edges of bins of quantized layers, are stored as float64 with
+    a nodata value of NaN, so that they are exported exactly as they are stored
+    in the encoding metadata.
+
+    Parameters
+    ----------
+    layer : dict
+        layer from the encoding metadata returned by encode_tifs
+    base : int
+        base of the encoding
+
+    Returns
+    -------
+    tuple of (numpy array of values for each encoded index, with nodata for
+    layer nodata and unused indexes; nodata value)
+    """
+
+    values = np.asarray(layer.get("values", range(layer["nodata"])))
+
+    if values.dtype.kind in "iub":
+        nodata = int(values.max()) + 1 if len(values) else 0
+        dtype = get_minimum_dtype(values.tolist() + [nodata])
+    else:
+        nodata = np.nan
+        dtype = "float64"
+
+    lookup = np.full(base, nodata, dtype=dtype)
+    lookup[: len(values)] = values
+    lookup[layer["nodata"]] = nodata
+
+    return lookup, nodata
+
+
+def _decode_window(args):
+    """Read and decode the tiles within a window of tiles into an array for
+    each layer.
+
+    Called in a separate process.
+
+    Returns
+    -------
+    tuple of (list of numpy arrays, one per exported layer, or None if there are
+    no tiles in the window; number of tiles read)
+    """
+
+    filename, zoom, window, tile_size, encoding, lookups = args
+    x0, y0, cols, rows = window
+    dtype = encoding["dtype"]
+    base = encoding["base"]
+
+    # tile rows are stored in the TMS scheme
+    tms_y0 = 2 ** zoom - (y0 + rows)
+
+    # pymbtiles does not support reading a range of tiles
+    with closing(sqlite3.connect("file:{0}?mode=ro".format(filename), uri=True)) as db:
+        tiles = db.execute(
+            "SELECT tile_column, tile_row, tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? "
+            "AND tile_row BETWEEN ? AND ?",
+            (zoom, x0, x0 + cols - 1, tms_y0, tms_y0 + rows - 1),
+        ).fetchall()
+
+    if not tiles:
+        return None, 0
+
+    encoded = np.full(
+        (rows * tile_size, cols * tile_size), encoding["nodata"], dtype="int64"
+    )
+    for x, tms_y, data in tiles:
+        col = (x - x0) * tile_size
+        row = (2 ** zoom - 1 - tms_y - y0) * tile_size
+        encoded[row : row + tile_size, col : col + tile_size] = decode_tile(
+            bytes(data), dtype
+        )
+
+    nodata_mask = encoded == encoding["nodata"]
+    layers = []
+    for i, lookup, nodata in lookups:
+        values = lookup[(encoded // base ** i) % base]
+        values[nodata_mask] = nodata
+        layers.append(values)
+
+    return layers, len(tiles)
+
+
+def export_layers(
+    infilename,
+    outdir,
+    zoom=None,
+    layers=None,
+    encoding=None,
+    processes=None,
+    window_tiles=8,
+    blocksize=256,
+    compress="deflate",
+    metrics=None,
+):
+    """Decode the layers of an mbtiles file of encoded data tiles back to their
+    values, and write each layer to a GeoTIFF in Web Mercator.
+
+    The tiles at zoom are read and decoded in windows of tiles in a pool of
+    processes, and each window is written to all layers before the next is
+    decoded, so that only a few windows are held in memory at once regardless
+    of the extent of the tiles.  Windows without any tiles are not written.
+
+    Pixels that are outside the tiles, or are nodata in the tiles or layer,
+    are set to the nodata value of each layer; see get_layer_values.
+
+    Parameters
+    ----------
+    infilename : path to input mbtiles file of tiles created from encode_tifs output
+    outdir : path to output directory, layers are written to <outdir>/<id>.tif
+    zoom : int, optional (default: None)
+        zoom level of tiles to export.  If None, the maximum zoom is used.
+    layers : list of str, optional (default: None)
+        ids of layers to export.  If None, all layers are exported.
+    encoding : dict, optional (default: None)
+        encoding metadata returned by encode_tifs.  If None, it is read from
+        the JSON "encoding" entry in the mbtiles metadata.
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+    window_tiles : int, optional (default: 8)
+        width and height of windows in tiles
+    blocksize : int, optional (default: 256)
+        width and height of internal tiles of output tifs, must be a multiple of 16
+    compress : str, optional (default: "deflate")
+        compression method of output tifs
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of the "decode" and "write" stages, the count of
+        "tiles" read, and the "peak_memory" of this process and
+        "peak_memory_workers" of the largest worker process
+
+    Returns
+    -------
+    dict of {<layer id>: <output filename>, ...}
+    """
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    with MBtiles(infilename, mode="r") as src:
+        if encoding is None:
+            if "encoding" not in src.meta:
+                raise ValueError(
+                    "encoding must be provided if not present in mbtiles metadata"
+                )
+
+            encoding = json.loads(src.meta["encoding"])
+
+        if encoding["type"] != "exponential":
+            raise NotImplementedError("other encoding types not yet supported")
+
+        if zoom is None:
+            zoom = src.zoom_range()[1]
+
+        min_x, max_x = src.col_range(zoom)
+        if min_x is None:
+            raise ValueError("mbtiles does not contain tiles at zoom {}".format(zoom))
+
+        min_tms_y, max_tms_y = src.row_range(zoom)
+
+    # pymbtiles does not expose the data of an arbitrary tile
+    with closing(
+        sqlite3.connect("file:{0}?mode=ro".format(infilename), uri=True)
+    ) as db:
+        data = db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? LIMIT 1", (zoom,)
+        ).fetchone()[0]
+        tile_size = decode_tile(bytes(data), encoding["dtype"]).shape[0]
+
+    layer_ids = [layer["id"] for layer in encoding["layers"]]
+    if layers is None:
+        layers = layer_ids
+
+    for id in layers:
+        if id not in layer_ids:
+            raise ValueError("layer is not present in encoding: {}".format(id))
+
+    # convert TMS rows to XYZ
+    min_y = 2 ** zoom - 1 - max_tms_y
+    max_y = 2 ** zoom - 1 - min_tms_y
+    tile_cols = max_x - min_x + 1
+    tile_rows = max_y - min_y + 1
+
+    tile_meters = WEB_MERCATOR_CIRCUMFERENCE / math.pow(2, zoom)
+    res = tile_meters / tile_size
+    origin = WEB_MERCATOR_CIRCUMFERENCE / 2
+    transform = Affine(
+        res, 0, min_x * tile_meters - origin, 0, -res, origin - min_y * tile_meters
+    )
+
+    windows = [
+        (
+            min_x + col,
+            min_y + row,
+            min(window_tiles, tile_cols - col),
+            min(window_tiles, tile_rows - row),
+        )
+        for row in range(0, tile_rows, window_tiles)
+        for col in range(0, tile_cols, window_tiles)
+    ]
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    # limit the number of windows decoded ahead of those being written
+    max_pending = 2 * processes
+
+    outfilenames = {id: os.path.join(outdir, "{}.tif".format(id)) for id in layers}
+    indexes = [layer_ids.index(id) for id in layers]
+    lookups = [
+        (i,) + get_layer_values(encoding["layers"][i], encoding["base"])
+        for i in indexes
+    ]
+
+    outs = []
+    try:
+        for id, (_, lookup, nodata) in zip(layers, lookups):
+            outs.append(
+                rasterio.open(
+                    outfilenames[id],
+                    "w",
+                    driver="GTiff",
+                    width=tile_cols * tile_size,
+                    height=tile_rows * tile_size,
+                    count=1,
+                    dtype=lookup.dtype,
+                    nodata=nodata,
+                    crs="EPSG:3857",
+                    transform=transform,
+                    tiled=True,
+                    blockxsize=blocksize,
+                    blockysize=blocksize,
+                    compress=compress,
+                    sparse_ok=True,
+                )
+            )
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            decoded_windows = map_ordered(
+                executor,
+                _decode_window,
+                (
+                    (infilename, zoom, window, tile_size, encoding, lookups)
+                    for window in windows
+                ),
+                max_pending,
+            )
+
+            for x, y, cols, rows in windows:
+                with metrics.timer("decode"):
+                    decoded, count = next(decoded_windows)
+
+                metrics.count("tiles", count)
+                if decoded is None:
+                    continue
+
+                window = Window(
+                    (x - min_x) * tile_size,
+                    (y - min_y) * tile_size,
+                    cols * tile_size,
+                    rows * tile_size,
+                )
+                with metrics.timer("write"):
+                    for out, values in zip(outs, decoded):
+                        out.write(values, 1, window=window)
+
+    finally:
+        for out in outs:
+            out.close()
+
+    metrics.record("peak_memory", get_peak_memory())
+    metrics.record("peak_memory_workers", get_peak_memory(children=True))
+
+    return outfilenames
@@ -0,0 +1,176 @@
+"""Per-tile layer histograms stored alongside tiles in mbtiles files"""
+
+import json
+import math
+import sqlite3
+
+import mercantile
+import numpy as np
+
+from datatiles.encoding.lookup import LookupDecoder
+from datatiles.raster import WEB_MERCATOR_BOUNDS
+
+
+HISTOGRAM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tile_histograms (
+    zoom_level integer,
+    tile_column integer,
+    tile_row integer,
+    histograms text,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+"""
+
+
+class TileHistograms(object):
+    """
+    Calculate the count of each value of each encoded layer within a tile.
+    """
+
+    def __init__(self, encoding):
+        """Initialize from the encoding metadata returned by encode_tifs.
+
+        Parameters
+        ----------
+        encoding : dict
+            encoding metadata
+        """
+
+        self.encoding = encoding
+        self.layers = encoding["layers"]
+
+        # number of values per layer, excluding nodata
+        self.sizes = [
+            len(layer["values"]) if "values" in layer else layer["nodata"]
+            for layer in self.layers
+        ]
+
+        # 8 bit encodings have few enough encoded values to build a lookup table
+        # of all of them once; otherwise one is built for the values in each tile
+        self._decoder = None
+        if encoding["dtype"] == "uint8":
+            self._decoder = LookupDecoder.from_encoding(encoding)
+
+    def __call__(self, data):
+        """Calculate histograms for a tile of encoded data.
+
+        Parameters
+        ----------
+        data : numpy array of encoded values
+
+        Returns
+        -------
+        list of numpy arrays, one per layer, with the count of each encoded index
+        """
+
+        data = np.asarray(data)
+
+        decoder = self._decoder
+        if decoder is None:
+            decoder = LookupDecoder.from_encoding(self.encoding, codes=np.unique(data))
+
+        indexes = np.moveaxis(decoder.decode_indexes(data), -1, 0)
+
+        return [
+            np.bincount(index.compressed(), minlength=size)[:size]
+            for index, size in zip(indexes, self.sizes)
+        ]
+
+
+def write_histograms(cursor, z, x, y, histograms):
+    """Write histograms for a tile to the tile_histograms table.
+
+    Parameters
+    ----------
+    cursor : sqlite3.Cursor
+        cursor of the open mbtiles file
+    z : int
+        zoom level
+    x : int
+        tile column
+    y : int
+        tile row (TMS scheme)
+    histograms : list of numpy arrays, one per layer
+    """
+
+    cursor.execute(
+        "INSERT OR REPLACE INTO tile_histograms "
+        "(zoom_level, tile_column, tile_row, histograms) values (?, ?, ?, ?)",
+        (z, x, y, json.dumps([h.tolist() for h in histograms])),
+    )
+
+
+def summarize_region(filename, bounds, zoom=None, encoding=None):
+    """Summarize the count of each value of each layer within the extent, by summing
+    the stored histograms of all tiles that intersect the extent.
+
+    Tiles are counted in full, so counts include pixels in tiles that only
+    partially overlap the extent.  Counts are in pixels at the zoom level.
+
+    Parameters
+    ----------
+    filename : path to mbtiles file created by tif_to_mbtiles with histograms
+    bounds : tuple of (west, south, east, north) in geographic coordinates
+    zoom : int, optional (default: None)
+        zoom level to summarize.  If None, the max zoom of the tileset is used.
+    encoding : dict, optional (default: None)
+        encoding metadata returned by encode_tifs.  If None, it is read from
+        the JSON "encoding" entry in the mbtiles metadata.
+
+    Returns
+    -------
+    dict of {<layer id>: {<value>: <count>, ...}, ...}
+    """
+
+    db = sqlite3.connect("file:{0}?mode=ro".format(filename), uri=True)
+    try:
+        cursor = db.cursor()
+        meta = dict(cursor.execute("SELECT name, value from metadata").fetchall())
+
+        if encoding is None:
+            if "encoding" not in meta:
+                raise ValueError(
+                    "encoding must be provided if not present in mbtiles metadata"
+                )
+            encoding = json.loads(meta["encoding"])
+
+        if zoom is None:
+            zoom = int(meta["maxzoom"])
+
+        w, s, e, n = bounds
+        ul = mercantile.tile(
+            max(w, WEB_MERCATOR_BOUNDS[0]), min(n, WEB_MERCATOR_BOUNDS[3]), zoom
+        )
+        lr = mercantile.tile(
+            min(e, WEB_MERCATOR_BOUNDS[2]), max(s, WEB_MERCATOR_BOUNDS[1]), zoom
+        )
+
+        # flip tile Y to match TMS scheme of mbtiles
+        num_tiles = int(math.pow(2, zoom))
+        rows = cursor.execute(
+            "SELECT histograms FROM tile_histograms WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+            (zoom, ul.x, lr.x, num_tiles - lr.y - 1, num_tiles - ul.y - 1),
+        )
+
+        layers = encoding["layers"]
+        totals = None
+        for (histograms,) in rows:
+            histograms = [np.array(h, dtype="int64") for h in json.loads(histograms)]
+            if totals is None:
+                totals = histograms
+            else:
+                totals = [t + h for t, h in zip(totals, histograms)]
+
+    finally:
+        db.close()
+
+    results = {}
+    for i, layer in enumerate(layers):
+        counts = totals[i] if totals is not None else []
+        values = layer.get("values", range(len(counts)))
+        results[layer["id"]] = {
+            value: int(count) for value, count in zip(values, counts) if count
+        }
+
+    return results
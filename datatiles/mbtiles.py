@@ -1,23 +1,53 @@
 
+from contextlib import ExitStack
 from functools import partial
+import json
 import math
-import os
-from tempfile import TemporaryDirectory
-from pymbtiles import MBtiles
+from pymbtiles import MBtiles, Tile
 import rasterio
 import numpy as np
 
+from datatiles.estimate import estimate_tiles
+from datatiles.histograms import HISTOGRAM_SCHEMA, TileHistograms, write_histograms
+from datatiles.metrics import NULL_METRICS, ProgressMetrics
 from datatiles.rgb import hex_to_rgb
 from datatiles.png import to_smallest_png, to_paletted_png
-from datatiles.tiles import read_tiles
+from datatiles.tiles import (
+    get_descendants,
+    get_outputs,
+    get_tile_format,
+    read_tiles,
+    render_tile,
+)
 from datatiles.raster import (
     get_geo_bounds,
     get_mbtiles_meta,
     get_default_max_zoom,
-    to_indexed_tif,
+    open_source,
+    overviews_source,
 )
 
 
+def _get_cursor(mbtiles):
+    """Get the cursor of an open pymbtiles.MBtiles instance.
+
+    pymbtiles does not expose its connection, which is opened with an exclusive
+    lock in write mode, so no other connection can write to the file until it is
+    closed.  This relies on the private cursor of the pymbtiles version pinned in
+    setup.py.
+
+    Parameters
+    ----------
+    mbtiles : pymbtiles.MBtiles
+
+    Returns
+    -------
+    sqlite3.Cursor
+    """
+
+    return mbtiles._cursor
+
+
 def tif_to_mbtiles(
     infilename,
     outfilename,
@@ -26,69 +56,231 @@ def tif_to_mbtiles(
     tile_size=256,
     metadata=None,
     tile_renderer=to_smallest_png,
+    encoding=None,
+    overview_resampling=None,
+    metrics=None,
+    dry_run=False,
+    prune=None,
+    progress=False,
 ):
     """Convert a tif to mbtiles, rendering each tile using tile_renderer.
 
     By default, this renders tiles as data using the smallest PNG image type
     for the data type of infilename.
+
+    Each tile can be rendered to several mbtiles files from a single read of the
+    data, by passing a list of (tile_renderer, outfilename) pairs as outfilename.
+
+    If encoding is provided, the count of each value of each layer within each
+    tile is stored in the tile_histograms table of the mbtiles file, for use
+    with datatiles.histograms.summarize_region.
+
+    The "format" metadata of each mbtiles file is "webp" if its tiles are
+    rendered using datatiles.webp.to_smallest_webp, otherwise "png".
+
+    Low zoom tiles are read from overviews of infilename, if present.
     
     Parameters
     ----------
-    infilename : path to input GeoTIFF file
-    outfilename : path to output mbtiles file
-    
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
+    outfilename : path to output mbtiles file, or list of (tile_renderer, outfilename)
+        tuples
     min_zoom : int
     max_zoom : int
     tile_size : int, optional (default: 256)
     metadata : dict, optional
         metadata dictionary to add to the mbtiles metadata
     tile_renderer : function, optional (default: to_smallest_png)
-        function that takes as input the data array for the tile and returns a PNG
+        function that takes as input the data array for the tile and returns a PNG,
+        or None to not write the tile.
+        Not used if outfilename is a list of (tile_renderer, outfilename) tuples.
+    encoding : dict, optional (default: None)
+        encoding metadata returned by encode_tifs for infilename.  If provided,
+        it is added to the metadata of each mbtiles file and histograms are stored
+        for each tile.
+    overview_resampling : str, optional (default: None)
+        one of "nearest", "mode".  If provided and infilename does not have
+        overviews, overviews are built using this resampling method in a temporary
+        copy of infilename, which is used to create tiles.
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of each stage of reading and writing tiles, and counts
+        of tiles read, skipped, and written and bytes written
+    dry_run : bool, optional (default: False)
+        if True, outfilename is not created.  Instead, the number of tiles, size
+        of tiles, and time to create tiles are estimated for each output using
+        datatiles.estimate.estimate_tiles.  Overviews are not built for the
+        estimate, so low zoom tiles are estimated from the full resolution data
+        if infilename does not have overviews.
+    prune : str, optional (default: None)
+        one of "overzoom", "duplicate".  If provided, the descendants of tiles where
+        all values are the same are not read.  If "overzoom", they are not written,
+        and clients are expected to overzoom the uniform tile.  If "duplicate",
+        the uniform tile is written in place of each descendant; its image is
+        stored only once.  See datatiles.tiles.read_tiles for limitations.
+    progress : bool, optional (default: False)
+        if True, the number of tiles read is displayed using ProgressMetrics
+
+    Returns
+    -------
+    If dry_run is True, dict of estimates returned by estimate_tiles, or a list of
+    these for each output if outfilename is a list.  Otherwise None.
     """
 
-    with rasterio.Env() as env:
-        with rasterio.open(infilename) as src:
-            with MBtiles(outfilename, mode="w") as mbtiles:
-                meta = {
-                    "tilejson": "2.0.0",
-                    "version": "1.0.0",
-                    "minzoom": min_zoom,
-                    "maxzoom": max_zoom,
-                }
-                meta.update(get_mbtiles_meta(src, min_zoom))
+    if prune not in (None, "overzoom", "duplicate"):
+        raise ValueError("prune must be one of: overzoom, duplicate")
+
+    histograms = None
+    if encoding is not None:
+        histograms = TileHistograms(encoding)
+
+    outputs = get_outputs(outfilename, tile_renderer)
+    renderers = [renderer for renderer, _ in outputs]
+
+    if dry_run:
+        # estimated from infilename as is, without building overviews
+        estimates = [
+            estimate_tiles(
+                infilename,
+                min_zoom,
+                max_zoom,
+                tile_size=tile_size,
+                tile_renderer=renderer,
+            )
+            for renderer in renderers
+        ]
+        if isinstance(outfilename, (list, tuple)):
+            return estimates
+        return estimates[0]
+
+    if progress:
+        metrics = ProgressMetrics(metrics)
+    elif metrics is None:
+        metrics = NULL_METRICS
+
+    with rasterio.Env() as env, overviews_source(
+        infilename, overview_resampling, metrics
+    ) as infilename:
+        with open_source(infilename) as src, ExitStack() as stack:
+            if max_zoom is None:
+                max_zoom = get_default_max_zoom(src)
+
+            meta = {
+                "tilejson": "2.0.0",
+                "version": "1.0.0",
+                "minzoom": min_zoom,
+                "maxzoom": max_zoom,
+            }
+            meta.update(get_mbtiles_meta(src, min_zoom))
 
-                if metadata is not None:
-                    meta.update(metadata)
+            if encoding is not None:
+                meta["encoding"] = json.dumps(encoding)
 
-                mbtiles.meta = meta
+            if metadata is not None:
+                meta.update(metadata)
 
-                for tile, data, transform in read_tiles(
-                    src, min_zoom=min_zoom, max_zoom=max_zoom, tile_size=tile_size
-                ):
-                    # Only write out non-empty tiles
-                    if not np.all(data == src.nodata):
-                        # flip tile Y to match xyz scheme
-                        tiley = int(math.pow(2, tile.z)) - tile.y - 1
-                        mbtiles.write_tile(tile.z, tile.x, tiley, tile_renderer(data))
+            outs = []
+            for renderer, path in outputs:
+                mbtiles = stack.enter_context(MBtiles(path, mode="w"))
+                if encoding is not None:
+                    _get_cursor(mbtiles).executescript(HISTOGRAM_SCHEMA)
+                # metadata may override the format of the tiles
+                mbtiles.meta = {"format": get_tile_format(renderer), **meta}
+                outs.append(mbtiles)
+
+            bounds = get_geo_bounds(src)
+
+            # tiles whose descendants were not read
+            pruned = set()
+
+            for tile, data, transform in read_tiles(
+                src,
+                min_zoom=min_zoom,
+                max_zoom=max_zoom,
+                tile_size=tile_size,
+                metrics=metrics,
+                prune=prune is not None,
+                reuse_buffers=True,
+                pruned=pruned,
+            ):
+                # Only write out non-empty tiles
+                with metrics.timer("empty"):
+                    empty = np.all(data == src.nodata)
+
+                if empty:
+                    metrics.count("skipped")
+                    continue
+
+                tiles = [tile]
+                if prune == "duplicate" and tile in pruned:
+                    # descendants were not read; they have the same data
+                    tiles.extend(get_descendants(tile, max_zoom, bounds))
+
+                # flip tile Y to match xyz scheme
+                tiles = [(t.z, t.x, int(math.pow(2, t.z)) - t.y - 1) for t in tiles]
+
+                tile_histograms = None
+                if histograms is not None:
+                    with metrics.timer("histograms"):
+                        tile_histograms = histograms(data)
+
+                pngs = render_tile(data, renderers, metrics)
+
+                # renderers return None for tiles that are not written
+                written = [
+                    (out, png) for out, png in zip(outs, pngs) if png is not None
+                ]
+                if not written:
+                    metrics.count("skipped")
+                    continue
+
+                with metrics.timer("write"):
+                    for mbtiles, png in written:
+                        mbtiles.write_tiles(Tile(z, x, y, png) for z, x, y in tiles)
+
+                metrics.count("written", len(tiles) * len(written))
+                metrics.count("bytes", sum(len(png) for _, png in written) * len(tiles))
+
+                if tile_histograms is not None:
+                    with metrics.timer("histograms"):
+                        for mbtiles, _ in written:
+                            for z, x, y in tiles:
+                                write_histograms(
+                                    _get_cursor(mbtiles), z, x, y, tile_histograms
+                                )
+
+            if progress:
+                metrics.finish()
 
 
 def render_tif_to_mbtiles(
-    infilename, outfilename, colormap, min_zoom, max_zoom, metadata=None, tile_size=256
+    infilename,
+    outfilename,
+    colormap,
+    min_zoom,
+    max_zoom,
+    metadata=None,
+    tile_size=256,
+    metrics=None,
 ):
     """Convert a tif to mbtiles, rendered according to the colormap.
 
-    The tif is first converted into an indexed image that matches the number of colors in the colormap,
-    and all values not in the colormap are masked out.
+    Values are converted to the index of their color in the colormap as each tile
+    is rendered, and all values not in the colormap are transparent.
     
     Parameters
     ----------
-    infilename : path to input GeoTIFF file
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
     outfilename : path to output mbtiles file
     colormap : dict of values to hex color codes
     min_zoom : int, optional (default: 0)
     max_zoom : int, optional (default: None, which means it will automatically be calculated from extent)
     metadata : dict, optional
         metadata dictionary to add to the mbtiles metadata
+    tile_size : int, optional (default: 256)
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        passed to tif_to_mbtiles
     """
 
     # palette is created as a series of r,g,b values.  Positions correspond to the index
@@ -96,31 +288,25 @@ def render_tif_to_mbtiles(
     values = sorted(colormap.keys())
     palette = np.array([hex_to_rgb(colormap[value]) for value in values], dtype="uint8")
 
-    with TemporaryDirectory() as tmpdir:
-        with rasterio.open(infilename) as src:
-            if src.count > 1:
-                raise ValueError("tif must be single band")
-
-            # Convert the image to indexed, if necessary
-            unique_values = np.unique(src.read(1, masked=True))
-            unique_values = [v for v in unique_values if v is not np.ma.masked]
-
-            if len(set(unique_values).difference(values)):
-                # convert the image to indexed
-                print("Converting tif to indexed tif")
-                indexedfilename = os.path.join(tmpdir, "indexed.tif")
-                to_indexed_tif(infilename, indexedfilename, values)
-
-            else:
-                indexedfilename = infilename
-
-        paletted_renderer = partial(to_paletted_png, palette=palette, nodata=src.nodata)
-        tif_to_mbtiles(
-            indexedfilename,
-            outfilename,
-            min_zoom,
-            max_zoom,
-            tile_size,
-            metadata=metadata,
-            tile_renderer=paletted_renderer,
-        )
+    with open_source(infilename) as src:
+        if src.count > 1:
+            raise ValueError("tif must be single band")
+
+        nodata = src.nodata
+
+    # values are mapped to the index of their color in the palette as each tile
+    # is rendered; values not in the colormap are transparent, and tiles that
+    # are entirely transparent are not written
+    paletted_renderer = partial(
+        to_paletted_png, palette=palette, nodata=nodata, values=values, skip_empty=True
+    )
+    tif_to_mbtiles(
+        infilename,
+        outfilename,
+        min_zoom,
+        max_zoom,
+        tile_size,
+        metadata=metadata,
+        tile_renderer=paletted_renderer,
+        metrics=metrics,
+    )
@@ -0,0 +1,207 @@
+"""Instrumentation of tiling and encoding stages"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import sys
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from progress.counter import Counter
+
+
+class _NullTimer(object):
+    """Context manager that does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    Receives timings and counts from read_tiles, tif_to_mbtiles, tif_to_tiles and
+    encode_tifs.
+
+    This base class ignores everything it receives, so that instrumentation costs
+    next to nothing when not used.  Subclass it to export metrics elsewhere.
+
+    Stages timed per tile are:
+    "window": calculating the window and transform of the tile
+    "read": reading the tile from the warped source
+    "empty": checking if the tile is empty
+    "render": rendering the tile to an image
+    "write": writing the tile to the output
+    "prune": checking if the descendants of the tile can be pruned
+
+    "overviews" times building overviews, in a temporary copy of the source or
+    in the output of encode_tifs.
+
+    Counts are:
+    "tiles": tiles read
+    "skipped": empty tiles that were not written
+    "written": tiles written
+    "bytes": bytes of tiles written
+
+    Recorded values are:
+    "peak_memory": peak resident memory of this process, in bytes
+    "peak_memory_workers": peak resident memory of the largest worker process,
+        in bytes
+    "base", "dtype", "nodata": parameters of the encoding from encode_tifs
+    """
+
+    def timer(self, stage):
+        """Time a stage of processing.
+
+        Parameters
+        ----------
+        stage : str
+            name of the stage
+
+        Returns
+        -------
+        context manager that times the stage
+        """
+
+        return _NULL_TIMER
+
+    def count(self, name, value=1):
+        """Add to a count.
+
+        Parameters
+        ----------
+        name : str
+            name of the count
+        value : int, optional (default 1)
+            amount to add to the count
+        """
+
+        pass
+
+    def record(self, name, value):
+        """Record a value, such as peak memory.
+
+        Parameters
+        ----------
+        name : str
+            name of the value
+        value : number
+        """
+
+        pass
+
+
+NULL_METRICS = Metrics()
+
+
+def get_peak_memory(children=False):
+    """Get the peak resident memory of this process or of its child processes.
+
+    Parameters
+    ----------
+    children : bool, optional (default False)
+        if True, get the peak of the largest child process that has finished
+
+    Returns
+    -------
+    int, bytes, or None if not available on this platform
+    """
+
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    )
+    # ru_maxrss is in kilobytes, except on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class TimingMetrics(Metrics):
+    """
+    Accumulate total time per stage, counts, and recorded values in memory.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.values = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += perf_counter() - start
+            self.calls[stage] += 1
+
+    def count(self, name, value=1):
+        self.counts[name] += value
+
+    def record(self, name, value):
+        self.values[name] = value
+
+    def summary(self):
+        """Summarize the metrics.
+
+        Returns
+        -------
+        dict of {"timings": {<stage>: {"seconds": <total>, "calls": <calls>}, ...},
+        "counts": {<name>: <count>, ...}, "values": {<name>: <value>, ...}}
+        """
+
+        return {
+            "timings": {
+                stage: {"seconds": seconds, "calls": self.calls[stage]}
+                for stage, seconds in self.timings.items()
+            },
+            "counts": dict(self.counts),
+            "values": dict(self.values),
+        }
+
+
+class ProgressMetrics(Metrics):
+    """
+    Display the number of tiles read, and pass everything received on to another
+    Metrics instance.  Nothing is timed unless that instance times it.
+    """
+
+    def __init__(self, metrics=None, message="Extracting tiles...    "):
+        """Start displaying progress.
+
+        Parameters
+        ----------
+        metrics : Metrics, optional (default None)
+            receives everything passed to this instance
+        message : str, optional
+            message displayed before the number of tiles read
+        """
+
+        self._metrics = NULL_METRICS if metrics is None else metrics
+        self._counter = Counter(message)
+
+    def timer(self, stage):
+        return self._metrics.timer(stage)
+
+    def count(self, name, value=1):
+        self._metrics.count(name, value)
+        if name == "tiles":
+            self._counter.next(value)
+
+    def record(self, name, value):
+        self._metrics.record(name, value)
+
+    def finish(self):
+        """Finish displaying progress"""
+
+        self._counter.finish()
@@ -0,0 +1,224 @@
+"""Recompress PNG tiles in existing mbtiles files"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import hashlib
+from io import BytesIO
+import os
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+
+# zlib strategies supported by Pillow's PNG encoder, as compress_type
+# 0: default, 1: filtered, 2: huffman only, 3: RLE, 4: fixed
+ZLIB_STRATEGIES = (0, 1, 2, 3, 4)
+
+
+def _to_palette(img):
+    """Convert a grayscale or RGB image with at most 256 colors to a paletted image
+    with the same colors, so that it can be written at a lower bit depth.
+
+    RGB images with only gray colors are not converted, because they could not
+    be distinguished from grayscale images when decoded by from_png.
+
+    Parameters
+    ----------
+    img : PIL Image
+
+    Returns
+    -------
+    PIL Image, or None if image cannot be converted
+    """
+
+    if img.mode not in ("L", "RGB") or "transparency" in img.info:
+        return None
+
+    arr = np.asarray(img)
+    if img.mode == "L":
+        colors, indexes = np.unique(arr, return_inverse=True)
+        if len(colors) > 256:
+            return None
+        palette = np.repeat(colors[:, np.newaxis], 3, axis=1)
+
+    else:
+        colors, indexes = np.unique(arr.reshape(-1, 3), axis=0, return_inverse=True)
+        if len(colors) > 256:
+            return None
+        if np.all(colors == colors[:, :1]):
+            return None
+        palette = colors
+
+    out = Image.fromarray(indexes.reshape(arr.shape[:2]).astype("uint8"), "P")
+    out.putpalette(palette.astype("uint8").flatten().tolist(), "RGB")
+    return out
+
+
+def recompress_png(png, levels=(9,), strategies=ZLIB_STRATEGIES, reduce_bit_depth=True):
+    """Recompress a PNG using each combination of zlib compression level and
+    strategy, and optionally at a lower bit depth, and return the smallest result.
+
+    Candidates are only used if their decoded RGBA pixels are identical to those of
+    the original PNG.
+
+    Parameters
+    ----------
+    png : PNG bytes
+    levels : list of int, optional (default: (9, ))
+        zlib compression levels to try, from 0 to 9
+    strategies : list of int, optional (default: ZLIB_STRATEGIES)
+        zlib strategies to try
+    reduce_bit_depth : bool, optional (default: True)
+        if True, grayscale and RGB images with at most 256 colors are also
+        written as paletted images, using 1, 2, 4, or 8 bits per pixel
+
+    Returns
+    -------
+    PNG bytes, the original PNG if none of the candidates are smaller
+    """
+
+    img = Image.open(BytesIO(png))
+    img.load()
+    pixels = np.asarray(img.convert("RGBA"))
+
+    images = [img]
+    if reduce_bit_depth:
+        paletted = _to_palette(img)
+        if paletted is not None:
+            images.append(paletted)
+
+    smallest = png
+    for candidate in images:
+        for level in levels:
+            for strategy in strategies:
+                buf = BytesIO()
+                candidate.save(buf, "PNG", compress_level=level, compress_type=strategy)
+                out = buf.getvalue()
+
+                if len(out) >= len(smallest):
+                    continue
+
+                decoded = np.asarray(Image.open(BytesIO(out)).convert("RGBA"))
+                if np.array_equal(decoded, pixels):
+                    smallest = out
+
+    return smallest
+
+
+def optimize_mbtiles(
+    filename,
+    levels=(9,),
+    strategies=ZLIB_STRATEGIES,
+    reduce_bit_depth=True,
+    processes=None,
+    batch_size=1000,
+    vacuum=True,
+):
+    """Recompress the PNG tiles of an mbtiles file in place, using
+    recompress_png in a pool of processes.
+
+    Each unique image is recompressed once, and the smaller images are written
+    back in a transaction per batch.  The mbtiles file must use the images and
+    map tables created by pymbtiles.
+
+    Parameters
+    ----------
+    filename : path to mbtiles file created by tif_to_mbtiles
+    levels : list of int, optional (default: (9, ))
+        zlib compression levels to try
+    strategies : list of int, optional (default: ZLIB_STRATEGIES)
+        zlib strategies to try
+    reduce_bit_depth : bool, optional (default: True)
+        if True, also try writing images as paletted images at lower bit depth
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+    batch_size : int, optional (default: 1000)
+        number of images to recompress and write per transaction
+    vacuum : bool, optional (default: True)
+        if True, the file is vacuumed afterward to release the space saved
+
+    Returns
+    -------
+    dict of {"images": <images>, "recompressed": <images made smaller>,
+    "bytes_before": <bytes of images>, "bytes_after": <bytes of images>,
+    "file_bytes_before": <bytes>, "file_bytes_after": <bytes>}
+    """
+
+    stats = {
+        "images": 0,
+        "recompressed": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+        "file_bytes_before": os.path.getsize(filename),
+    }
+
+    recompress = partial(
+        recompress_png,
+        levels=levels,
+        strategies=strategies,
+        reduce_bit_depth=reduce_bit_depth,
+    )
+
+    db = sqlite3.connect(filename, isolation_level=None)
+    try:
+        cursor = db.cursor()
+        ids = [row[0] for row in cursor.execute("SELECT tile_id FROM images")]
+
+        # map is only indexed on tile coordinates
+        cursor.execute("CREATE INDEX IF NOT EXISTS map_tile_id ON map (tile_id)")
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start : start + batch_size]
+                rows = cursor.execute(
+                    "SELECT tile_id, tile_data FROM images WHERE tile_id IN ({})".format(
+                        ",".join("?" * len(batch))
+                    ),
+                    batch,
+                ).fetchall()
+
+                pngs = [bytes(data) for _, data in rows]
+                results = executor.map(recompress, pngs, chunksize=16)
+
+                cursor.execute("BEGIN")
+                try:
+                    for (id, _), png, out in zip(rows, pngs, results):
+                        stats["images"] += 1
+                        stats["bytes_before"] += len(png)
+                        stats["bytes_after"] += len(out)
+
+                        if len(out) >= len(png):
+                            continue
+
+                        stats["recompressed"] += 1
+
+                        # images are identified by the hash of their contents
+                        new_id = hashlib.sha1(out).hexdigest()
+                        cursor.execute(
+                            "INSERT OR REPLACE INTO images (tile_id, tile_data) "
+                            "values (?, ?)",
+                            (new_id, sqlite3.Binary(out)),
+                        )
+                        cursor.execute(
+                            "UPDATE map SET tile_id = ? WHERE tile_id = ?", (new_id, id)
+                        )
+                        cursor.execute("DELETE FROM images WHERE tile_id = ?", (id,))
+
+                    cursor.execute("COMMIT")
+
+                except sqlite3.Error:
+                    cursor.execute("ROLLBACK")
+                    raise
+
+        cursor.execute("DROP INDEX map_tile_id")
+
+        if vacuum:
+            cursor.execute("VACUUM")
+
+    finally:
+        db.close()
+
+    stats["file_bytes_after"] = os.path.getsize(filename)
+
+    return stats
@@ -9,7 +9,7 @@ from PIL import Image
 import rasterio
 from rasterio.dtypes import get_minimum_dtype
 
-from datatiles.rgb import to_rgb_array, to_rgba_array
+from datatiles.rgb import to_rgb_array, to_rgba_array, from_rgb_array
 
 
 MAX_VALUE = {"L": 255, "RGB": 16777215, "RGBA": 4294967295}
@@ -49,25 +49,23 @@ def get_smallest_image_type(arr):
         )
 
 
-def to_smallest_png(arr, image_type=None):
+def to_image(arr, image_type=None):
     """
-    Convert an array to PNG, using the smallest PNG bit depth that
-    will contain the data range: 8, 24, or 32.
+    Convert an array to a PIL Image, using the smallest image type that will
+    contain the data range: "L" (8 bit) or "RGB" (24 bit).
 
-    If the input is a masked array, the maximum value of the data type
+    If the input is a masked array, the maximum value of the image type
     will be used to fill nodata.
 
-    You can pre-fill nodata with a different value, but if you use a value well
-    outside your value range, this may force use of a larger output PNG bit depth
-    than is ideal.
-    
     Parameters
     ----------
     arr: input array or masked array, must have dtype of uint8, uint16, or uint32
+    image_type : str, optional (default: None)
+        one of "L", "RGB".  If None, the smallest image type is used.
 
     Returns
     -------
-    PNG bytes
+    PIL Image
     """
 
     if arr.dtype.kind not in ("u", "i"):
@@ -101,7 +99,8 @@ def to_smallest_png(arr, image_type=None):
         arr = arr.data
 
     if image_type == "L":
-        image_data = arr
+        # arrays of larger data types with small values are written as 8 bit
+        image_data = np.ascontiguousarray(arr, dtype="uint8")
 
     elif image_type == "RGB":
         image_data = to_rgb_array(np.asarray(arr))
@@ -112,29 +111,129 @@ def to_smallest_png(arr, image_type=None):
     else:
         raise NotImplementedError("values require an image type that is not supported")
 
-    img = Image.frombuffer(
+    return Image.frombuffer(
         image_type, (arr.shape[1], arr.shape[0]), image_data, "raw", image_type, 0, 1
     )
 
+
+def to_smallest_png(arr, image_type=None):
+    """
+    Convert an array to PNG, using the smallest PNG bit depth that
+    will contain the data range: 8, 24, or 32.
+
+    If the input is a masked array, the maximum value of the data type
+    will be used to fill nodata.
+
+    You can pre-fill nodata with a different value, but if you use a value well
+    outside your value range, this may force use of a larger output PNG bit depth
+    than is ideal.
+    
+    Parameters
+    ----------
+    arr: input array or masked array, must have dtype of uint8, uint16, or uint32
+
+    Returns
+    -------
+    PNG bytes
+    """
+
+    img = to_image(arr, image_type)
+
     buf = BytesIO()
     img.save(buf, "PNG")
     buf.seek(0)  # rewind to beginning of buffer
     return buf.read()
 
 
-def to_paletted_png(arr, palette, nodata=None):
+def from_png(png):
+    """
+    Decode PNG bytes created by to_smallest_png back to integer values.
+
+    8-bit grayscale images are returned as uint8 values, 24-bit RGB images are
+    returned as uint32 values.  Paletted images, such as those written at a lower
+    bit depth by datatiles.optimize, are decoded through their palette: as uint8
+    values if all colors are gray, otherwise as uint32 values.
+
+    Parameters
+    ----------
+    png : PNG bytes
+
+    Raises
+    ------
+    ValueError
+        raised if image type is not supported
+
+    Returns
+    -------
+    numpy array of shape (height, width)
+    """
+
+    img = Image.open(BytesIO(png))
+
+    if img.mode == "P":
+        rgb = np.asarray(img.convert("RGB"))
+        if np.all(rgb == rgb[..., :1]):
+            return rgb[..., 0]
+        return from_rgb_array(rgb)
+
+    if img.mode == "L":
+        return np.asarray(img)
+
+    if img.mode == "RGB":
+        return from_rgb_array(np.asarray(img))
+
+    raise ValueError("Image type is not supported: {}".format(img.mode))
+
+
+def get_palette_indexes(arr, values, nodata_index):
+    """Map values in an array to their index within values.
+
+    Values not present in values are assigned nodata_index.  uint8 arrays are
+    mapped using a lookup table, other arrays using a binary search of values.
+
+    Parameters
+    ----------
+    arr : numpy array, must be integer type
+    values : sorted list-like of values
+    nodata_index : int
+
+    Returns
+    -------
+    uint8 numpy array of indexes
+    """
+
+    values = np.asarray(values)
+
+    if arr.dtype == np.uint8:
+        lut = np.full(256, nodata_index, dtype="uint8")
+        in_range = (values >= 0) & (values <= 255)
+        lut[values[in_range].astype("uint8")] = np.arange(len(values))[in_range]
+        return lut[arr]
+
+    indexes = np.searchsorted(values, arr).clip(0, len(values) - 1)
+    return np.where(values[indexes] == arr, indexes, nodata_index).astype("uint8")
+
+
+def to_paletted_png(arr, palette, nodata=None, values=None, skip_empty=False):
     """
     Render an array as a paletted PNG.
+
+    The input array is not modified.
     
     Parameters
     ----------
-    arr : input array or masked array, must have dtype of uint8
+    arr : input array or masked array, must have dtype of uint8 unless values are provided
     palette : numpy array of 8 bit tuples [(r, g, b), ...], where the index corresponds to the value in the image
     nodata : nodata value, will be set as transparent in the image (optional, default: None)
+    values : sorted list-like of values that correspond to each entry in palette (optional, default: None).
+        If provided, values in the array are mapped to the index of that value within values,
+        and values not in values are set as transparent.
+    skip_empty : bool, optional (default: False)
+        if True, None is returned instead of a PNG if all pixels are transparent
 
     Returns
     -------
-    PNG bytes
+    PNG bytes, or None if skip_empty is True and all pixels are transparent
     """
 
     if arr.dtype.kind not in ("u", "i"):
@@ -143,21 +242,35 @@ def to_paletted_png(arr, palette, nodata=None):
     # TODO: validate palette: must be of a small enough size and have rgb tuples
 
     nodata_index = None
-    if is_masked(arr) or nodata is not None:
+    if is_masked(arr) or nodata is not None or values is not None:
         # If it is masked, fill with index at end of palette
         nodata_index = len(palette)
+        if nodata_index > 255:
+            raise ValueError("Palette must have less than 255 colors to allow nodata")
 
         # add nodata color to palette (set as transparent below)
         palette = np.append(palette, (0, 0, 0))
 
-        if is_masked(arr):
-            arr = arr.filled(nodata_index)
-        else:
-            arr[arr == nodata] = nodata_index
+        mask = np.ma.getmaskarray(arr) if is_masked(arr) else None
+        arr = np.ma.getdata(arr)
+        if nodata is not None:
+            nodata_mask = arr == nodata
+            mask = nodata_mask if mask is None else mask | nodata_mask
+
+        if values is not None:
+            arr = get_palette_indexes(arr, values, nodata_index)
+            if mask is not None:
+                arr[mask] = nodata_index
+
+        elif mask is not None:
+            arr = np.where(mask, nodata_index, arr).astype(arr.dtype)
 
     else:
         # return the underlying ndarray
-        arr = arr.data
+        arr = np.ma.getdata(arr)
+
+    if skip_empty and nodata_index is not None and np.all(arr == nodata_index):
+        return None
 
     img = Image.frombuffer("P", (arr.shape[1], arr.shape[0]), arr, "raw", "P", 0, 1)
     # palette must be a list of [r, g, b, r, g, b, ...]  values
@@ -0,0 +1,208 @@
+"""Query decoded values at points from encoded data tiles"""
+
+from functools import lru_cache
+import json
+import math
+
+import numpy as np
+from pymbtiles import MBtiles
+
+from datatiles.encoding.lookup import LookupDecoder
+from datatiles.png import from_png
+
+
+def lnglat_to_tile_pixel(lons, lats, zoom, tile_size=256):
+    """Calculate the tile and pixel within that tile for each longitude, latitude
+    pair.
+
+    Tile coordinates follow the XYZ scheme.
+
+    Parameters
+    ----------
+    lons : list-like of longitude values
+    lats : list-like of latitude values
+    zoom : int
+    tile_size : int, optional (default 256)
+        length and width of tile
+
+    Returns
+    -------
+    tuple of arrays: tile x, tile y, pixel column, pixel row, valid
+        valid is False where the point falls outside the Web Mercator extent
+    """
+
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+
+    num_tiles = 2 ** zoom
+    lat_rad = np.radians(lats)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = (lons + 180.0) / 360.0 * num_tiles
+        y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0
+        y *= num_tiles
+
+    valid = (x >= 0) & (x < num_tiles) & (y >= 0) & (y < num_tiles)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+
+    tile_x = np.floor(x).astype("int64")
+    tile_y = np.floor(y).astype("int64")
+    col = np.minimum(((x - tile_x) * tile_size).astype("int64"), tile_size - 1)
+    row = np.minimum(((y - tile_y) * tile_size).astype("int64"), tile_size - 1)
+
+    return tile_x, tile_y, col, row, valid
+
+
+class PointQuery(object):
+    """
+    Query decoded layer values for many points at once from an mbtiles file
+    of encoded data tiles.
+
+    Points are grouped by tile so that each tile is read and decoded only once.
+    Decoded tiles are held in a least-recently-used cache for repeated queries.
+    """
+
+    def __init__(self, filename, encoding=None, cache_size=256):
+        """Open the mbtiles file for querying.
+
+        Parameters
+        ----------
+        filename : path to mbtiles file of tiles created from encode_tifs output
+        encoding : dict, optional (default: None)
+            encoding metadata returned by encode_tifs.  If None, it is read from
+            the JSON "encoding" entry in the mbtiles metadata.
+        cache_size : int, optional (default: 256)
+            number of decoded tiles to hold in memory
+        """
+
+        self._mbtiles = MBtiles(filename, mode="r")
+
+        if encoding is None:
+            if "encoding" not in self._mbtiles.meta:
+                self._mbtiles.close()
+                raise ValueError(
+                    "encoding must be provided if not present in mbtiles metadata"
+                )
+
+            encoding = json.loads(self._mbtiles.meta["encoding"])
+
+        if encoding["type"] != "exponential":
+            self._mbtiles.close()
+            raise NotImplementedError("other encoding types not yet supported")
+
+        self.encoding = encoding
+
+        # 8 bit encodings have few enough encoded values to build a lookup table
+        # of all of them once; otherwise one is built for the values queried
+        self._decoder = None
+        if encoding["dtype"] == "uint8":
+            self._decoder = LookupDecoder.from_encoding(encoding)
+
+        self.max_zoom = int(self._mbtiles.meta.get("maxzoom", 0))
+        self._read_tile = lru_cache(maxsize=cache_size)(self._read_tile)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the mbtiles file."""
+
+        self._mbtiles.close()
+
+    def _read_tile(self, z, x, y):
+        """Read and decode a tile to encoded integer values.
+
+        Parameters
+        ----------
+        z, x, y : int
+            XYZ tile coordinates
+
+        Returns
+        -------
+        numpy array of encoded values, or None if tile is not present
+        """
+
+        # flip tile Y to match TMS scheme of mbtiles
+        png = self._mbtiles.read_tile(z, x, int(math.pow(2, z)) - y - 1)
+        if png is None:
+            return None
+
+        return from_png(png)
+
+    def query_encoded(self, lons, lats, zoom=None):
+        """Query the encoded values at each point.
+
+        Parameters
+        ----------
+        lons : list-like of longitude values
+        lats : list-like of latitude values
+        zoom : int, optional (default: None)
+            zoom level to query.  If None, max zoom of the tileset is used.
+
+        Returns
+        -------
+        numpy MaskedArray of encoded values, masked where no data are present
+        """
+
+        if zoom is None:
+            zoom = self.max_zoom
+
+        lons = np.asarray(lons, dtype="float64")
+        out = np.ma.masked_all(lons.shape, dtype="uint32")
+
+        tile_x, tile_y, _, _, valid = lnglat_to_tile_pixel(lons, lats, zoom, 1)
+        if not valid.any():
+            return out
+
+        # group points by tile
+        keys = tile_x * (2 ** zoom) + tile_y
+        unique_keys, inverse = np.unique(keys[valid], return_inverse=True)
+        indices = np.flatnonzero(valid)
+
+        for i, key in enumerate(unique_keys.tolist()):
+            data = self._read_tile(zoom, key // (2 ** zoom), key % (2 ** zoom))
+            if data is None:
+                continue
+
+            point_indices = indices[inverse == i]
+            _, _, col, row, _ = lnglat_to_tile_pixel(
+                lons[point_indices],
+                np.asarray(lats, dtype="float64")[point_indices],
+                zoom,
+                data.shape[0],
+            )
+            out[point_indices] = data[row, col]
+
+        out[out == self.encoding["nodata"]] = np.ma.masked
+        return out
+
+    def query(self, lons, lats, zoom=None):
+        """Query the decoded values of each layer at each point.
+
+        Parameters
+        ----------
+        lons : list-like of longitude values
+        lats : list-like of latitude values
+        zoom : int, optional (default: None)
+            zoom level to query.  If None, max zoom of the tileset is used.
+
+        Returns
+        -------
+        dict of {<layer id>: numpy MaskedArray of values}
+            values are masked where that layer or all layers have no data at the point
+        """
+
+        encoded = self.query_encoded(lons, lats, zoom=zoom)
+        encoded = encoded.filled(self.encoding["nodata"]).astype("int64")
+
+        decoder = self._decoder
+        if decoder is None:
+            decoder = LookupDecoder.from_encoding(
+                self.encoding, codes=np.unique(encoded)
+            )
+
+        return decoder.decode(encoded)
@@ -1,15 +1,26 @@
 """Raster file processing functions"""
 
 from collections import defaultdict
+from contextlib import contextmanager
 import math
 import os
+import shutil
+from tempfile import TemporaryDirectory
 import numpy as np
 import rasterio
-from rasterio.warp import transform_bounds
+from rasterio.enums import Resampling
+from rasterio.io import DatasetReader, MemoryFile
+import rasterio.shutil
+from rasterio.warp import calculate_default_transform, transform_bounds
+
+from datatiles.metrics import NULL_METRICS
 
 
 EPSILON = 1.0e-10
 
+# Circumference of the earth in Web Mercator meters
+WEB_MERCATOR_CIRCUMFERENCE = 2 * math.pi * 6378137
+
 # Bounds of web mercator in geographic coordinates
 WEB_MERCATOR_BOUNDS = (
     -180 + EPSILON,  # w
@@ -87,6 +98,243 @@ def get_default_max_zoom(src):
     return max(zw, zh)
 
 
+def get_overview_factors(width, height, blocksize=256):
+    """Calculate the decimation factors for overviews, halving the resolution at each
+    level until the overview fits within a single block.
+
+    Parameters
+    ----------
+    width : int
+    height : int
+    blocksize : int, optional (default 256)
+
+    Returns
+    -------
+    list of ints
+    """
+
+    factors = []
+    factor = 2
+    while max(width, height) / (factor / 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def build_overviews(dataset, resampling="nearest", blocksize=256):
+    """Build internal overviews for all bands of the dataset.
+
+    Only resampling methods that preserve categorical values are allowed.
+
+    Parameters
+    ----------
+    dataset : rasterio.DatasetWriter
+        dataset opened in "w" or "r+" mode
+    resampling : str, optional (default "nearest")
+        one of "nearest", "mode"
+    blocksize : int, optional (default 256)
+        overviews are built until they fit within a block of this size
+    """
+
+    if resampling not in ("nearest", "mode"):
+        raise ValueError("Overview resampling must be one of: nearest, mode")
+
+    factors = get_overview_factors(dataset.width, dataset.height, blocksize)
+    if factors:
+        dataset.build_overviews(factors, Resampling[resampling])
+        dataset.update_tags(ns="rio_overview", resampling=resampling)
+
+
+def get_overview_levels(src, zooms, tile_size=256):
+    """Determine the overview level of src to read for each zoom level.
+
+    The coarsest overview whose resolution is at least as fine as the tile
+    resolution at a zoom level is used, so that reads at each zoom touch
+    roughly the number of pixels in the output tile.
+
+    Parameters
+    ----------
+    src : rasterio.DatasetReader
+    zooms : list-like of ints
+    tile_size : int, optional (default 256)
+        length and width of tile
+
+    Returns
+    -------
+    dict of {<zoom>: <overview level>}
+        overview level is the 0-based index into src.overviews(1), or None to
+        read from the full resolution data
+    """
+
+    overviews = src.overviews(1)
+    if not overviews:
+        return {zoom: None for zoom in zooms}
+
+    # resolution of src in Web Mercator
+    transform, _, _ = calculate_default_transform(
+        src.crs, "EPSG:3857", src.width, src.height, *src.bounds
+    )
+    src_res = abs(transform.a)
+
+    levels = {}
+    for zoom in zooms:
+        tile_res = WEB_MERCATOR_CIRCUMFERENCE / (tile_size * math.pow(2, zoom))
+
+        levels[zoom] = None
+        for level, factor in enumerate(overviews):
+            if src_res * factor <= tile_res:
+                levels[zoom] = level
+
+    return levels
+
+
+def copy_with_overviews(infilename, outfilename, resampling="nearest", blocksize=256):
+    """Copy a tif and build internal overviews in the copy.
+
+    Parameters
+    ----------
+    infilename : input tif filename
+    outfilename : output tif filename
+    resampling : str, optional (default "nearest")
+        one of "nearest", "mode"
+    blocksize : int, optional (default 256)
+        overviews are built until they fit within a block of this size
+    """
+
+    shutil.copyfile(infilename, outfilename)
+    with rasterio.open(outfilename, "r+") as out:
+        build_overviews(out, resampling, blocksize)
+
+
+@contextmanager
+def open_source(source):
+    """Context manager that opens a raster source for reading.
+
+    Datasets that are already open are provided as is, and are not closed on exit.
+
+    Parameters
+    ----------
+    source : path to tif, rasterio.io.MemoryFile, or rasterio.DatasetReader
+
+    Yields
+    ------
+    rasterio.DatasetReader
+    """
+
+    if isinstance(source, DatasetReader):
+        yield source
+
+    elif isinstance(source, MemoryFile):
+        with source.open() as src:
+            yield src
+
+    else:
+        with rasterio.open(source) as src:
+            yield src
+
+
+def array_to_memoryfile(data, transform, crs, nodata=None, blocksize=256):
+    """Write a 2D array to an in-memory tiled GeoTIFF, so that it can be used as
+    a source for tif_to_mbtiles and similar functions without writing it to disk.
+
+    Parameters
+    ----------
+    data : numpy array or masked array of shape (height, width)
+        If masked, masked values are filled with nodata.
+    transform : affine.Affine
+    crs : CRS or str
+    nodata : number, optional (default None)
+    blocksize : int, optional (default 256)
+        width and height of internal tiles, must be a multiple of 16
+
+    Returns
+    -------
+    rasterio.io.MemoryFile
+    """
+
+    if np.ma.is_masked(data):
+        if nodata is None:
+            raise ValueError("nodata is required for masked arrays")
+        data = data.filled(nodata)
+
+    data = np.ma.getdata(data)
+    memfile = MemoryFile()
+    with memfile.open(
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        crs=crs,
+        transform=transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=blocksize,
+        blockysize=blocksize,
+    ) as out:
+        out.write(data, 1)
+
+    return memfile
+
+
+@contextmanager
+def overviews_source(infilename, resampling=None, metrics=None):
+    """Context manager that provides a tif with overviews.
+
+    If infilename does not have overviews and resampling is provided, overviews
+    are built in a temporary copy of infilename that is deleted on exit.  The copy
+    is made in memory if infilename is a rasterio.io.MemoryFile or an open dataset
+    that is not backed by a file on disk.  Otherwise, infilename is provided as is.
+
+    Parameters
+    ----------
+    infilename : path to tif, rasterio.io.MemoryFile, or rasterio.DatasetReader
+    resampling : str, optional (default None)
+        one of "nearest", "mode"
+    metrics : datatiles.metrics.Metrics, optional (default None)
+        receives the timing of the "overviews" stage, if overviews are built
+
+    Yields
+    ------
+    filename of tif, or rasterio.io.MemoryFile
+    """
+
+    if resampling is None:
+        yield infilename
+        return
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    with open_source(infilename) as src:
+        has_overviews = bool(src.overviews(1))
+        filename = infilename
+        if isinstance(infilename, DatasetReader) and os.path.exists(src.name):
+            # copy the file on disk rather than reading it all into memory
+            filename = src.name
+
+        if not has_overviews and isinstance(filename, (MemoryFile, DatasetReader)):
+            with MemoryFile() as memfile:
+                with metrics.timer("overviews"):
+                    rasterio.shutil.copy(src, memfile.name, driver="GTiff", tiled=True)
+                    with rasterio.open(memfile.name, "r+") as out:
+                        build_overviews(out, resampling)
+
+                yield memfile
+                return
+
+    if has_overviews:
+        yield infilename
+        return
+
+    with TemporaryDirectory() as tmpdir:
+        outfilename = os.path.join(tmpdir, os.path.basename(filename))
+        with metrics.timer("overviews"):
+            copy_with_overviews(filename, outfilename, resampling)
+        yield outfilename
+
+
 def to_indexed_tif(infilename, outfilename, values):
     """Converts the input tif to uint8 indexed data.  Input tif must be a single-band
     image.
@@ -167,7 +415,7 @@ def has_matching_attributes(rasters, attribute):
     # att_values = defaultdict(set)
     value = None
     for src in rasters:
-        next_value = str(getattr(src, att))
+        next_value = str(getattr(src, attribute))
         if value is None:
             value = next_value
         elif value != next_value:
@@ -40,6 +40,24 @@ def to_rgb_array(arr):
     return bgr[..., ::-1].copy()
 
 
+def from_rgb_array(arr):
+    """
+    Convert RGB triples back to 2D integer values.  This is the inverse of
+    to_rgb_array.
+
+    Parameters
+    ----------
+    arr: array of RGB triples: [[[R, G, B] ...]]    (uint8)
+
+    Returns
+    -------
+    array of integer values    (uint32)
+    """
+
+    arr = arr.astype("uint32")
+    return (arr[..., 0] << 16) | (arr[..., 1] << 8) | arr[..., 2]
+
+
 # Note: this currently cannot be decoded properly, apparently because browsers can mess with gamma and alpha:
 # https://stackoverflow.com/questions/27767914/why-is-a-canvas-drawn-with-an-image-a-slightly-different-color-than-the-image-it
 def to_rgba_array(arr):
@@ -1,8 +1,10 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from functools import partial
 import os
 import math
 import json
-from tempfile import TemporaryDirectory
 
 from affine import Affine
 import mercantile
@@ -11,22 +13,480 @@ import numpy as np
 import rasterio
 from rasterio.enums import Resampling
 from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
 
-from progress.counter import Counter
-
+from datatiles.metrics import NULL_METRICS, ProgressMetrics
 from datatiles.rgb import hex_to_rgb
 from datatiles.png import to_smallest_png, to_paletted_png
 from datatiles.raster import (
+    WEB_MERCATOR_CIRCUMFERENCE,
     get_geo_bounds,
     get_mbtiles_meta,
     get_default_max_zoom,
-    to_indexed_tif,
+    get_overview_levels,
+    open_source,
+    overviews_source,
 )
+from datatiles.webp import to_smallest_webp
+
+
+# maximum number of tiles for which windows are calculated at once
+GRID_CHUNK_SIZE = 65536
+
+
+@contextmanager
+def open_tile_vrt(src, overview_level=None, tile_size=256):
+    """Context manager that opens a WarpedVRT of src in Web Mercator, for use with
+    read_tile.
+
+    Parameters
+    ----------
+    src : rasterio.DatasetReader
+        Input dataset, opened for reading
+    overview_level : int, optional (default None)
+        0-based index into src.overviews(1) of the overview to read from, or None
+        to read full resolution data.
+    tile_size : int, optional (default 256)
+        length and width of tile
+
+    Yields
+    ------
+    rasterio.WarpedVRT
+    """
+
+    with ExitStack() as stack:
+        if overview_level is not None:
+            src = stack.enter_context(
+                rasterio.open(src.name, overview_level=overview_level)
+            )
+
+        yield stack.enter_context(
+            WarpedVRT(
+                src,
+                crs="EPSG:3857",
+                nodata=src.nodata,
+                resampling=Resampling.nearest,
+                width=tile_size,
+                height=tile_size,
+            )
+        )
+
+
+class TileBufferPool(object):
+    """
+    Pool of reusable arrays for tile data, so that tiles can be read without
+    allocating new arrays for each tile.
+
+    A buffer returned by acquire is owned by the caller until it is passed back to
+    release; after that, it may be overwritten by any subsequent read.
+    """
+
+    def __init__(self, tile_size, dtype, nodata=None):
+        """
+        Parameters
+        ----------
+        tile_size : int
+            length and width of tile
+        dtype : numpy dtype
+        nodata : number, optional (default None)
+            value used to fill areas of tiles outside the data.  If None, 0 is used.
+        """
+
+        self.tile_size = tile_size
+        self.dtype = np.dtype(dtype)
+        self._free = []
+
+        # filled into tiles before pasting in partial reads
+        self._template = np.full(
+            (tile_size, tile_size), 0 if nodata is None else nodata, dtype=self.dtype
+        )
+
+        # partial reads are read here, reshaped to the width and height read
+        self._scratch = np.empty(tile_size * tile_size, dtype=self.dtype)
+
+    def acquire(self):
+        """Get a buffer from the pool, allocating a new one if none are free.
+
+        Returns
+        -------
+        numpy array of shape (tile_size, tile_size)
+        """
+
+        if self._free:
+            return self._free.pop()
+
+        return np.empty((self.tile_size, self.tile_size), dtype=self.dtype)
+
+    def release(self, buffer):
+        """Return a buffer to the pool.
+
+        Parameters
+        ----------
+        buffer : numpy array returned by acquire
+        """
+
+        self._free.append(buffer)
+
+    def fill_nodata(self, buffer):
+        """Fill a buffer with nodata.
+
+        Parameters
+        ----------
+        buffer : numpy array returned by acquire
+        """
+
+        np.copyto(buffer, self._template)
+
+    def scratch(self, height, width):
+        """Get the scratch array used for partial reads.
+
+        Parameters
+        ----------
+        height : int
+        width : int
+
+        Returns
+        -------
+        numpy array of shape (height, width), a view of the scratch array
+        """
+
+        return self._scratch[: height * width].reshape(height, width)
+
+
+# windows, transforms, and offsets of tiles within a WarpedVRT, calculated by
+# get_tile_grid
+TILE_GRID_DTYPE = np.dtype(
+    [
+        ("x", "int64"),
+        ("y", "int64"),
+        # window of the tile in the VRT
+        ("col_off", "float64"),
+        ("row_off", "float64"),
+        ("window_width", "float64"),
+        ("window_height", "float64"),
+        # upper left corner of tile, in Web Mercator
+        ("left", "float64"),
+        ("top", "float64"),
+        # position and size of the data within the tile, in pixels
+        ("left_offset", "int64"),
+        ("top_offset", "int64"),
+        ("width", "int64"),
+        ("height", "int64"),
+    ]
+)
+
+
+def get_tile_grid(vrt, zoom, xs, ys, tile_size=256):
+    """Calculate the window, bounds and offsets needed to read each of many tiles
+    at the same zoom level from the VRT at once.
+
+    If the tile bounds fall outside the vrt bounds, we have to calculate
+    offsets and widths ourselves (because WarpedVRT does not allow boundless reads).
+
+    Parameters
+    ----------
+    vrt : rasterio.WarpedVRT
+        WarpedVRT in Web Mercator, returned by open_tile_vrt
+    zoom : int
+    xs : numpy array of tile x values
+    ys : numpy array of tile y values
+    tile_size : int, optional (default 256)
+        length and width of tile
+
+    Returns
+    -------
+    numpy structured array of TILE_GRID_DTYPE, one entry per tile
+    """
+
+    tile_meters = WEB_MERCATOR_CIRCUMFERENCE / math.pow(2, zoom)
+    origin = WEB_MERCATOR_CIRCUMFERENCE / 2
+    res = tile_meters / tile_size
+    vrt_transform = vrt.transform
+    vrt_left, vrt_bottom, vrt_right, vrt_top = vrt.bounds
+
+    grid = np.empty(len(xs), dtype=TILE_GRID_DTYPE)
+    grid["x"] = xs
+    grid["y"] = ys
+
+    left = xs * tile_meters - origin
+    top = origin - ys * tile_meters
+    grid["left"] = left
+    grid["top"] = top
+
+    grid["col_off"] = (left - vrt_transform.c) / vrt_transform.a
+    grid["row_off"] = (top - vrt_transform.f) / vrt_transform.e
+    grid["window_width"] = tile_meters / vrt_transform.a
+    grid["window_height"] = tile_meters / -vrt_transform.e
+
+    left_offset = np.maximum(np.round((vrt_left - left) / res), 0)
+    right_offset = np.maximum(np.round((left + tile_meters - vrt_right) / res), 0)
+    bottom_offset = np.maximum(np.round((vrt_bottom - (top - tile_meters)) / res), 0)
+    top_offset = np.maximum(np.round((top - vrt_top) / res), 0)
+
+    grid["left_offset"] = left_offset
+    grid["top_offset"] = top_offset
+    grid["width"] = tile_size - left_offset - right_offset
+    grid["height"] = tile_size - top_offset - bottom_offset
+
+    return grid
+
+
+def _read_grid_tile(vrt, entry, tile_size, metrics, buffers):
+    """Read the tile described by an entry of get_tile_grid, as a tuple.
+
+    Returns
+    -------
+    tuple of numpy array of data with shape (tile_size, tile_size), tile transform object
+    """
+
+    (
+        _,
+        _,
+        col_off,
+        row_off,
+        window_width,
+        window_height,
+        left,
+        top,
+        left_offset,
+        top_offset,
+        width,
+        height,
+    ) = entry
+
+    res = (window_width * vrt.transform.a) / tile_size
+    dst_transform = Affine(res, 0, left, 0, -res, top)
+
+    if buffers is not None:
+        out = buffers.acquire()
+    else:
+        out = np.empty((tile_size, tile_size), dtype=vrt.dtypes[0])
+
+    if not (width > 0 and height > 0):
+        # No data can be read within an window that has no width or height
+        # so return a blank tile
+        if buffers is not None:
+            buffers.fill_nodata(out)
+        else:
+            out.fill(vrt.nodata)
+
+        return out, dst_transform
+
+    window = Window(col_off, row_off, window_width, window_height)
+
+    with metrics.timer("read"):
+        if width == tile_size and height == tile_size:
+            vrt.read(1, out=out, window=window)
+
+        else:
+            if buffers is not None:
+                data = vrt.read(1, out=buffers.scratch(height, width), window=window)
+                buffers.fill_nodata(out)
+            else:
+                data = vrt.read(1, out_shape=(height, width), window=window)
+                out.fill(vrt.nodata)
+
+            # paste data into the tile, which is otherwise nodata
+            out[
+                top_offset : top_offset + data.shape[0],
+                left_offset : left_offset + data.shape[1],
+            ] = data
+
+    return out, dst_transform
+
+
+def read_tile(vrt, tile, tile_size=256, metrics=NULL_METRICS, buffers=None):
+    """Read a tile of data from the VRT.
+
+    If the tile bounds fall outside the vrt bounds, the data that were read are
+    pasted into an otherwise blank tile (filled with Nodata value).
+
+    To read many tiles, read_tiles is faster, because it calculates the windows
+    of all tiles at a zoom level at once.
+    
+    Parameters
+    ----------
+    vrt : rasterio.WarpedVRT
+        WarpedVRT initialized from the data source.  Example:
+            with WarpedVRT(
+                src,
+                crs="EPSG:3857",
+                nodata=src.nodata,
+                resampling=Resampling.nearest,
+                width=tile_size,
+                height=tile_size,
+            ) as vrt
+    tile : mercantile.Tile
+        Tile object describing z, x, y coordinates
+    tile_size : int, optional (default 256)
+        length and width of tile
+    metrics : datatiles.metrics.Metrics, optional (default NULL_METRICS)
+        receives timings of the "window" and "read" stages
+    buffers : TileBufferPool, optional (default None)
+        if provided, data are read into a buffer acquired from buffers, which
+        the caller must release when done with it.
+
+    Returns
+    -------
+    tuple of numpy array of data with shape (tile_size, tile_size), tile transform object
+    """
+
+    with metrics.timer("window"):
+        grid = get_tile_grid(
+            vrt, tile.z, np.array([tile.x]), np.array([tile.y]), tile_size
+        )
+
+    return _read_grid_tile(vrt, grid[0].item(), tile_size, metrics, buffers)
+
+
+def get_tile_range(bounds, zoom):
+    """Get the range of tiles at zoom that overlap bounds, matching the tiles
+    returned by mercantile.tiles.
+
+    Parameters
+    ----------
+    bounds : tuple of (west, south, east, north) in geographic coordinates
+    zoom : int
+
+    Returns
+    -------
+    tuple of upper left tile, lower right tile (mercantile.Tile)
+    """
+
+    w, s, e, n = bounds
+    ul = mercantile.tile(w, n, zoom)
+    lr = mercantile.tile(e - mercantile.LL_EPSILON, s + mercantile.LL_EPSILON, zoom)
+    return ul, lr
+
+
+def is_uniform(data):
+    """Determine if all values of the tile data are the same.
+
+    Parameters
+    ----------
+    data : numpy array
+
+    Returns
+    -------
+    bool
+    """
+
+    return bool(np.all(data == data.flat[0]))
 
 
-def read_tiles(src, min_zoom=0, max_zoom=None, tile_size=256):
+def _is_uniform_in_source(src, tile, value, rows=1024):
+    """Determine if all pixels of src within the bounds of tile are value, at the
+    full resolution of src.
+
+    The source is read in strips of rows, stopping at the first strip that has
+    any other value or nodata.
+
+    Parameters
+    ----------
+    src : rasterio.DatasetReader
+    tile : mercantile.Tile
+    value : number
+    rows : int, optional (default 1024)
+        number of rows read at a time
+
+    Returns
+    -------
+    bool
+    """
+
+    bounds = transform_bounds("EPSG:3857", src.crs, *mercantile.xy_bounds(tile))
+    window = from_bounds(*bounds, transform=src.transform)
+    col_off = max(math.floor(window.col_off), 0)
+    row_off = max(math.floor(window.row_off), 0)
+    col_end = min(math.ceil(window.col_off + window.width), src.width)
+    row_end = min(math.ceil(window.row_off + window.height), src.height)
+
+    if col_end <= col_off or row_end <= row_off:
+        return False
+
+    for row in range(row_off, row_end, rows):
+        data = src.read(
+            1,
+            window=Window(col_off, row, col_end - col_off, min(rows, row_end - row)),
+            masked=True,
+        )
+        if np.ma.is_masked(data) or np.any(data.data != value):
+            return False
+
+    return True
+
+
+def is_prunable(src, tile, data):
+    """Determine if the descendants of a tile can be pruned because they all have
+    the same value as tile data read from src.
+
+    Tiles that are entirely nodata are never pruned, because data at lower zoom
+    levels may be sampled from only some pixels of src and miss small areas of
+    data.  For the same reason, a tile that is uniform is only pruned if every
+    pixel of src within the tile has the same value at full resolution.
+
+    Parameters
+    ----------
+    src : rasterio.DatasetReader
+    tile : mercantile.Tile
+    data : numpy array of tile data
+
+    Returns
+    -------
+    bool
+    """
+
+    if not is_uniform(data):
+        return False
+
+    value = data.flat[0]
+    if src.nodata is not None and value == src.nodata:
+        return False
+
+    return _is_uniform_in_source(src, tile, value)
+
+
+def get_descendants(tile, max_zoom, bounds):
+    """Generator of the descendants of tile down to max_zoom that overlap bounds.
+
+    Parameters
+    ----------
+    tile : mercantile.Tile
+    max_zoom : int
+    bounds : tuple of (west, south, east, north) in geographic coordinates
+
+    Yields
+    ------
+    mercantile.Tile
+    """
+
+    for zoom in range(tile.z + 1, max_zoom + 1):
+        ul, lr = get_tile_range(bounds, zoom)
+        scale = 2 ** (zoom - tile.z)
+        for x in range(max(tile.x * scale, ul.x), min((tile.x + 1) * scale, lr.x + 1)):
+            for y in range(
+                max(tile.y * scale, ul.y), min((tile.y + 1) * scale, lr.y + 1)
+            ):
+                yield mercantile.Tile(x, y, zoom)
+
+
+def read_tiles(
+    src,
+    min_zoom=0,
+    max_zoom=None,
+    tile_size=256,
+    overview_levels=None,
+    metrics=None,
+    prune=False,
+    reuse_buffers=False,
+    pruned=None,
+):
     """This function is a generator that reads all tiles 
     that overlap with the extent of src between min_zoom and max_zoom.
+
+    At each zoom level, tiles are read from the overview of src that most closely
+    matches the resolution of the tiles, if src has overviews.
     
     Parameters
     ----------
@@ -37,100 +497,259 @@ def read_tiles(src, min_zoom=0, max_zoom=None, tile_size=256):
         If None, max_zoom will be calculated based on the extent of src
     tile_size : int, optional (default 256)
         length and width of tile
+    overview_levels : dict of {<zoom>: <overview level>}, optional (default None)
+        overview level of src to read for each zoom level, as a 0-based index
+        into src.overviews(1), or None to read full resolution data.
+        If None, these are calculated using get_overview_levels.
+    metrics : datatiles.metrics.Metrics, optional (default None)
+        receives timings of the "window", "read", and "prune" stages and the count
+        of "tiles"
+    prune : bool, optional (default False)
+        if True, the descendants of tiles where all values are the same, and
+        every pixel of src within the tile has that value at full resolution,
+        are not read; see is_prunable.  Tiles that are entirely nodata are
+        always read.  Tiles are then read in order by parent tile within each
+        zoom level.
+    reuse_buffers : bool, optional (default False)
+        if True, tiles are read into a small pool of reusable arrays instead of
+        new arrays.  Each data array is only valid until the next tile is
+        requested from the generator, after which it will be overwritten; it
+        must be copied if it is to be kept.
+    pruned : set, optional (default None)
+        if provided and prune is True, each tile whose descendants are not read
+        is added to this set before the tile is yielded.
     
     Yields
     ------
     tile (mercantile.Tile), tile data (of shape (tile_size, tile_size)), and tile transform
     """
 
-    def _read_tile(vrt, tile, tile_size=256):
-        """Read a tile of data from the VRT.
+    if max_zoom is None:
+        max_zoom = get_default_max_zoom(src)
+
+    zooms = range(min_zoom, max_zoom + 1)
+    if overview_levels is None:
+        overview_levels = get_overview_levels(src, zooms, tile_size)
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    bounds = get_geo_bounds(src)
+
+    buffers = None
+    if reuse_buffers:
+        buffers = TileBufferPool(tile_size, src.dtypes[0], src.nodata)
+
+    # tiles at the previous zoom level that were not uniform, if pruning
+    parents = None
+
+    for zoom in zooms:
+        ul, lr = get_tile_range(bounds, zoom)
+
+        if parents is None:
+            # all tiles in range, ordered by x then y
+            num_rows = lr.y - ul.y + 1
+            num_tiles = (lr.x - ul.x + 1) * num_rows
+            chunks = (
+                np.arange(start, min(start + GRID_CHUNK_SIZE, num_tiles))
+                for start in range(0, num_tiles, GRID_CHUNK_SIZE)
+            )
+            chunks = (
+                (ul.x + index // num_rows, ul.y + index % num_rows) for index in chunks
+            )
+
+        else:
+            # children of each parent, in the same order as mercantile.children
+            xs = (2 * parents[:, :1] + [0, 1, 1, 0]).ravel()
+            ys = (2 * parents[:, 1:] + [0, 0, 1, 1]).ravel()
+            in_range = (xs >= ul.x) & (xs <= lr.x) & (ys >= ul.y) & (ys <= lr.y)
+            chunks = [(xs[in_range], ys[in_range])]
+
+        if prune:
+            parents = []
+
+        with open_tile_vrt(src, overview_levels.get(zoom), tile_size) as vrt:
+            for xs, ys in chunks:
+                with metrics.timer("window"):
+                    grid = get_tile_grid(vrt, zoom, xs, ys, tile_size)
+
+                for entry in grid.tolist():
+                    tile = mercantile.Tile(entry[0], entry[1], zoom)
+                    data, transform = _read_grid_tile(
+                        vrt, entry, tile_size, metrics, buffers
+                    )
+                    metrics.count("tiles")
+
+                    if prune:
+                        with metrics.timer("prune"):
+                            prunable = is_prunable(src, tile, data)
+
+                        if not prunable:
+                            parents.append((tile.x, tile.y))
+                        elif pruned is not None:
+                            pruned.add(tile)
+
+                    yield tile, data, transform
+
+                    if buffers is not None:
+                        buffers.release(data)
+
+        if prune:
+            parents = np.array(parents, dtype="int64").reshape(-1, 2)
+
+
+def get_outputs(outputs, tile_renderer):
+    """Get a list of (tile_renderer, output) pairs from either a single output,
+    rendered using tile_renderer, or a list of pairs.
+
+    Parameters
+    ----------
+    outputs : path or list of (tile_renderer, path) tuples
+    tile_renderer : function
+        used if outputs is a single path
+
+    Returns
+    -------
+    list of (tile_renderer, path) tuples
+    """
+
+    if isinstance(outputs, (list, tuple)):
+        if not outputs:
+            raise ValueError("at least one output is required")
+        return list(outputs)
+
+    return [(tile_renderer, outputs)]
+
+
+def get_tile_format(tile_renderer):
+    """Get the image format of tiles rendered by tile_renderer.
+
+    Parameters
+    ----------
+    tile_renderer : function, or functools.partial of one
+
+    Returns
+    -------
+    str: "webp" if tile_renderer is datatiles.webp.to_smallest_webp, otherwise "png"
+    """
+
+    while isinstance(tile_renderer, partial):
+        tile_renderer = tile_renderer.func
+
+    if tile_renderer is to_smallest_webp:
+        return "webp"
+
+    return "png"
+
+
+def render_tile(data, renderers, metrics=NULL_METRICS):
+    """Render tile data using each renderer.
+
+    Parameters
+    ----------
+    data : numpy array of tile data
+    renderers : list of functions that take as input the data array and return
+        a PNG, or None if the tile is not written
+    metrics : datatiles.metrics.Metrics, optional (default NULL_METRICS)
+        receives timings of the "render" stage
+
+    Returns
+    -------
+    list of PNG bytes or None, one per renderer
+    """
+
+    pngs = []
+    with metrics.timer("render"):
+        for renderer in renderers:
+            pngs.append(renderer(data))
+
+    return pngs
+
 
-        If the tile bounds fall outside the vrt bounds, we have to calculate
-        offsets and widths ourselves (because WarpedVRT does not allow boundless reads)
-        and paste the data that were read into an otherwise blank tile (filled with Nodata value).
-        
+class DirectoryWriter(object):
+    """
+    Write tiles to files in subdirectories of a path:
+    <path>/<zoom>/<x>/<y>.png
+
+    Files are written using a pool of threads, so that writing tiles does not
+    block reading and rendering tiles.  The directory of each tile column is
+    created when its first tile is written, so that no empty directories are
+    left for columns without any tiles.
+    """
+
+    def __init__(self, path, threads=4, ext="png"):
+        """
         Parameters
         ----------
-        vrt : rasterio.WarpedVRT
-            WarpedVRT initialized from the data source.  Example:
-                with WarpedVRT(
-                    src,
-                    crs="EPSG:3857",
-                    nodata=src.nodata,
-                    resampling=Resampling.nearest,
-                    width=tile_size,
-                    height=tile_size,
-                ) as vrt
-        tile : mercantile.Tile
-            Tile object describing z, x, y coordinates
-        tile_size : int, optional (default 256)
-            length and width of tile   
-
-        Returns
-        -------
-        tuple of numpy array of data with shape (tile_size, tile_size), tile transform object
+        path : root path of output tiles
+        threads : int, optional (default 4)
+            number of threads used to write files
+        ext : str, optional (default "png")
+            file extension of tiles
         """
 
-        tile_bounds = mercantile.xy_bounds(*tile)
-        window = vrt.window(*tile_bounds)
+        self.path = path
+        self.ext = ext
+        self._dirs = {}
+        self._executor = ThreadPoolExecutor(max_workers=threads)
 
-        dst_transform = vrt.window_transform(window)
-        scaling = Affine.scale(window.width / tile_size, window.height / tile_size)
-        dst_transform *= scaling
+        # limit the number of tiles held in memory waiting to be written
+        self._pending = deque()
+        self._max_pending = threads * 16
 
-        x_res = abs(dst_transform.a)
-        y_res = abs(dst_transform.e)
+    def __enter__(self):
+        return self
 
-        left_offset = max(int(round((vrt.bounds[0] - tile_bounds[0]) / x_res, 0)), 0)
-        right_offset = max(int(round((tile_bounds[2] - vrt.bounds[2]) / x_res, 0)), 0)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-        bottom_offset = max(int(round((vrt.bounds[1] - tile_bounds[1]) / y_res, 0)), 0)
-        top_offset = max(int(round((tile_bounds[3] - vrt.bounds[3]) / y_res, 0)), 0)
+    def _get_dir(self, z, x):
+        outdir = self._dirs.get((z, x))
+        if outdir is None:
+            outdir = os.path.join(self.path, str(z), str(x))
+            os.makedirs(outdir, exist_ok=True)
+            self._dirs[(z, x)] = outdir
 
-        width = tile_size - left_offset - right_offset
-        height = tile_size - top_offset - bottom_offset
+        return outdir
 
-        if not (width > 0 and height > 0):
-            # No data can be read within an window that has no width or height
-            # so return a blank tile
-            data = np.empty((1, tile_size, tile_size), dtype=vrt.dtypes[0])
-            data.fill(vrt.nodata)
+    def write_tile(self, z, x, y, data):
+        """Write a tile to <path>/<z>/<x>/<y>.<ext>.
 
-            return data[0], dst_transform
+        The file is written in the background; errors are raised from a later
+        call to write_tile or close.
 
-        data = vrt.read(out_shape=(1, height, width), window=window)
+        Parameters
+        ----------
+        z : int
+            zoom level
+        x : int
+            tile column
+        y : int
+            tile row (XYZ scheme)
+        data : bytes
+            tile data bytes
+        """
 
-        if width != tile_size or height != tile_size:
-            # Create a blank tile (filled with nodata) and paste in data
-            out = np.empty((1, tile_size, tile_size), dtype=vrt.dtypes[0])
-            out.fill(vrt.nodata)
-            out[
-                0,
-                top_offset : top_offset + data.shape[1],
-                left_offset : left_offset + data.shape[2],
-            ] = data
-            data = out
+        filename = "{}{}{}.{}".format(self._get_dir(z, x), os.sep, y, self.ext)
 
-        return data[0], dst_transform
+        while len(self._pending) >= self._max_pending:
+            self._pending.popleft().result()
 
-    with WarpedVRT(
-        src,
-        crs="EPSG:3857",
-        nodata=src.nodata,
-        resampling=Resampling.nearest,
-        width=tile_size,
-        height=tile_size,
-    ) as vrt:
+        self._pending.append(self._executor.submit(_write_file, filename, data))
 
-        if max_zoom is None:
-            get_default_max_zoom(src)
+    def close(self):
+        """Wait for all tiles to be written."""
 
-        tiles = mercantile.tiles(*get_geo_bounds(src), range(min_zoom, max_zoom + 1))
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown()
 
-        for tile in Counter("Extracting tiles...    ").iter(tiles):
-            data, transform = _read_tile(vrt, tile, tile_size)
-            yield tile, data, transform
+
+def _write_file(filename, data):
+    with open(filename, "wb") as out:
+        out.write(data)
 
 
 def tif_to_tiles(
@@ -140,47 +759,130 @@ def tif_to_tiles(
     max_zoom,
     tile_size=256,
     tile_renderer=to_smallest_png,
+    overview_resampling=None,
+    metrics=None,
+    prune=None,
+    threads=4,
+    ext="png",
+    progress=False,
 ):
     """Convert a tif to image tiles, rendered according to tile_renderer.
 
     By default, tiles are rendered as data using the smallest PNG image type.
 
+    Low zoom tiles are read from overviews of infilename, if present.
+
     Images will be stored in subdirectories under path:
-    <outpath>/<zoom>/<x>/<y>.png
+    <outpath>/<zoom>/<x>/<y>.<ext>
+
+    Each tile can be rendered to several outputs from a single read of the
+    data, by passing a list of (tile_renderer, outpath) pairs as outpath.
     
     Note: tile x,y,z coordinates follow the XYZ scheme to match their numbering in an mbtiles file.
 
     Parameters
     ----------
-    infilename : path to input GeoTIFF file
-    path : root path of output tiles
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
+    outpath : root path of output tiles, or list of (tile_renderer, outpath) tuples
     min_zoom : int, optional (default: 0)
     max_zoom : int, optional (default: None, which means it will automatically be calculated from extent)
     tile_size : int, optional (default: 256)
     tile_renderer : function, optional (default: to_smallest_png)
-        function that takes as input the data array for the tile and returns a PNG
+        function that takes as input the data array for the tile and returns a PNG,
+        or None to not write the tile.
+        Not used if outpath is a list of (tile_renderer, outpath) tuples.
+    overview_resampling : str, optional (default: None)
+        one of "nearest", "mode".  If provided and infilename does not have
+        overviews, overviews are built using this resampling method in a temporary
+        copy of infilename, which is used to create tiles.
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of each stage of reading and writing tiles, and counts
+        of tiles read, skipped, and written and bytes written
+    prune : str, optional (default: None)
+        one of "overzoom", "duplicate".  If provided, the descendants of tiles where
+        all values are the same are not read.  If "overzoom", they are not written,
+        and clients are expected to overzoom the uniform tile.  If "duplicate",
+        the uniform tile is written in place of each descendant.
+        See read_tiles for limitations.
+    threads : int, optional (default: 4)
+        number of threads used to write tiles
+    ext : str, optional (default: "png")
+        file extension of tiles, such as "webp" if tile_renderer is
+        datatiles.webp.to_smallest_webp
+    progress : bool, optional (default: False)
+        if True, the number of tiles read is displayed using ProgressMetrics
     """
 
-    with rasterio.open(infilename) as src:
+    if prune not in (None, "overzoom", "duplicate"):
+        raise ValueError("prune must be one of: overzoom, duplicate")
+
+    if progress:
+        metrics = ProgressMetrics(metrics)
+    elif metrics is None:
+        metrics = NULL_METRICS
+
+    outputs = get_outputs(outpath, tile_renderer)
+    renderers = [renderer for renderer, _ in outputs]
+
+    with overviews_source(
+        infilename, overview_resampling, metrics
+    ) as infilename, ExitStack() as stack:
+        src = stack.enter_context(open_source(infilename))
+        writers = [
+            stack.enter_context(DirectoryWriter(path, threads=threads, ext=ext))
+            for _, path in outputs
+        ]
+
+        if max_zoom is None:
+            max_zoom = get_default_max_zoom(src)
+
+        bounds = get_geo_bounds(src)
+
+        # tiles whose descendants were not read
+        pruned = set()
 
         for tile, data, transform in read_tiles(
-            src, min_zoom=min_zoom, max_zoom=max_zoom, tile_size=tile_size
+            src,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            tile_size=tile_size,
+            metrics=metrics,
+            prune=prune is not None,
+            reuse_buffers=True,
+            pruned=pruned,
         ):
             # Only write non-empty tiles
-            if not np.all(data == src.nodata):
+            with metrics.timer("empty"):
+                empty = np.all(data == src.nodata)
+
+            if empty:
+                metrics.count("skipped")
+                continue
+
+            tiles = [tile]
+            if prune == "duplicate" and tile in pruned:
+                # descendants were not read; they have the same data
+                tiles.extend(get_descendants(tile, max_zoom, bounds))
+
+            pngs = render_tile(data, renderers, metrics)
 
-                # flip tile Y to match xyz scheme
-                tiley = int(math.pow(2, tile.z)) - tile.y - 1
+            # renderers return None for tiles that are not written
+            written = [(w, png) for w, png in zip(writers, pngs) if png is not None]
+            if not written:
+                metrics.count("skipped")
+                continue
 
-                outfilename = "{path}/{z}/{x}/{y}.png".format(
-                    path=outpath, z=tile.z, x=tile.x, y=tile.y
-                )
-                outdir = os.path.dirname(outfilename)
-                if not os.path.exists(outdir):
-                    os.makedirs(outdir)
+            with metrics.timer("write"):
+                for writer, png in written:
+                    for t in tiles:
+                        writer.write_tile(t.z, t.x, t.y, png)
 
-                with open(outfilename, "wb") as out:
-                    out.write(tile_renderer(data))
+            metrics.count("written", len(tiles) * len(written))
+            metrics.count("bytes", sum(len(png) for _, png in written) * len(tiles))
+
+    if progress:
+        metrics.finish()
 
 
 def render_tif_to_tiles(
@@ -188,8 +890,8 @@ def render_tif_to_tiles(
 ):
     """Convert a tif to image tiles, rendered according to the colormap.
 
-    The tif is first converted into an indexed image that matches the number of colors in the colormap,
-    and all values not in the colormap are masked out.
+    Values are converted to the index of their color in the colormap as each tile
+    is rendered, and all values not in the colormap are transparent.
 
     Images will be stored in subdirectories under path:
     <outpath>/<zoom>/<x>/<y>.png
@@ -198,7 +900,8 @@ def render_tif_to_tiles(
 
     Parameters
     ----------
-    infilename : path to input GeoTIFF file
+    infilename : path to input GeoTIFF file, rasterio.io.MemoryFile, or
+        rasterio.DatasetReader
     path : root path of output tiles
     colormap : dict of values to hex color codes
     min_zoom : int, optional (default: 0)
@@ -210,33 +913,23 @@ def render_tif_to_tiles(
     values = sorted(colormap.keys())
     palette = np.array([hex_to_rgb(colormap[value]) for value in values], dtype="uint8")
 
-    with TemporaryDirectory() as tmpdir:
-        with rasterio.Env() as env:
-            with rasterio.open(infilename) as src:
-                if src.count > 1:
-                    raise ValueError("tif must be single band")
-
-                # Convert the image to indexed, if necessary
-                unique_values = np.unique(src.read(1, masked=True))
-                unique_values = [v for v in unique_values if v is not np.ma.masked]
-
-                if len(set(unique_values).difference(values)):
-                    # convert the image to indexed
-                    print("Converting tif to indexed tif")
-                    indexedfilename = os.path.join(tmpdir, "indexed.tif")
-                    to_indexed_tif(infilename, indexedfilename, values)
-
-                else:
-                    indexedfilename = infilename
-
-            paletted_renderer = partial(
-                to_paletted_png, palette=palette, nodata=src.nodata
-            )
-            tif_to_tiles(
-                indexedfilename,
-                outpath,
-                min_zoom,
-                max_zoom,
-                tile_size,
-                tile_renderer=paletted_renderer,
-            )
+    with open_source(infilename) as src:
+        if src.count > 1:
+            raise ValueError("tif must be single band")
+
+        nodata = src.nodata
+
+    # values are mapped to the index of their color in the palette as each tile
+    # is rendered; values not in the colormap are transparent, and tiles that
+    # are entirely transparent are not written
+    paletted_renderer = partial(
+        to_paletted_png, palette=palette, nodata=nodata, values=values, skip_empty=True
+    )
+    tif_to_tiles(
+        infilename,
+        outpath,
+        min_zoom,
+        max_zoom,
+        tile_size,
+        tile_renderer=paletted_renderer,
+    )
@@ -0,0 +1,197 @@
+"""Render a single layer of encoded data tiles as paletted tiles"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
+import json
+import sqlite3
+
+import numpy as np
+from pymbtiles import MBtiles, Tile
+
+from datatiles.metrics import NULL_METRICS
+from datatiles.png import to_paletted_png
+from datatiles.rgb import hex_to_rgb
+from datatiles.webp import decode_tile
+
+
+def get_layer_lookup(encoding, layer_id, colormap):
+    """Create a lookup table from the encoded index of a layer to the index of its
+    color in the palette.
+
+    Parameters
+    ----------
+    encoding : dict
+        encoding metadata returned by encode_tifs
+    layer_id : str
+        id of the layer to render
+    colormap : dict of layer values to hex color codes
+
+    Returns
+    -------
+    tuple of (uint8 numpy array of palette indexes for each encoded index, with
+    the nodata index for layer nodata and values not in colormap; numpy array of
+    palette colors)
+    """
+
+    if encoding["type"] != "exponential":
+        raise NotImplementedError("other encoding types not yet supported")
+
+    layer_ids = [layer["id"] for layer in encoding["layers"]]
+    if layer_id not in layer_ids:
+        raise ValueError("layer is not present in encoding: {}".format(layer_id))
+
+    layer = encoding["layers"][layer_ids.index(layer_id)]
+
+    values = sorted(colormap.keys())
+    if len(values) > 254:
+        raise ValueError("colormap must have less than 255 colors")
+
+    palette = np.array([hex_to_rgb(colormap[value]) for value in values], dtype="uint8")
+    nodata_index = len(values)
+
+    palette_indexes = {value: i for i, value in enumerate(values)}
+    lookup = np.full(encoding["base"], nodata_index, dtype="uint8")
+    for i, value in enumerate(layer.get("values", range(layer["nodata"]))):
+        if value in palette_indexes:
+            lookup[i] = palette_indexes[value]
+
+    lookup[layer["nodata"]] = nodata_index
+
+    return lookup, palette
+
+
+def _render_layer(data, dtype, nodata, base, factor, lookup, palette):
+    """Decode a tile, extract a layer, and render it as a paletted PNG.
+
+    Called in a separate process.
+
+    Returns
+    -------
+    PNG bytes, or None if the layer has no data in the tile
+    """
+
+    encoded = decode_tile(data, dtype).astype("int64")
+    indexes = lookup[(encoded // factor) % base]
+
+    nodata_index = len(palette)
+    indexes[encoded == nodata] = nodata_index
+    if np.all(indexes == nodata_index):
+        return None
+
+    return to_paletted_png(indexes, palette, nodata=nodata_index)
+
+
+def transcode_layer(
+    infilename,
+    outfilename,
+    layer_id,
+    colormap,
+    metadata=None,
+    encoding=None,
+    processes=None,
+    batch_size=1000,
+    metrics=None,
+):
+    """Render a single layer of an mbtiles file of encoded data tiles as paletted
+    PNG tiles, without reading the source rasters.
+
+    Only the target layer is decoded from each tile, and its values are rendered
+    according to the colormap in a pool of processes.  Values not in the colormap
+    are transparent, and tiles where the layer has no data are not written.
+
+    Identical tiles within each batch are only rendered once.
+
+    Parameters
+    ----------
+    infilename : path to input mbtiles file of tiles created from encode_tifs output
+    outfilename : path to output mbtiles file
+    layer_id : str
+        id of the layer to render
+    colormap : dict of layer values to hex color codes
+    metadata : dict, optional
+        metadata dictionary to add to the mbtiles metadata
+    encoding : dict, optional (default: None)
+        encoding metadata returned by encode_tifs.  If None, it is read from
+        the JSON "encoding" entry in the mbtiles metadata.
+    processes : int, optional (default: None)
+        number of processes to use.  If None, the number of CPUs is used.
+    batch_size : int, optional (default: 1000)
+        number of tiles to read, render, and write at a time
+    metrics : datatiles.metrics.Metrics, optional (default: None)
+        receives timings of the "read", "render", and "write" stages, and counts
+        of tiles read, skipped, and written and bytes written
+    """
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    with MBtiles(infilename, mode="r") as src:
+        if encoding is None:
+            if "encoding" not in src.meta:
+                raise ValueError(
+                    "encoding must be provided if not present in mbtiles metadata"
+                )
+
+            encoding = json.loads(src.meta["encoding"])
+
+        lookup, palette = get_layer_lookup(encoding, layer_id, colormap)
+        layer_index = [layer["id"] for layer in encoding["layers"]].index(layer_id)
+
+        render = partial(
+            _render_layer,
+            dtype=encoding["dtype"],
+            nodata=encoding["nodata"],
+            base=encoding["base"],
+            factor=encoding["base"] ** layer_index,
+            lookup=lookup,
+            palette=palette,
+        )
+
+        meta = {k: v for k, v in src.meta.items() if k != "encoding"}
+        # tiles are always rendered as paletted PNG, whatever the source format
+        meta["format"] = "png"
+        if metadata is not None:
+            meta.update(metadata)
+
+        # pymbtiles does not support reading tiles in batches
+        db = sqlite3.connect("file:{0}?mode=ro".format(infilename), uri=True)
+
+        with closing(db), MBtiles(outfilename, mode="w") as out, ProcessPoolExecutor(
+            max_workers=processes
+        ) as executor:
+            out.meta = meta
+
+            cursor = db.execute(
+                "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+            )
+
+            while True:
+                with metrics.timer("read"):
+                    rows = cursor.fetchmany(batch_size)
+
+                if not rows:
+                    break
+
+                metrics.count("tiles", len(rows))
+
+                # render identical tiles once
+                tiles = {}
+                for z, x, y, data in rows:
+                    tiles.setdefault(bytes(data), []).append((z, x, y))
+
+                with metrics.timer("render"):
+                    pngs = list(executor.map(render, tiles, chunksize=16))
+
+                with metrics.timer("write"):
+                    written = [
+                        Tile(z, x, y, png)
+                        for coords, png in zip(tiles.values(), pngs)
+                        if png is not None
+                        for z, x, y in coords
+                    ]
+                    out.write_tiles(written)
+
+                metrics.count("skipped", len(rows) - len(written))
+                metrics.count("written", len(written))
+                metrics.count("bytes", sum(len(tile.data) for tile in written))
@@ -1,3 +1,6 @@
+from collections import deque
+
+
 def get_dtype(max_value):
     """
     Calculate the appropriate dtype that will contain the max value
@@ -47,3 +50,31 @@ def get_nodata_value(max_value):
         return 4294967295
 
     raise Exception("value is too large for uint32 / rgba")
+
+
+def map_ordered(executor, fn, args, max_pending):
+    """Like executor.map, but only submits up to max_pending tasks ahead of the
+    result being consumed, so that results do not accumulate in memory.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+    fn : function
+        called with each item of args
+    args : iterable
+    max_pending : int
+        maximum number of tasks submitted ahead of the result being consumed
+
+    Yields
+    ------
+    result of fn for each item of args, in order
+    """
+
+    pending = deque()
+    for arg in args:
+        pending.append(executor.submit(fn, arg))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
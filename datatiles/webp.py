@@ -0,0 +1,173 @@
+"""Lossless WebP processing functions"""
+
+from io import BytesIO
+from time import perf_counter
+
+import numpy as np
+from numpy.ma.core import is_masked
+from PIL import Image
+
+from datatiles.png import (
+    MAX_VALUE,
+    from_png,
+    get_smallest_image_type,
+    to_image,
+    to_smallest_png,
+)
+from datatiles.rgb import from_rgb_array
+
+
+def to_smallest_webp(arr, image_type=None, method=4, verify=False):
+    """
+    Convert an array to a lossless WebP, using the same encoding of values to
+    colors as to_smallest_png.
+
+    WebP images are always stored as RGB, so uint8 arrays are stored as gray
+    pixels and arrays of larger data types as RGB, even if their values would
+    fit in 8 bits; use from_webp with the dtype of arr, such as the dtype of the
+    encoding, to decode them.
+
+    Parameters
+    ----------
+    arr: input array or masked array, must have dtype of uint8, uint16, or uint32
+    image_type : str, optional (default: None)
+        one of "L", "RGB".  If None, the smallest image type is used.
+    method : int, optional (default: 4)
+        compression effort, from 0 (fastest) to 6 (smallest)
+    verify : bool, optional (default: False)
+        if True, the WebP is decoded using from_webp and compared to the input,
+        with masked values filled as for to_image, to verify that the values are
+        exact
+
+    Raises
+    ------
+    ValueError
+        raised if verify is True and decoded values do not match the input
+
+    Returns
+    -------
+    WebP bytes
+    """
+
+    if image_type is None:
+        image_type = get_smallest_image_type(arr)
+        if image_type == "L" and arr.dtype != np.uint8:
+            # from_webp decodes gray pixels according to the dtype, not the values
+            image_type = "RGB"
+
+    img = to_image(arr, image_type)
+    if img.mode == "L":
+        img = img.convert("RGB")
+
+    buf = BytesIO()
+    img.save(buf, "WEBP", lossless=True, quality=100, method=method, exact=True)
+    webp = buf.getvalue()
+
+    if verify:
+        if is_masked(arr):
+            expected = arr.filled(MAX_VALUE[image_type])
+        else:
+            expected = np.ma.getdata(arr)
+
+        if not np.array_equal(from_webp(webp, dtype=arr.dtype), expected):
+            raise ValueError("Decoded WebP values do not match input")
+
+    return webp
+
+
+def from_webp(webp, dtype="uint32"):
+    """
+    Decode WebP bytes created by to_smallest_webp back to integer values.
+
+    Parameters
+    ----------
+    webp : WebP bytes
+    dtype : str, optional (default: "uint32")
+        data type of the encoded values, such as the "dtype" of the encoding
+        metadata.  uint8 values are decoded from gray pixels, other values from
+        RGB pixels.
+
+    Returns
+    -------
+    numpy array of shape (height, width)
+    """
+
+    rgb = np.asarray(Image.open(BytesIO(webp)).convert("RGB"))
+
+    if np.dtype(dtype) == np.uint8:
+        return rgb[..., 0]
+
+    return from_rgb_array(rgb)
+
+
+def decode_tile(data, dtype="uint32"):
+    """
+    Decode PNG or lossless WebP tile bytes created by to_smallest_png or
+    to_smallest_webp back to integer values.
+
+    Parameters
+    ----------
+    data : PNG or WebP bytes
+    dtype : str, optional (default: "uint32")
+        data type of the encoded values, used to decode WebP tiles
+
+    Returns
+    -------
+    numpy array of shape (height, width)
+    """
+
+    if data[8:12] == b"WEBP":
+        return from_webp(data, dtype=dtype)
+
+    return from_png(data)
+
+
+def compare_to_png(arrays, method=4):
+    """Render each array as both PNG and lossless WebP, verify that the values
+    decoded from each WebP exactly match those decoded from the PNG, and compare
+    total size and time to render.
+
+    Use tiles read using datatiles.tiles.read_tiles as a sample of the tiles that
+    would be created.
+
+    Parameters
+    ----------
+    arrays : iterable of tile data arrays, as passed to to_smallest_png
+    method : int, optional (default: 4)
+        compression effort of WebP, from 0 (fastest) to 6 (smallest)
+
+    Returns
+    -------
+    dict of {"tiles": <tiles>, "exact": <True if all tiles match>,
+    "png": {"bytes": <bytes>, "seconds": <seconds>},
+    "webp": {"bytes": <bytes>, "seconds": <seconds>}}
+    """
+
+    results = {
+        "tiles": 0,
+        "exact": True,
+        "png": {"bytes": 0, "seconds": 0},
+        "webp": {"bytes": 0, "seconds": 0},
+    }
+
+    for arr in arrays:
+        start = perf_counter()
+        png = to_smallest_png(arr)
+        results["png"]["seconds"] += perf_counter() - start
+
+        start = perf_counter()
+        webp = to_smallest_webp(arr, method=method)
+        results["webp"]["seconds"] += perf_counter() - start
+
+        results["tiles"] += 1
+        results["png"]["bytes"] += len(png)
+        results["webp"]["bytes"] += len(webp)
+
+        # masked values are filled according to the image type of each format
+        mask = np.ma.getmaskarray(arr)
+        expected = from_png(png)[~mask]
+        decoded = from_webp(webp, dtype=arr.dtype)[~mask]
+        if not np.array_equal(decoded, expected):
+            results["exact"] = False
+
+    return results
@@ -12,7 +12,7 @@ setup(
     description='Convert raster data to tiles',
     long_description_content_type='text/markdown',
     long_description=open('README.md').read(),
-    install_requires=['rasterio>=1.0', 'Pillow', 'numpy', 'mercantile', 'pymbtiles', 'click', 'progress'],
+    install_requires=['rasterio>=1.0', 'Pillow', 'numpy', 'mercantile', 'pymbtiles~=0.5.0', 'click', 'progress'],
     include_package_data=True,
     extras_require={
         'test': ['pytest', 'pytest-cov'],
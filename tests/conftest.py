@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_bounds, from_origin
+
+from datatiles.raster import WEB_MERCATOR_CIRCUMFERENCE
+
+
+def _write_tif(filename, data, nodata=None, crs="EPSG:4326", transform=None):
+    if transform is None:
+        transform = from_bounds(-100, 30, -90, 40, data.shape[1], data.shape[0])
+
+    with rasterio.open(
+        filename,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        nodata=nodata,
+        crs=crs,
+        transform=transform,
+    ) as out:
+        out.write(data, 1)
+
+
+def _write_random_tif(filename, width=1024, height=1024, zoom=10):
+    # pixels match the resolution of 256 x 256 tiles at zoom
+    res = WEB_MERCATOR_CIRCUMFERENCE / (256 * math.pow(2, zoom))
+    _write_tif(
+        filename,
+        np.random.randint(0, 4, (height, width)).astype("uint8"),
+        nodata=255,
+        crs="EPSG:3857",
+        transform=from_origin(0, 0, res, res),
+    )
+
+
+@pytest.fixture
+def write_tif():
+    """Write a 2D array to a single band tif, by default covering 10 degrees
+    in EPSG:4326."""
+
+    return _write_tif
+
+
+@pytest.fixture
+def write_random_tif():
+    """Write a single band uint8 tif of random values from 0 to 3 in Web
+    Mercator, with nodata of 255 and pixels at the resolution of tiles at zoom."""
+
+    return _write_random_tif
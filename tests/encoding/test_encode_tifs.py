@@ -0,0 +1,243 @@
+import numpy as np
+import pytest
+import rasterio
+
+from datatiles.encoding import encode_tifs
+from datatiles.encoding.exponential import decode_array
+from datatiles.metrics import TimingMetrics
+
+
+def test_encode_tifs(tmpdir, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:5] = 255
+    b = np.random.choice([1, 2], (600, 500)).astype("uint16")
+    b[:10] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    outfilename = str(tmpdir.join("encoded.tif"))
+    metrics = TimingMetrics()
+    encoding = encode_tifs(
+        {
+            "a": {"source": str(tmpdir.join("a.tif"))},
+            "b": {"source": str(tmpdir.join("b.tif"))},
+        },
+        outfilename,
+        metrics=metrics,
+    )
+
+    for stage in ("validate", "parameters", "encode", "write", "overviews"):
+        assert stage in metrics.timings
+    assert metrics.counts["bytes"] > 0
+    assert metrics.values["base"] == encoding["base"]
+    assert metrics.values["dtype"] == encoding["dtype"]
+
+    assert encoding["base"] == 4
+    assert encoding["dtype"] == "uint8"
+    assert encoding["layers"][0]["values"] == [5, 10, 15]
+    assert encoding["layers"][1]["values"] == [1, 2]
+
+    with rasterio.open(outfilename) as src:
+        assert src.profile["tiled"]
+        assert src.block_shapes[0] == (256, 256)
+        assert src.compression.value == "DEFLATE"
+        assert src.overviews(1) == [2, 4]
+        assert src.nodata == encoding["nodata"]
+        encoded = src.read(1)
+
+    # nodata in all layers
+    assert (encoded[:5] == encoding["nodata"]).all()
+
+    indexes = decode_array(encoded[5:], base=4, size=2)
+    assert np.array_equal(
+        np.take([5, 10, 15, 255], indexes[0]), np.where(a[5:] == 255, 255, a[5:])
+    )
+    assert np.array_equal(np.take([1, 2, 0, 0], indexes[1]), b[5:])
+
+
+def test_encode_tifs_dtype(tmpdir, write_tif):
+    # layers with many and few values, where encoded values of pixels with
+    # nodata in only some layers are larger than 255
+    a = np.tile(np.arange(19, dtype="uint8"), (100, 10))[:, :100]
+    b = np.random.choice([1, 2], (100, 100)).astype("uint8")
+    b[:50] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    outfilename = str(tmpdir.join("encoded.tif"))
+    encoding = encode_tifs(
+        {
+            "a": {"source": str(tmpdir.join("a.tif"))},
+            "b": {"source": str(tmpdir.join("b.tif"))},
+        },
+        outfilename,
+    )
+
+    assert encoding["base"] == 20
+    assert encoding["dtype"] == "uint16"
+    assert encoding["nodata"] == 65535
+
+    with rasterio.open(outfilename) as src:
+        encoded = src.read(1)
+
+    assert encoded.max() > 255
+    indexes = decode_array(encoded, base=20, size=2)
+    assert np.array_equal(np.take(np.arange(19), indexes[0]), a)
+    assert np.array_equal(np.take([1, 2] + [0] * 18, indexes[1]), b)
+
+
+def test_encode_tifs_processes(tmpdir, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    # values that only occur in some windows
+    a[-1, -1] = 20
+    b = np.random.choice([1, 2, 3], (600, 500)).astype("uint16")
+    b[:300, :300] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+    sources = {
+        "a": {"source": str(tmpdir.join("a.tif"))},
+        "b": {"source": str(tmpdir.join("b.tif"))},
+    }
+
+    encoded = []
+    for processes in (1, 3):
+        outfilename = str(tmpdir.join("encoded{}.tif".format(processes)))
+        encoding = encode_tifs(sources, outfilename, blocksize=64, processes=processes)
+        assert encoding["layers"][0]["values"] == [5, 10, 15, 20]
+        assert encoding["layers"][1]["values"] == [1, 2, 3]
+
+        with rasterio.open(outfilename) as src:
+            encoded.append(src.read(1))
+
+    assert np.array_equal(encoded[0], encoded[1])
+
+    indexes = decode_array(encoded[0], base=5, size=2)
+    assert np.array_equal(np.take([5, 10, 15, 20, 255], indexes[0]), a)
+    assert np.array_equal(np.take([1, 2, 3, 0, 0], indexes[1]), b)
+
+
+def test_encode_tifs_scratch_dir(tmpdir, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:5] = 255
+    b = np.random.choice([1, 2], (600, 500)).astype("uint16")
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+    sources = {
+        "a": {"source": str(tmpdir.join("a.tif"))},
+        "b": {"source": str(tmpdir.join("b.tif"))},
+    }
+
+    outfilename = str(tmpdir.join("encoded.tif"))
+    encode_tifs(sources, outfilename, processes=2)
+
+    scratch_dir = tmpdir.mkdir("scratch")
+    scratch_outfilename = str(tmpdir.join("encoded_scratch.tif"))
+    metrics = TimingMetrics()
+    encode_tifs(
+        sources,
+        scratch_outfilename,
+        processes=2,
+        metrics=metrics,
+        scratch_dir=str(scratch_dir),
+    )
+
+    # scratch file is removed when done
+    assert scratch_dir.listdir() == []
+
+    assert metrics.values["peak_memory"] > 0
+    assert metrics.values["peak_memory_workers"] > 0
+
+    with rasterio.open(outfilename) as src, rasterio.open(scratch_outfilename) as out:
+        assert np.array_equal(src.read(1), out.read(1))
+
+
+def test_encode_tifs_quantized(tmpdir, write_tif):
+    elevation = np.random.uniform(0, 100, (600, 500)).astype("float32")
+    elevation[:5] = -9999
+    elevation[5, 0] = 0
+    elevation[5, 1] = 100
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:5] = 255
+
+    write_tif(str(tmpdir.join("elevation.tif")), elevation, nodata=-9999)
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+
+    outfilename = str(tmpdir.join("encoded.tif"))
+    encoding = encode_tifs(
+        {
+            "elevation": {
+                "source": str(tmpdir.join("elevation.tif")),
+                "type": "quantized",
+                "bins": 5,
+            },
+            "a": {"source": str(tmpdir.join("a.tif"))},
+        },
+        outfilename,
+        blocksize=128,
+    )
+
+    assert encoding["base"] == 6
+    layer = encoding["layers"][0]
+    assert layer["type"] == "quantized"
+    assert layer["nodata"] == 5
+    assert np.allclose(layer["bins"], [0, 20, 40, 60, 80, 100])
+    assert np.allclose(layer["values"], [0, 20, 40, 60, 80])
+    assert encoding["layers"][1]["values"] == [5, 10, 15]
+
+    with rasterio.open(outfilename) as src:
+        encoded = src.read(1)
+
+    assert (encoded[:5] == encoding["nodata"]).all()
+
+    indexes = decode_array(encoded[5:], base=6, size=2)
+    expected = np.clip(elevation[5:] // 20, 0, 4)
+    assert np.array_equal(indexes[0], expected)
+    assert np.array_equal(np.take([5, 10, 15], indexes[1]), a[5:])
+
+
+def test_encode_tifs_quantized_edges(tmpdir, write_tif):
+    data = np.arange(600 * 500).reshape(600, 500).astype("uint32")
+    write_tif(str(tmpdir.join("a.tif")), data)
+
+    outfilename = str(tmpdir.join("encoded.tif"))
+    encoding = encode_tifs(
+        {
+            "a": {
+                "source": str(tmpdir.join("a.tif")),
+                "type": "quantized",
+                "bins": [1000, 2000, 100000, 200000],
+            }
+        },
+        outfilename,
+    )
+
+    assert encoding["layers"][0]["values"] == [1000, 2000, 100000]
+
+    with rasterio.open(outfilename) as src:
+        encoded = src.read(1)
+
+    # values outside the edges are in the first or last bin
+    expected = np.digitize(data, [2000, 100000])
+    assert np.array_equal(encoded, expected)
+
+    with pytest.raises(ValueError):
+        encode_tifs(
+            {"a": {"source": str(tmpdir.join("a.tif")), "type": "quantized"}},
+            outfilename,
+        )
+
+    with pytest.raises(ValueError):
+        encode_tifs(
+            {
+                "a": {
+                    "source": str(tmpdir.join("a.tif")),
+                    "type": "quantized",
+                    "bins": [10, 5],
+                }
+            },
+            outfilename,
+        )
@@ -5,6 +5,7 @@ from hypothesis import given, strategies as st
 from datatiles.encoding.exponential import (
     encode,
     decode,
+    decode_array,
     ExponentialEncoder,
     ExponentialDecoder,
 )
@@ -67,6 +68,16 @@ def test_encode_decode_roundtrip(values):
     assert decode(encode(values, base=base), base=base, size=len(values)) == values
 
 
+@given(st.lists(st.integers(0, 100), min_size=1, max_size=4))
+def test_decode_array(values):
+    base = max(2, max(values) + 1)
+    encoded = np.array([encode(values, base=base)] * 3)
+
+    decoded = decode_array(encoded, base=base, size=len(values))
+    assert decoded.shape == (len(values), 3)
+    assert np.array_equal(decoded[:, 0], values)
+
+
 @given(st.lists(st.integers(0, 254), min_size=1, max_size=100))
 def test_ExponentialEncoder(values):
     base = max(2, max(values) + 1)
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+from datatiles.encoding.exponential import encode
+from datatiles.encoding.lookup import LookupDecoder
+
+
+ENCODING = {
+    "type": "exponential",
+    "base": 4,
+    "dtype": "uint8",
+    "nodata": 255,
+    "layers": [
+        {"id": "a", "nodata": 3, "type": "indexed", "values": [10, 20, 30]},
+        {"id": "b", "nodata": 3, "type": "indexed", "values": [1, 5]},
+    ],
+}
+
+
+def test_LookupDecoder():
+    decoder = LookupDecoder.from_encoding(ENCODING)
+    assert decoder.indexes.shape == (17, 2)
+
+    encoded = np.array([encode([0, 1], 4), encode([2, 0], 4), encode([3, 1], 4), 255])
+    decoded = decoder.decode(encoded)
+
+    assert decoded["a"].tolist() == [10, 30, None, None]
+    assert decoded["b"].tolist() == [5, 1, 5, None]
+
+    indexes = decoder.decode_indexes(encoded)
+    assert indexes[:, 0].tolist() == [0, 2, None, None]
+
+    # indexes past the end of the values of a layer are masked
+    decoded = decoder.decode(np.array([encode([1, 2], 4)]))
+    assert decoded["a"].tolist() == [20]
+    assert decoded["b"].tolist() == [None]
+
+
+def test_LookupDecoder_codes():
+    codes = [encode([0, 1], 4), encode([2, 0], 4)]
+    decoder = LookupDecoder.from_encoding(ENCODING, codes=codes + [255])
+    assert decoder.indexes.shape == (3, 2)
+
+    encoded = np.array(codes + [encode([1, 1], 4), 255])
+    decoded = decoder.decode(encoded)
+    assert decoded["a"].tolist() == [10, 30, None, None]
+    assert decoded["b"].tolist() == [5, 1, None, None]
+
+
+def test_LookupDecoder_too_large():
+    encoding = dict(ENCODING, base=5000)
+    with pytest.raises(ValueError):
+        LookupDecoder.from_encoding(encoding)
+
+
+def test_LookupDecoder_serialize():
+    decoder = LookupDecoder.from_encoding(ENCODING)
+    table = json.loads(json.dumps(decoder.to_dict()))
+    assert table["layers"][0]["values"][-1] is None
+
+    restored = LookupDecoder.from_dict(table)
+    encoded = np.arange(256)
+    expected = decoder.decode(encoded)
+    decoded = restored.decode(encoded)
+    for layer in ("a", "b"):
+        assert np.array_equal(decoded[layer].mask, expected[layer].mask)
+        assert np.array_equal(decoded[layer].compressed(), expected[layer].compressed())
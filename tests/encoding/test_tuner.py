@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from datatiles.encoding import encode_tifs
+from datatiles.encoding.tuner import (
+    apply_tuning,
+    get_orderings,
+    sample_windows,
+    tune_encoding,
+)
+from datatiles.png import to_smallest_png
+
+
+def test_get_orderings():
+    assert get_orderings(["a", "b"]) == [("a", "b"), ("b", "a")]
+
+    orderings = get_orderings(list("abcde"), max_orderings=10)
+    assert len(orderings) == 10
+    assert len(set(orderings)) == 10
+    assert orderings[0] == tuple("abcde")
+
+
+def test_tune_encoding(tmpdir, write_tif):
+    # a varies per pixel, b is constant in large blocks
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    b = np.kron(
+        np.random.choice([1, 2, 3], (6, 5)), np.ones((100, 100), dtype="uint8")
+    ).astype("uint8")
+    b[:10] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    sources = {
+        "b": {"source": str(tmpdir.join("b.tif"))},
+        "a": {"source": str(tmpdir.join("a.tif"))},
+    }
+
+    results = tune_encoding(sources, samples=4, processes=2)
+    assert len(results) == 2
+    assert results[0]["bytes"] <= results[1]["bytes"]
+    assert {tuple(r["order"]) for r in results} == {("a", "b"), ("b", "a")}
+    assert all(r["encoding"] == "exponential" for r in results)
+
+    tuned_sources, encoding = apply_tuning(sources, results[0])
+    assert list(tuned_sources) == results[0]["order"]
+
+    encoding = encode_tifs(tuned_sources, str(tmpdir.join("encoded.tif")), encoding)
+    assert [layer["id"] for layer in encoding["layers"]] == results[0]["order"]
+
+
+def test_tune_encoding_matches_encode_tifs(tmpdir, write_tif):
+    # with base 17, a then b encodes to at most 16 + 2 * 17 (uint8, nodata 255),
+    # but b then a encodes to at most 2 + 16 * 17 (uint16, nodata 65535)
+    a = np.random.choice(np.arange(16), (512, 512)).astype("uint8")
+    b = np.random.choice([1, 2], (512, 512)).astype("uint8")
+    a[:, :128] = 255
+    b[:, :128] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    sources = {
+        "a": {"source": str(tmpdir.join("a.tif"))},
+        "b": {"source": str(tmpdir.join("b.tif"))},
+    }
+
+    # all 4 windows are sampled
+    results = tune_encoding(sources, samples=4, processes=2)
+
+    # render the same windows from the output of encode_tifs in each order
+    expected = {}
+    for order in (("a", "b"), ("b", "a")):
+        filename = str(tmpdir.join("{}{}.tif".format(*order)))
+        encode_tifs({id: sources[id] for id in order}, filename)
+        with rasterio.open(filename) as src:
+            expected[order] = sum(
+                len(to_smallest_png(src.read(1, window=Window(col, row, 256, 256))))
+                for row in (0, 256)
+                for col in (0, 256)
+            )
+
+    assert {tuple(r["order"]): r["bytes"] for r in results} == expected
+
+    # a then b is written as grayscale, b then a as RGB
+    assert results[0]["order"] == ["a", "b"]
+    assert expected[("a", "b")] < expected[("b", "a")]
+
+
+def test_tune_encoding_empty(tmpdir, write_tif):
+    # b has no data at all, and a only has data in its upper left window
+    a = np.full((512, 512), 255, dtype="uint8")
+    a[:256, :256] = np.random.choice([1, 2, 3], (256, 256))
+    b = np.zeros((512, 512), dtype="uint8")
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    sources = {
+        "a": {"source": str(tmpdir.join("a.tif"))},
+        "b": {"source": str(tmpdir.join("b.tif"))},
+    }
+
+    sampled, counts = sample_windows(sources, samples=4)
+    assert counts == {"a": 3, "b": 0}
+    assert len(sampled["a"]) == len(sampled["b"]) == 1
+    assert sampled["b"][0].mask.all()
+
+    results = tune_encoding(sources, samples=4, processes=1)
+    assert len(results) == 2
+    assert all(r["bytes"] > 0 for r in results)
+
+    with pytest.raises(ValueError):
+        tune_encoding({"b": sources["b"]}, processes=1)
@@ -0,0 +1,136 @@
+from functools import partial
+
+import numpy as np
+import pytest
+from pymbtiles import MBtiles
+import rasterio
+
+from datatiles.archive import (
+    TileArchive,
+    TileArchiveWriter,
+    get_tile_ids,
+    get_tiles,
+    tif_to_archive,
+)
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.png import to_paletted_png
+from datatiles.raster import get_default_max_zoom
+
+
+def test_get_tile_ids():
+    for zoom in range(6):
+        n = 2 ** zoom
+        x, y = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+        x = x.ravel()
+        y = y.ravel()
+
+        tile_ids = get_tile_ids(zoom, x, y)
+        start = (4 ** zoom - 1) // 3
+        assert sorted(tile_ids.tolist()) == list(range(start, start + n * n))
+
+        # consecutive tiles along the Hilbert curve are adjacent
+        order = np.argsort(tile_ids)
+        distance = np.abs(np.diff(x[order])) + np.abs(np.diff(y[order]))
+        assert (distance == 1).all()
+
+        zooms, tile_x, tile_y = get_tiles(tile_ids)
+        assert (zooms == zoom).all()
+        assert (tile_x == x).all()
+        assert (tile_y == y).all()
+
+    zooms, x, y = get_tiles(get_tile_ids(20, 123456, 654321))
+    assert (zooms.item(), x.item(), y.item()) == (20, 123456, 654321)
+
+
+def test_archive(tmpdir):
+    filename = str(tmpdir.join("test.archive"))
+    with TileArchiveWriter(filename) as archive:
+        archive.meta = {"name": "test"}
+        archive.write_tile(3, 1, 2, b"tile-a")
+        archive.write_tile(0, 0, 0, b"tile-b")
+        archive.write_tile(3, 2, 2, b"tile-a")
+
+        with pytest.raises(ValueError):
+            archive.write_tile(32, 0, 0, b"tile-a")
+
+    with TileArchive(filename) as archive:
+        assert archive.meta == {"name": "test"}
+        assert len(archive) == 3
+        assert sorted(archive.list_tiles()) == [(0, 0, 0), (3, 1, 2), (3, 2, 2)]
+        assert bytes(archive.read_tile(3, 1, 2)) == b"tile-a"
+        assert bytes(archive.read_tile(3, 2, 2)) == b"tile-a"
+        assert bytes(archive.read_tile(0, 0, 0)) == b"tile-b"
+        assert archive.read_tile(1, 0, 0) is None
+
+    # duplicate tiles are only stored once
+    with open(filename, "rb") as f:
+        assert f.read().count(b"tile-a") == 1
+
+
+def test_tif_to_archive(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    mbtiles_filename = str(tmpdir.join("test.mbtiles"))
+    tif_to_mbtiles(filename, mbtiles_filename, 8, 10)
+
+    archive_filename = str(tmpdir.join("test.archive"))
+    tif_to_archive(filename, archive_filename, 8, 10)
+
+    with MBtiles(mbtiles_filename) as mbtiles, TileArchive(archive_filename) as archive:
+        tiles = mbtiles.list_tiles()
+        assert archive.meta["maxzoom"] == 10
+        assert len(archive) == len(tiles)
+
+        for z, x, y in tiles:
+            # mbtiles uses the TMS scheme
+            tile = archive.read_tile(z, x, 2 ** z - y - 1)
+            assert tile == mbtiles.read_tile(z, x, y)
+            tile.release()
+
+
+def test_tif_to_archive_default_max_zoom(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    archive_filename = str(tmpdir.join("test.archive"))
+    tif_to_archive(filename, archive_filename, 6, None)
+
+    with rasterio.open(filename) as src:
+        max_zoom = get_default_max_zoom(src)
+
+    with TileArchive(archive_filename) as archive:
+        assert archive.meta["maxzoom"] == max_zoom
+        assert len(archive) > 0
+
+
+def test_tif_to_archive_max_zoom(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    with pytest.raises(ValueError):
+        tif_to_archive(filename, str(tmpdir.join("test.archive")), 8, 32)
+
+
+def test_tif_to_archive_skip(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    # only tiles that have value 3 are written
+    renderer = partial(
+        to_paletted_png,
+        palette=np.array([(255, 0, 0)], dtype="uint8"),
+        values=[3],
+        skip_empty=True,
+    )
+    archive_filename = str(tmpdir.join("test.archive"))
+    tif_to_archive(filename, archive_filename, 8, 10, tile_renderer=renderer)
+
+    with TileArchive(archive_filename) as archive:
+        assert len(archive) == 1 + 4 + 16
+
+    renderer = partial(renderer, values=[10])
+    tif_to_archive(filename, archive_filename, 8, 10, tile_renderer=renderer)
+
+    with TileArchive(archive_filename) as archive:
+        assert len(archive) == 0
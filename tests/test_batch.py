@@ -0,0 +1,149 @@
+import json
+
+import numpy as np
+from pymbtiles import MBtiles
+import pytest
+
+from datatiles.batch import read_manifest, run_batch
+from datatiles.encoding import encode_tifs
+from datatiles.mbtiles import render_tif_to_mbtiles, tif_to_mbtiles
+
+
+def read_all_tiles(filename):
+    with MBtiles(filename) as src:
+        return {tuple(tile): src.read_tile(*tile) for tile in src.list_tiles()}
+
+
+def test_read_manifest(tmpdir):
+    filename = str(tmpdir.join("manifest.json"))
+    with open(filename, "w") as out:
+        json.dump(
+            [
+                {
+                    "id": "a",
+                    "type": "render",
+                    "source": "a.tif",
+                    "mbtiles": "a.mbtiles",
+                    "colormap": {"1": "#FF0000", "2.5": "#0000FF"},
+                }
+            ],
+            out,
+        )
+
+    jobs = read_manifest(filename)
+    assert jobs[0]["colormap"] == {1: "#FF0000", 2.5: "#0000FF"}
+
+    with pytest.raises(ValueError):
+        read_manifest([{"id": "a", "type": "tiles", "source": "a.tif"}])
+
+    with pytest.raises(ValueError):
+        read_manifest([{"id": "a", "type": "unknown"}])
+
+    with pytest.raises(ValueError):
+        read_manifest(
+            [
+                {"id": "a", "type": "tiles", "source": "a.tif", "mbtiles": "a"},
+                {"id": "a", "type": "tiles", "source": "b.tif", "mbtiles": "b"},
+            ]
+        )
+
+
+def test_run_batch(tmpdir, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:100] = 255
+    b = np.random.choice([1, 2], (600, 500)).astype("uint16")
+    b[:, :100] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    sources = {
+        "a": {"source": str(tmpdir.join("a.tif"))},
+        "b": {"source": str(tmpdir.join("b.tif"))},
+    }
+    colormap = {1: "#FF0000", 2: "#0000FF"}
+
+    manifest = [
+        {
+            "id": "encoded",
+            "type": "encode",
+            "sources": sources,
+            "encoded": str(tmpdir.join("encoded.tif")),
+            "mbtiles": str(tmpdir.join("encoded.mbtiles")),
+            "min_zoom": 4,
+            "max_zoom": 6,
+        },
+        {
+            "id": "a",
+            "type": "tiles",
+            "source": str(tmpdir.join("a.tif")),
+            "mbtiles": str(tmpdir.join("a.mbtiles")),
+            "min_zoom": 4,
+            "max_zoom": 6,
+            "format": "webp",
+        },
+        {
+            "id": "b",
+            "type": "render",
+            "source": str(tmpdir.join("b.tif")),
+            "mbtiles": str(tmpdir.join("b.mbtiles")),
+            "colormap": colormap,
+            "min_zoom": 4,
+            "max_zoom": 6,
+        },
+        {
+            "id": "missing",
+            "type": "tiles",
+            "source": str(tmpdir.join("missing.tif")),
+            "mbtiles": str(tmpdir.join("missing.mbtiles")),
+        },
+    ]
+
+    stages = []
+    results = run_batch(
+        manifest, processes=2, progress=lambda id, stage: stages.append((id, stage))
+    )
+
+    assert results["missing"]["error"] is not None
+    assert ("missing", "failed") in stages
+
+    for id in ("encoded", "a", "b"):
+        assert results[id]["error"] is None
+        assert (id, "done") in stages
+
+    assert results["encoded"]["outputs"] == [
+        str(tmpdir.join("encoded.tif")),
+        str(tmpdir.join("encoded.mbtiles")),
+    ]
+    for id in ("encoded", "a", "b"):
+        assert results[id]["metrics"]["tiles"].counts["written"] > 0
+
+    # outputs match those of running each job on its own
+    encoding = encode_tifs(sources, str(tmpdir.join("expected.tif")))
+    assert results["encoded"]["encoding"] == encoding
+
+    tif_to_mbtiles(
+        str(tmpdir.join("expected.tif")),
+        str(tmpdir.join("expected.mbtiles")),
+        4,
+        6,
+        encoding=encoding,
+    )
+    assert read_all_tiles(str(tmpdir.join("encoded.mbtiles"))) == read_all_tiles(
+        str(tmpdir.join("expected.mbtiles"))
+    )
+
+    render_tif_to_mbtiles(
+        str(tmpdir.join("b.tif")),
+        str(tmpdir.join("expected_b.mbtiles")),
+        colormap,
+        4,
+        6,
+    )
+    assert read_all_tiles(str(tmpdir.join("b.mbtiles"))) == read_all_tiles(
+        str(tmpdir.join("expected_b.mbtiles"))
+    )
+
+    with MBtiles(str(tmpdir.join("a.mbtiles"))) as src:
+        assert src.meta["format"] == "webp"
+        assert all(src.read_tile(*tile)[8:12] == b"WEBP" for tile in src.list_tiles())
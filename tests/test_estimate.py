@@ -0,0 +1,69 @@
+import os
+
+import rasterio
+from pymbtiles import MBtiles
+
+from datatiles.estimate import estimate_tiles
+from datatiles.mbtiles import tif_to_mbtiles
+
+
+def test_estimate_tiles(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=2048, height=1024)
+
+    # leave data in only the upper left tiles
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        data[:, 1000:] = src.nodata
+        data[600:] = src.nodata
+        src.write(data, 1)
+
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    results = tif_to_mbtiles(filename, outfilename, 8, 10, dry_run=True)
+    assert not os.path.exists(outfilename)
+
+    assert set(results["zooms"]) == {8, 9, 10}
+    assert results["zooms"][10]["tiles"] == 32
+    assert results["zooms"][10]["nonempty"] == 12
+    assert results["zooms"][10]["sampled"] == 12
+    assert results["tiles"] == sum(z["tiles"] for z in results["zooms"].values())
+    assert results["seconds"] > 0
+
+    tif_to_mbtiles(filename, outfilename, 8, 10)
+    with MBtiles(outfilename) as mbtiles:
+        tiles = mbtiles.list_tiles()
+        size = sum(len(mbtiles.read_tile(*tile)) for tile in tiles)
+
+    assert len(tiles) == results["nonempty"]
+    # all tiles at max zoom are sampled; lower zooms are extrapolated
+    assert abs(results["bytes"] - size) < 0.1 * size
+
+
+def test_estimate_tiles_sample(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    results = estimate_tiles(filename, 10, 11, samples=5)
+    assert results["zooms"][11]["tiles"] == 64
+    assert results["zooms"][11]["nonempty"] == 64
+    assert results["zooms"][11]["sampled"] == 5
+
+
+def test_dry_run_does_not_build_overviews(tmpdir, monkeypatch, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=256)
+
+    def copy_with_overviews(*args, **kwargs):
+        raise AssertionError("overviews should not be built for dry run")
+
+    monkeypatch.setattr("datatiles.raster.copy_with_overviews", copy_with_overviews)
+
+    results = tif_to_mbtiles(
+        filename,
+        str(tmpdir.join("test.mbtiles")),
+        8,
+        None,
+        overview_resampling="nearest",
+        dry_run=True,
+    )
+    assert 8 in results["zooms"]
@@ -0,0 +1,112 @@
+import numpy as np
+from pymbtiles import MBtiles
+import pytest
+import rasterio
+
+from datatiles.encoding import encode_tifs
+from datatiles.encoding.exponential import decode_array
+from datatiles.export import export_layers, get_layer_values
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.metrics import TimingMetrics
+from datatiles.png import from_png
+
+
+def test_get_layer_values():
+    lookup, nodata = get_layer_values(
+        {"id": "a", "nodata": 4, "type": "indexed", "values": [5, 10, 300]}, 5
+    )
+    assert nodata == 301
+    assert lookup.dtype == np.uint16
+    assert lookup.tolist() == [5, 10, 300, 301, 301]
+
+    lookup, nodata = get_layer_values(
+        {"id": "b", "nodata": 3, "type": "quantized", "values": [0, 0.5, 1.5]}, 4
+    )
+    assert np.isnan(nodata)
+    assert lookup.dtype == np.float64
+    assert lookup[:3].tolist() == [0, 0.5, 1.5]
+    assert np.isnan(lookup[3])
+
+    # bin edges are not rounded to float32
+    lookup, _ = get_layer_values(
+        {"id": "c", "nodata": 2, "type": "quantized", "values": [0.1, 0.2]}, 3
+    )
+    assert lookup[:2].tolist() == [0.1, 0.2]
+
+
+def test_export_layers(tmpdir, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:100] = 255
+    b = np.random.random((600, 500)).astype("float32")
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b)
+
+    encoded_filename = str(tmpdir.join("encoded.tif"))
+    encoding = encode_tifs(
+        {
+            "a": {"source": str(tmpdir.join("a.tif"))},
+            "b": {
+                "source": str(tmpdir.join("b.tif")),
+                "type": "quantized",
+                "bins": [0, 0.25, 0.5, 1],
+            },
+        },
+        encoded_filename,
+    )
+
+    filename = str(tmpdir.join("encoded.mbtiles"))
+    tif_to_mbtiles(encoded_filename, filename, 4, 6, encoding=encoding)
+
+    outdir = str(tmpdir.mkdir("layers"))
+    metrics = TimingMetrics()
+    outfilenames = export_layers(
+        filename, outdir, window_tiles=1, processes=2, metrics=metrics
+    )
+    assert sorted(outfilenames) == ["a", "b"]
+
+    with MBtiles(filename) as src, rasterio.open(
+        outfilenames["a"]
+    ) as a_out, rasterio.open(outfilenames["b"]) as b_out:
+        tiles = [tile for tile in src.list_tiles() if tile.z == 6]
+        assert metrics.counts["tiles"] == len(tiles)
+
+        assert a_out.crs.to_epsg() == 3857
+        assert a_out.nodata == 16
+        assert np.isnan(b_out.nodata)
+
+        min_x = min(x for _, x, _ in tiles)
+        max_y = max(y for _, _, y in tiles)
+
+        a_values = a_out.read(1)
+        b_values = b_out.read(1)
+        for z, x, y in tiles:
+            encoded = from_png(src.read_tile(z, x, y))
+            indexes = decode_array(encoded, base=encoding["base"], size=2)
+
+            # tile rows are stored in the TMS scheme
+            row = (max_y - y) * 256
+            col = (x - min_x) * 256
+            window = (slice(row, row + 256), slice(col, col + 256))
+
+            nodata = (encoded == encoding["nodata"]) | (indexes[0] == 3)
+            assert np.all(a_values[window][nodata] == 16)
+            assert np.array_equal(
+                a_values[window][~nodata],
+                np.array([5, 10, 15])[indexes[0][~nodata]],
+            )
+            nodata = encoded == encoding["nodata"]
+            assert np.all(np.isnan(b_values[window][nodata]))
+            assert np.array_equal(
+                b_values[window][~nodata],
+                np.array([0, 0.25, 0.5])[indexes[1][~nodata]],
+            )
+
+    outfilenames = export_layers(filename, outdir, zoom=4, layers=["b"])
+    assert list(outfilenames) == ["b"]
+
+    with rasterio.open(outfilenames["b"]) as out:
+        assert out.res[0] > b_out.res[0]
+
+    with pytest.raises(ValueError):
+        export_layers(filename, outdir, layers=["c"])
@@ -0,0 +1,91 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+from pymbtiles import MBtiles
+
+from datatiles.encoding.exponential import ExponentialEncoder
+from datatiles.histograms import TileHistograms, summarize_region
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.png import from_png
+
+
+ENCODING = {
+    "type": "exponential",
+    "base": 4,
+    "dtype": "uint8",
+    "nodata": 255,
+    "layers": [
+        {"id": "a", "nodata": 3, "type": "indexed", "values": [10, 20, 30]},
+        {"id": "b", "nodata": 3, "type": "indexed", "values": [1, 5]},
+    ],
+}
+
+
+def encode_layers(a, b):
+    encoder = ExponentialEncoder(base=ENCODING["base"], dtype="uint8")
+    encoder.add(a.astype("uint8"))
+    encoder.add(b.astype("uint8"))
+    return encoder.values
+
+
+def test_TileHistograms():
+    a = np.array([[0, 1], [2, 3]])
+    b = np.array([[1, 1], [0, 3]])
+    encoded = encode_layers(a, b)
+    encoded[0, 0] = ENCODING["nodata"]
+
+    histograms = TileHistograms(ENCODING)(encoded)
+    assert histograms[0].tolist() == [0, 1, 1]
+    assert histograms[1].tolist() == [1, 1]
+
+    # tables are built from the values in each tile for larger encodings
+    encoding = dict(ENCODING, dtype="uint16", nodata=65535)
+    encoded = encoded.astype("uint16")
+    encoded[0, 0] = encoding["nodata"]
+    histograms = TileHistograms(encoding)(encoded)
+    assert histograms[0].tolist() == [0, 1, 1]
+    assert histograms[1].tolist() == [1, 1]
+
+
+def test_summarize_region(tmpdir):
+    a = np.random.randint(0, 4, (100, 100))
+    b = np.random.randint(0, 2, (100, 100))
+    encoded = encode_layers(a, b)
+    encoded[:10] = ENCODING["nodata"]
+
+    tif = str(tmpdir.join("encoded.tif"))
+    with rasterio.open(
+        tif,
+        "w",
+        driver="GTiff",
+        width=100,
+        height=100,
+        count=1,
+        dtype="uint8",
+        nodata=ENCODING["nodata"],
+        crs="EPSG:4326",
+        transform=from_bounds(-100, 30, -90, 40, 100, 100),
+    ) as out:
+        out.write(encoded, 1)
+
+    filename = str(tmpdir.join("encoded.mbtiles"))
+    tif_to_mbtiles(tif, filename, 0, 4, tile_size=64, encoding=ENCODING)
+
+    # Compare against histograms of all decoded tiles
+    histograms = TileHistograms(ENCODING)
+    expected = [np.zeros(3, dtype="int64"), np.zeros(2, dtype="int64")]
+    with MBtiles(filename) as mbtiles:
+        for tile in mbtiles.list_tiles():
+            if tile.z == 4:
+                data = from_png(mbtiles.read_tile(*tile))
+                expected = [e + h for e, h in zip(expected, histograms(data))]
+
+    summary = summarize_region(filename, (-180, -85, 180, 85))
+    assert summary["a"] == {
+        v: c for v, c in zip([10, 20, 30], expected[0].tolist()) if c
+    }
+    assert summary["b"] == {v: c for v, c in zip([1, 5], expected[1].tolist()) if c}
+
+    # No tiles outside the data
+    summary = summarize_region(filename, (0, 0, 10, 10))
+    assert summary == {"a": {}, "b": {}}
@@ -0,0 +1,130 @@
+from functools import partial
+
+import numpy as np
+from pymbtiles import MBtiles
+import rasterio
+from rasterio.io import MemoryFile
+
+from datatiles.encoding import encode_tifs
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.metrics import TimingMetrics
+from datatiles.png import to_paletted_png, to_smallest_png
+from datatiles.raster import array_to_memoryfile
+from datatiles.tiles import tif_to_tiles
+
+
+PALETTE = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 0, 0)], dtype="uint8")
+
+
+def test_tif_to_mbtiles_outputs(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    paletted_renderer = partial(to_paletted_png, palette=PALETTE, nodata=255)
+
+    data_filename = str(tmpdir.join("data.mbtiles"))
+    tif_to_mbtiles(filename, data_filename, 8, 10)
+
+    paletted_filename = str(tmpdir.join("paletted.mbtiles"))
+    tif_to_mbtiles(filename, paletted_filename, 8, 10, tile_renderer=paletted_renderer)
+
+    # paletted renderer first, to verify it does not change data for the next
+    outputs = [
+        (paletted_renderer, str(tmpdir.join("out_paletted.mbtiles"))),
+        (to_smallest_png, str(tmpdir.join("out_data.mbtiles"))),
+    ]
+    metrics = TimingMetrics()
+    tif_to_mbtiles(filename, outputs, 8, 10, metrics=metrics)
+
+    with MBtiles(data_filename) as expected:
+        tiles = expected.list_tiles()
+
+    assert metrics.counts["written"] == 2 * len(tiles)
+    assert metrics.counts["tiles"] == len(tiles) + metrics.counts["skipped"]
+
+    for expected_filename, (_, out_filename) in zip(
+        (paletted_filename, data_filename), outputs
+    ):
+        with MBtiles(expected_filename) as expected, MBtiles(out_filename) as out:
+            assert out.meta["maxzoom"] == expected.meta["maxzoom"]
+            assert sorted(out.list_tiles()) == sorted(tiles)
+            for tile in tiles:
+                assert out.read_tile(*tile) == expected.read_tile(*tile)
+
+    estimates = tif_to_mbtiles(filename, outputs, 8, 10, dry_run=True)
+    assert len(estimates) == 2
+
+
+def test_tif_to_tiles_outputs(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    paletted_renderer = partial(to_paletted_png, palette=PALETTE, nodata=255)
+    paletted_path = tmpdir.join("paletted")
+    data_path = tmpdir.join("data")
+    tif_to_tiles(
+        filename,
+        [(paletted_renderer, str(paletted_path)), (to_smallest_png, str(data_path))],
+        8,
+        10,
+    )
+
+    data_filename = str(tmpdir.join("data.mbtiles"))
+    tif_to_mbtiles(filename, data_filename, 8, 10)
+
+    with MBtiles(data_filename) as expected:
+        for z, x, y in expected.list_tiles():
+            # mbtiles uses the TMS scheme
+            path = [str(z), str(x), "{}.png".format(2 ** z - y - 1)]
+            assert data_path.join(*path).read_binary() == expected.read_tile(z, x, y)
+            assert paletted_path.join(*path).exists()
+
+
+def test_tif_to_mbtiles_in_memory(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    expected_filename = str(tmpdir.join("expected.mbtiles"))
+    tif_to_mbtiles(filename, expected_filename, 8, 10)
+
+    with MBtiles(expected_filename) as mbtiles:
+        tiles = mbtiles.list_tiles()
+        expected = {tile: mbtiles.read_tile(*tile) for tile in tiles}
+
+    with rasterio.open(filename) as src:
+        memfile = array_to_memoryfile(src.read(1), src.transform, src.crs, src.nodata)
+
+        for i, source in enumerate((src, memfile)):
+            outfilename = str(tmpdir.join("test{}.mbtiles".format(i)))
+            tif_to_mbtiles(source, outfilename, 8, 10, overview_resampling="nearest")
+
+            with MBtiles(outfilename) as mbtiles:
+                assert sorted(mbtiles.list_tiles()) == sorted(tiles)
+                # tiles at max zoom are not read from overviews
+                for tile in tiles:
+                    if tile[0] == 10:
+                        assert mbtiles.read_tile(*tile) == expected[tile]
+
+
+def test_encode_tifs_to_mbtiles_in_memory(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=600, height=500)
+
+    encoded_filename = str(tmpdir.join("encoded.tif"))
+    sources = {"a": {"source": filename}}
+    encoding = encode_tifs(sources, encoded_filename)
+
+    expected_filename = str(tmpdir.join("expected.mbtiles"))
+    tif_to_mbtiles(encoded_filename, expected_filename, 9, 10, encoding=encoding)
+
+    with MemoryFile() as memfile:
+        assert encode_tifs(sources, memfile) == encoding
+
+        outfilename = str(tmpdir.join("test.mbtiles"))
+        tif_to_mbtiles(memfile, outfilename, 9, 10, encoding=encoding)
+
+    with MBtiles(expected_filename) as expected, MBtiles(outfilename) as mbtiles:
+        tiles = expected.list_tiles()
+        assert sorted(mbtiles.list_tiles()) == sorted(tiles)
+        for tile in tiles:
+            assert mbtiles.read_tile(*tile) == expected.read_tile(*tile)
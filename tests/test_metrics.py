@@ -0,0 +1,98 @@
+import os
+
+from pymbtiles import MBtiles
+
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.metrics import NULL_METRICS, ProgressMetrics, TimingMetrics
+from datatiles.tiles import tif_to_tiles
+
+
+def test_null_metrics():
+    with NULL_METRICS.timer("read"):
+        pass
+
+    NULL_METRICS.count("tiles")
+    NULL_METRICS.record("peak_memory", 100)
+
+
+def test_TimingMetrics():
+    metrics = TimingMetrics()
+    for _ in range(2):
+        with metrics.timer("read"):
+            pass
+    metrics.count("tiles")
+    metrics.count("bytes", 10)
+    metrics.record("peak_memory", 100)
+
+    summary = metrics.summary()
+    assert summary["timings"]["read"]["calls"] == 2
+    assert summary["timings"]["read"]["seconds"] >= 0
+    assert summary["counts"] == {"tiles": 1, "bytes": 10}
+    assert summary["values"] == {"peak_memory": 100}
+
+
+def test_ProgressMetrics():
+    # nothing is timed by default
+    progress = ProgressMetrics()
+    assert progress.timer("read") is NULL_METRICS.timer("read")
+    progress.count("tiles", 2)
+    progress.finish()
+
+    metrics = TimingMetrics()
+    progress = ProgressMetrics(metrics)
+    with progress.timer("read"):
+        pass
+    progress.count("tiles", 2)
+    progress.record("peak_memory", 100)
+    progress.finish()
+
+    assert metrics.calls["read"] == 1
+    assert metrics.counts["tiles"] == 2
+    assert metrics.values["peak_memory"] == 100
+
+
+def test_tif_to_mbtiles_metrics(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=256)
+
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    metrics = TimingMetrics()
+    tif_to_mbtiles(filename, outfilename, 8, 10, metrics=metrics)
+
+    with MBtiles(outfilename) as mbtiles:
+        num_tiles = len(mbtiles.list_tiles())
+
+    counts = metrics.counts
+    assert counts["written"] == num_tiles
+    assert counts["tiles"] == counts["written"] + counts["skipped"]
+    assert counts["bytes"] > 0
+    for stage in ("window", "read", "empty", "render", "write"):
+        assert stage in metrics.timings
+
+
+def test_tif_to_tiles_metrics(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=256)
+
+    outpath = str(tmpdir.join("tiles"))
+    metrics = TimingMetrics()
+    tif_to_tiles(filename, outpath, 10, 10, metrics=metrics)
+
+    num_tiles = sum(len(files) for _, _, files in os.walk(outpath))
+    assert metrics.counts["written"] == num_tiles
+    assert metrics.counts["bytes"] == sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(outpath)
+        for f in files
+    )
+
+
+def test_tif_to_mbtiles_progress(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=256)
+
+    # metrics are passed on while progress is displayed
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    metrics = TimingMetrics()
+    tif_to_mbtiles(filename, outfilename, 8, 10, metrics=metrics, progress=True)
+    assert metrics.counts["tiles"] > 0
@@ -0,0 +1,65 @@
+from contextlib import closing
+from io import BytesIO
+import sqlite3
+
+import numpy as np
+from PIL import Image
+from pymbtiles import MBtiles
+
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.optimize import optimize_mbtiles, recompress_png
+from datatiles.png import from_png, to_paletted_png, to_smallest_png
+
+
+def test_recompress_png():
+    arr = np.random.choice([0, 1000, 2000], (256, 256)).astype("uint16")
+    png = to_smallest_png(arr)
+    assert Image.open(BytesIO(png)).mode == "RGB"
+
+    out = recompress_png(png)
+    assert len(out) < len(png)
+    assert Image.open(BytesIO(out)).mode == "P"
+    assert np.array_equal(from_png(out), arr)
+
+    # bit depth is not reduced when disabled
+    out = recompress_png(png, reduce_bit_depth=False)
+    assert Image.open(BytesIO(out)).mode == "RGB"
+    assert np.array_equal(from_png(out), arr)
+
+    # transparency of paletted images is retained
+    arr = np.ma.masked_equal(np.random.randint(0, 4, (256, 256)), 3).astype("uint8")
+    palette = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255)], dtype="uint8")
+    png = to_paletted_png(arr, palette)
+    out = recompress_png(png)
+    assert len(out) <= len(png)
+    assert np.array_equal(
+        np.asarray(Image.open(BytesIO(out)).convert("RGBA")),
+        np.asarray(Image.open(BytesIO(png)).convert("RGBA")),
+    )
+
+
+def test_optimize_mbtiles(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    tif_to_mbtiles(filename, outfilename, 8, 10)
+
+    with MBtiles(outfilename) as mbtiles:
+        tiles = mbtiles.list_tiles()
+        expected = {tile: from_png(mbtiles.read_tile(*tile)) for tile in tiles}
+
+    stats = optimize_mbtiles(outfilename, processes=2, batch_size=5)
+    assert stats["images"] == len(tiles)
+    assert stats["recompressed"] > 0
+    assert stats["bytes_after"] < stats["bytes_before"]
+    assert stats["file_bytes_after"] < stats["file_bytes_before"]
+
+    with MBtiles(outfilename) as mbtiles:
+        assert sorted(mbtiles.list_tiles()) == sorted(tiles)
+        for tile in tiles:
+            assert np.array_equal(from_png(mbtiles.read_tile(*tile)), expected[tile])
+
+    # no orphaned images remain
+    with closing(sqlite3.connect(outfilename)) as db:
+        assert db.execute("SELECT count(*) FROM images").fetchone()[0] == len(tiles)
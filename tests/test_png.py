@@ -0,0 +1,108 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from pymbtiles import MBtiles
+import rasterio
+
+from datatiles.mbtiles import render_tif_to_mbtiles, tif_to_mbtiles
+from datatiles.png import from_png, get_palette_indexes, to_paletted_png
+
+
+def decode_rgba(png):
+    return np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+
+
+def test_get_palette_indexes():
+    values = [1, 3, 300]
+
+    arr = np.array([[0, 1, 2], [3, 255, 1]], dtype="uint8")
+    expected = np.array([[3, 0, 3], [1, 3, 0]], dtype="uint8")
+    assert np.array_equal(get_palette_indexes(arr, values, 3), expected)
+
+    arr = np.array([[0, 1, 2], [3, 300, 1000]], dtype="uint16")
+    expected = np.array([[3, 0, 3], [1, 2, 3]], dtype="uint8")
+    assert np.array_equal(get_palette_indexes(arr, values, 3), expected)
+
+
+def test_to_paletted_png_values():
+    palette = np.array([(255, 0, 0), (0, 0, 255)], dtype="uint8")
+    arr = np.array([[10, 20], [30, 255]], dtype="uint16")
+    original = arr.copy()
+
+    rgba = decode_rgba(to_paletted_png(arr, palette, nodata=255, values=[10, 30]))
+    assert arr.dtype == "uint16"
+    assert np.array_equal(arr, original)
+
+    assert tuple(rgba[0, 0]) == (255, 0, 0, 255)
+    assert tuple(rgba[1, 0]) == (0, 0, 255, 255)
+    # values not in values and nodata are transparent
+    assert rgba[0, 1, 3] == 0
+    assert rgba[1, 1, 3] == 0
+
+
+def test_to_paletted_png_nodata():
+    palette = np.array([(255, 0, 0), (0, 0, 255)], dtype="uint8")
+    arr = np.array([[0, 1], [255, 1]], dtype="uint8")
+    original = arr.copy()
+
+    rgba = decode_rgba(to_paletted_png(arr, palette, nodata=255))
+    assert np.array_equal(arr, original)
+    assert rgba[1, 0, 3] == 0
+    assert tuple(rgba[1, 1]) == (0, 0, 255, 255)
+
+
+def test_render_tif_to_mbtiles(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=512)
+
+    colormap = {1: "#FF0000", 3: "#0000FF"}
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    render_tif_to_mbtiles(filename, outfilename, colormap, 10, 10)
+
+    datafilename = str(tmpdir.join("data.mbtiles"))
+    tif_to_mbtiles(filename, datafilename, 10, 10)
+
+    with MBtiles(outfilename) as mbtiles, MBtiles(datafilename) as data_mbtiles:
+        tiles = mbtiles.list_tiles()
+        assert sorted(tiles) == sorted(data_mbtiles.list_tiles())
+
+        for tile in tiles:
+            rgba = decode_rgba(mbtiles.read_tile(*tile))
+            data = from_png(data_mbtiles.read_tile(*tile))
+
+            assert np.all(rgba[data == 1] == (255, 0, 0, 255))
+            assert np.all(rgba[data == 3] == (0, 0, 255, 255))
+            assert np.all(rgba[(data != 1) & (data != 3)][:, 3] == 0)
+
+
+def test_to_paletted_png_skip_empty():
+    palette = np.array([[255, 0, 0], [0, 0, 255]], dtype="uint8")
+    arr = np.array([[0, 7], [7, 0]], dtype="uint8")
+
+    assert to_paletted_png(arr, palette, values=[5, 10], skip_empty=True) is None
+    assert to_paletted_png(arr, palette, values=[0, 10], skip_empty=True) is not None
+
+
+def test_render_tif_to_mbtiles_skip_empty(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=512)
+
+    # right half only has values that are not in the colormap
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        data[:, 256:] = 0
+        src.write(data, 1)
+
+    outfilename = str(tmpdir.join("test.mbtiles"))
+    render_tif_to_mbtiles(filename, outfilename, {1: "#FF0000"}, 10, 10)
+
+    datafilename = str(tmpdir.join("data.mbtiles"))
+    tif_to_mbtiles(filename, datafilename, 10, 10)
+
+    with MBtiles(outfilename) as mbtiles, MBtiles(datafilename) as data_mbtiles:
+        tiles = mbtiles.list_tiles()
+        assert 0 < len(tiles) < len(data_mbtiles.list_tiles())
+
+        for tile in tiles:
+            assert np.any(decode_rgba(mbtiles.read_tile(*tile))[..., 3] == 255)
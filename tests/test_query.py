@@ -0,0 +1,80 @@
+import json
+
+import mercantile
+import numpy as np
+from pymbtiles import MBtiles
+
+from datatiles.encoding.exponential import ExponentialEncoder
+from datatiles.png import to_smallest_png
+from datatiles.query import PointQuery, lnglat_to_tile_pixel
+
+ENCODING = {
+    "type": "exponential",
+    "base": 5,
+    "dtype": "uint16",
+    "nodata": 65535,
+    "layers": [
+        {"id": "a", "nodata": 4, "type": "indexed", "values": [10, 20, 30]},
+        {"id": "b", "nodata": 4, "type": "indexed", "values": [1, 2, 3, 4]},
+    ],
+}
+
+
+def test_lnglat_to_tile_pixel():
+    tile = mercantile.Tile(3, 2, 3)
+    bounds = mercantile.bounds(tile)
+    lons = [bounds.west + 1e-9, bounds.east - 1e-9, 0]
+    lats = [bounds.north - 1e-9, bounds.south + 1e-9, 89]
+
+    x, y, col, row, valid = lnglat_to_tile_pixel(lons, lats, tile.z, 128)
+    assert np.array_equal(x[:2], [3, 3])
+    assert np.array_equal(y[:2], [2, 2])
+    assert np.array_equal(col[:2], [0, 127])
+    assert np.array_equal(row[:2], [0, 127])
+    assert np.array_equal(valid, [True, True, False])
+
+
+def test_PointQuery(tmpdir):
+    a = np.random.randint(0, 3, (64, 64)).astype("uint16")
+    b = np.random.randint(0, 4, (64, 64)).astype("uint16")
+    encoder = ExponentialEncoder(base=ENCODING["base"], dtype="uint16")
+    encoder.add(a)
+    encoder.add(b)
+    encoded = encoder.values
+    encoded[0, 0] = ENCODING["nodata"]
+    a[0, 1] = 4  # layer nodata
+    encoded[0, 1] = a[0, 1] + b[0, 1] * ENCODING["base"]
+
+    filename = str(tmpdir.join("test.mbtiles"))
+    with MBtiles(filename, mode="w") as mbtiles:
+        mbtiles.meta = {"maxzoom": 3, "encoding": json.dumps(ENCODING)}
+        # TMS tile row
+        mbtiles.write_tile(3, 3, 5, to_smallest_png(encoded))
+
+    bounds = mercantile.bounds(mercantile.Tile(3, 2, 3))
+    lons = np.random.uniform(bounds.west, bounds.east, 100)
+    lats = np.random.uniform(bounds.south, bounds.north, 100)
+    _, _, col, row, _ = lnglat_to_tile_pixel(lons, lats, 3, 64)
+
+    # point outside the tileset
+    lons[-1] = 0
+
+    with PointQuery(filename) as query:
+        results = query.query(lons, lats)
+
+    expected_a = np.ma.masked_equal(a[row, col], 4)
+    expected_a.mask |= encoded[row, col] == ENCODING["nodata"]
+    expected_a[-1] = np.ma.masked
+    assert np.array_equal(
+        np.ma.getmaskarray(results["a"]), np.ma.getmaskarray(expected_a)
+    )
+    assert np.array_equal(
+        results["a"].compressed(),
+        np.take([10, 20, 30], expected_a.compressed()),
+    )
+
+    assert results["b"].mask[-1]
+    valid = ~np.ma.getmaskarray(results["b"])
+    assert np.array_equal(
+        results["b"][valid], np.take([1, 2, 3, 4], b[row, col][valid])
+    )
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.io import MemoryFile
+
+from datatiles.metrics import TimingMetrics
+from datatiles.raster import (
+    array_to_memoryfile,
+    get_overview_factors,
+    get_overview_levels,
+    open_source,
+    overviews_source,
+)
+
+
+def test_get_overview_factors():
+    assert get_overview_factors(256, 100) == []
+    assert get_overview_factors(1000, 257) == [2, 4]
+    assert get_overview_factors(100, 1024, blocksize=128) == [2, 4, 8]
+
+
+def test_get_overview_levels(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    with rasterio.open(filename) as src:
+        assert get_overview_levels(src, range(5, 11)) == {z: None for z in range(5, 11)}
+
+    with overviews_source(filename, "nearest") as overviews_filename:
+        assert overviews_filename != filename
+
+        with rasterio.open(overviews_filename) as src:
+            assert src.overviews(1) == [2, 4]
+            assert get_overview_levels(src, range(5, 11)) == {
+                5: 1,
+                6: 1,
+                7: 1,
+                8: 1,
+                9: 0,
+                10: None,
+            }
+
+            # tiles of half the size use the same levels one zoom higher
+            assert get_overview_levels(src, [10, 11], tile_size=128) == {
+                10: 0,
+                11: None,
+            }
+
+    # Source is not modified
+    with rasterio.open(filename) as src:
+        assert src.overviews(1) == []
+
+    with overviews_source(filename) as overviews_filename:
+        assert overviews_filename == filename
+
+
+def test_open_source(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=256)
+
+    with rasterio.open(filename) as src:
+        data = src.read(1)
+        transform = src.transform
+
+        with open_source(src) as opened:
+            assert opened is src
+        # open datasets are not closed
+        assert not src.closed
+
+    memfile = array_to_memoryfile(data, transform, "EPSG:3857", nodata=255)
+    for source in (filename, memfile):
+        with open_source(source) as src:
+            assert src.transform == transform
+            assert src.nodata == 255
+            assert np.array_equal(src.read(1), data)
+
+    masked = np.ma.masked_array(data, mask=data == 0)
+    with open_source(array_to_memoryfile(masked, transform, "EPSG:3857", 255)) as src:
+        assert np.array_equal(src.read(1), np.where(data == 0, 255, data))
+
+
+def test_overviews_source_memoryfile(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    with rasterio.open(filename) as src:
+        memfile = array_to_memoryfile(src.read(1), src.transform, src.crs, 255)
+
+    with overviews_source(memfile, "nearest") as source:
+        assert isinstance(source, MemoryFile)
+        assert source is not memfile
+        with open_source(source) as src:
+            assert src.overviews(1) == [2, 4]
+
+    # Source is not modified
+    with open_source(memfile) as src:
+        assert src.overviews(1) == []
+
+
+def test_overviews_source_dataset(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+
+    # Open datasets backed by files on disk are copied to a temporary file
+    with rasterio.open(filename) as dataset:
+        with overviews_source(dataset, "nearest") as source:
+            assert isinstance(source, str)
+            assert source != filename
+            with open_source(source) as src:
+                assert src.overviews(1) == [2, 4]
+
+        assert not os.path.exists(source)
+        assert dataset.overviews(1) == []
+
+    metrics = TimingMetrics()
+    with overviews_source(filename, "nearest", metrics) as source:
+        assert metrics.calls["overviews"] == 1
@@ -0,0 +1,224 @@
+from contextlib import closing
+import sqlite3
+
+import mercantile
+import numpy as np
+import rasterio
+from pymbtiles import MBtiles
+
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.tiles import (
+    DirectoryWriter,
+    get_descendants,
+    get_tile_grid,
+    is_uniform,
+    open_tile_vrt,
+    read_tiles,
+    tif_to_tiles,
+)
+
+
+def write_uniform_tif(filename, write_random_tif):
+    # uniform except for the upper left tile at zoom 10
+    write_random_tif(filename)
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        data[256:] = 1
+        data[:, 256:] = 1
+        src.write(data, 1)
+
+
+def test_get_descendants():
+    bounds = mercantile.bounds(0, 0, 1)
+    assert list(get_descendants(mercantile.Tile(0, 0, 0), 1, bounds)) == [
+        mercantile.Tile(0, 0, 1)
+    ]
+
+    descendants = list(get_descendants(mercantile.Tile(0, 0, 1), 3, (-180, 0, 0, 85)))
+    assert len(descendants) == 4 + 16
+
+
+def test_get_tile_grid(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    with rasterio.open(filename) as src, open_tile_vrt(src) as vrt:
+        # raster starts at the upper left of tile 512, 512, 10
+        tiles = [
+            mercantile.Tile(x, y, 10) for x in range(510, 518) for y in range(510, 518)
+        ]
+        grid = get_tile_grid(
+            vrt, 10, np.array([t.x for t in tiles]), np.array([t.y for t in tiles])
+        )
+
+        for tile, entry in zip(tiles, grid):
+            bounds = mercantile.xy_bounds(tile)
+            window = vrt.window(*bounds)
+
+            assert (entry["x"], entry["y"]) == (tile.x, tile.y)
+            assert np.allclose(
+                [entry["col_off"], entry["row_off"]],
+                [window.col_off, window.row_off],
+            )
+            assert np.allclose(
+                [entry["window_width"], entry["window_height"]],
+                [window.width, window.height],
+            )
+            assert np.allclose([entry["left"], entry["top"]], [bounds[0], bounds[3]])
+
+        inside = (grid["x"] >= 512) & (grid["x"] < 516)
+        inside &= (grid["y"] >= 512) & (grid["y"] < 516)
+        empty = (grid["width"] <= 0) | (grid["height"] <= 0)
+        assert (empty == ~inside).all()
+        assert (grid["width"][inside & (grid["x"] < 515)] == 256).all()
+        assert (grid["width"][inside & (grid["x"] == 515)] == 1000 - 3 * 256).all()
+        assert (grid["height"][inside & (grid["y"] == 515)] == 900 - 3 * 256).all()
+
+
+def test_read_tiles_prune(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_uniform_tif(filename, write_random_tif)
+
+    with rasterio.open(filename) as src:
+        tiles = [tile for tile, _, _ in read_tiles(src, 8, 10)]
+        pruned = [tile for tile, _, _ in read_tiles(src, 8, 10, prune=True)]
+
+    assert len(tiles) == 1 + 4 + 16
+    assert len(pruned) == 1 + 4 + 4
+    assert set(pruned).issubset(tiles)
+
+
+def test_read_tiles_prune_sampled(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename)
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        # a single pixel that is not sampled at lower zoom levels
+        data[:] = 1
+        data[513, 513] = 2
+        src.write(data, 1)
+
+    with rasterio.open(filename) as src:
+        tiles = {
+            tile: is_uniform(data)
+            for tile, data, _ in read_tiles(src, 8, 10, prune=True)
+        }
+
+    assert tiles[mercantile.Tile(128, 128, 8)]
+    # descendants are read down to the tile that contains the pixel
+    assert mercantile.Tile(514, 514, 10) in tiles
+
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        # data that is not sampled at lower zoom levels, where tiles are nodata
+        data[:] = 255
+        data[600:602, 600:602] = 1
+        src.write(data, 1)
+
+    with rasterio.open(filename) as src:
+        tiles = [tile for tile, _, _ in read_tiles(src, 6, 10)]
+        pruned = [tile for tile, _, _ in read_tiles(src, 6, 10, prune=True)]
+
+    assert sorted(pruned) == sorted(tiles)
+
+
+def test_tif_to_mbtiles_prune(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_uniform_tif(filename, write_random_tif)
+
+    expected_filename = str(tmpdir.join("expected.mbtiles"))
+    tif_to_mbtiles(filename, expected_filename, 8, 10)
+
+    filename_overzoom = str(tmpdir.join("overzoom.mbtiles"))
+    tif_to_mbtiles(filename, filename_overzoom, 8, 10, prune="overzoom")
+
+    filename_duplicate = str(tmpdir.join("duplicate.mbtiles"))
+    tif_to_mbtiles(filename, filename_duplicate, 8, 10, prune="duplicate")
+
+    with MBtiles(expected_filename) as expected, MBtiles(
+        filename_overzoom
+    ) as overzoom, MBtiles(filename_duplicate) as duplicate:
+        tiles = expected.list_tiles()
+        assert len(tiles) == 21
+        assert len(overzoom.list_tiles()) == 9
+        assert sorted(duplicate.list_tiles()) == sorted(tiles)
+
+        for tile in tiles:
+            assert duplicate.read_tile(*tile) == expected.read_tile(*tile)
+
+    # images of duplicated tiles are stored once
+    with closing(sqlite3.connect(filename_duplicate)) as db:
+        assert db.execute("SELECT count(*) FROM images").fetchone()[0] < len(tiles)
+
+
+def test_read_tiles_reuse_buffers(tmpdir, write_random_tif):
+    # tiles along the right and bottom edges are partial
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    with rasterio.open(filename) as src:
+        expected = [
+            (tile, data) for tile, data, _ in read_tiles(src, 8, 11, tile_size=128)
+        ]
+
+        buffers = set()
+        tiles = []
+        for tile, data, _ in read_tiles(src, 8, 11, tile_size=128, reuse_buffers=True):
+            buffers.add(id(data))
+            tiles.append((tile, data.copy()))
+
+    assert len(buffers) == 1
+    assert len(tiles) == len(expected)
+    for (tile, data), (expected_tile, expected_data) in zip(tiles, expected):
+        assert tile == expected_tile
+        assert np.array_equal(data, expected_data)
+
+
+def test_DirectoryWriter(tmpdir):
+    path = str(tmpdir.join("tiles"))
+    with DirectoryWriter(path, threads=2) as writer:
+        for x in range(2):
+            for y in range(2):
+                writer.write_tile(1, x, y, "{}{}".format(x, y).encode("utf-8"))
+
+    assert tmpdir.join("tiles/1/1/0.png").read_binary() == b"10"
+    assert len(tmpdir.join("tiles/1").listdir()) == 2
+
+
+def test_tif_to_tiles(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=1000, height=900)
+
+    mbtiles_filename = str(tmpdir.join("test.mbtiles"))
+    tif_to_mbtiles(filename, mbtiles_filename, 8, 10)
+
+    path = tmpdir.join("tiles")
+    tif_to_tiles(filename, str(path), 8, 10, threads=2)
+
+    with MBtiles(mbtiles_filename) as mbtiles:
+        tiles = mbtiles.list_tiles()
+        assert len(path.listdir()) == 3
+        assert len(list(path.visit("*.png"))) == len(tiles)
+
+        for z, x, y in tiles:
+            # mbtiles uses the TMS scheme
+            png = path.join(str(z), str(x), "{}.png".format(2 ** z - y - 1))
+            assert png.read_binary() == mbtiles.read_tile(z, x, y)
+
+
+def test_tif_to_tiles_sparse(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    # the two left columns of tiles at zoom 10 are entirely nodata
+    write_random_tif(filename, width=1024, height=512)
+    with rasterio.open(filename, "r+") as src:
+        data = src.read(1)
+        data[:, :512] = 255
+        src.write(data, 1)
+
+    path = tmpdir.join("tiles")
+    tif_to_tiles(filename, str(path), 10, 10, threads=2)
+
+    # directories are only created for columns with tiles
+    assert len(path.join("10").listdir()) == 2
+    for column in path.join("10").listdir():
+        assert len(column.listdir()) == 2
@@ -0,0 +1,95 @@
+from functools import partial
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from pymbtiles import MBtiles
+import pytest
+
+from datatiles.encoding import encode_tifs
+from datatiles.encoding.exponential import decode_array
+from datatiles.mbtiles import render_tif_to_mbtiles, tif_to_mbtiles
+from datatiles.metrics import TimingMetrics
+from datatiles.png import from_png
+from datatiles.transcode import get_layer_lookup, transcode_layer
+from datatiles.webp import from_webp, to_smallest_webp
+
+
+def decode_rgba(png):
+    return np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+
+
+def test_get_layer_lookup():
+    encoding = {
+        "type": "exponential",
+        "base": 5,
+        "dtype": "uint8",
+        "nodata": 255,
+        "layers": [
+            {"id": "a", "nodata": 4, "type": "indexed", "values": [5, 10, 15]},
+            {"id": "b", "nodata": 4, "type": "indexed", "values": [1, 2, 3, 4]},
+        ],
+    }
+    lookup, palette = get_layer_lookup(encoding, "a", {15: "#0000FF", 5: "#FF0000"})
+    assert lookup.tolist() == [0, 2, 1, 2, 2]
+    assert palette.tolist() == [[255, 0, 0], [0, 0, 255]]
+
+    with pytest.raises(ValueError):
+        get_layer_lookup(encoding, "c", {})
+
+
+@pytest.mark.parametrize("renderer", ["png", "webp"])
+def test_transcode_layer(tmpdir, renderer, write_tif):
+    a = np.random.choice([5, 10, 15], (600, 500)).astype("uint8")
+    a[:100] = 255
+    b = np.random.choice([1, 2], (600, 500)).astype("uint16")
+    b[:, :100] = 0
+
+    write_tif(str(tmpdir.join("a.tif")), a, nodata=255)
+    write_tif(str(tmpdir.join("b.tif")), b, nodata=0)
+
+    encoded_filename = str(tmpdir.join("encoded.tif"))
+    encoding = encode_tifs(
+        {
+            "a": {"source": str(tmpdir.join("a.tif"))},
+            "b": {"source": str(tmpdir.join("b.tif"))},
+        },
+        encoded_filename,
+    )
+
+    kwargs = {"tile_renderer": to_smallest_webp} if renderer == "webp" else {}
+    filename = str(tmpdir.join("encoded.mbtiles"))
+    tif_to_mbtiles(encoded_filename, filename, 4, 6, encoding=encoding, **kwargs)
+
+    colormap = {1: "#FF0000", 2: "#0000FF"}
+    outfilename = str(tmpdir.join("b.mbtiles"))
+    metrics = TimingMetrics()
+    transcode_layer(filename, outfilename, "b", colormap, processes=2, metrics=metrics)
+
+    # rendering the layer from its source produces the same tiles at max zoom;
+    # lower zooms are read from overviews of the encoded tif
+    expected_filename = str(tmpdir.join("expected.mbtiles"))
+    render_tif_to_mbtiles(str(tmpdir.join("b.tif")), expected_filename, colormap, 6, 6)
+
+    with MBtiles(outfilename) as out, MBtiles(expected_filename) as expected:
+        assert "encoding" not in out.meta
+        assert out.meta["format"] == "png"
+        assert out.meta["maxzoom"] == "6"
+        assert metrics.counts["written"] == len(out.list_tiles())
+
+        for tile in expected.list_tiles():
+            assert np.array_equal(
+                decode_rgba(out.read_tile(*tile)),
+                decode_rgba(expected.read_tile(*tile)),
+            )
+
+    decode = from_png if renderer == "png" else partial(from_webp, dtype="uint8")
+    with MBtiles(filename) as src, MBtiles(outfilename) as out:
+        for z, x, y in out.list_tiles():
+            encoded = decode(src.read_tile(z, x, y))
+            values = decode_array(encoded, base=encoding["base"], size=2)[1]
+            rgba = decode_rgba(out.read_tile(z, x, y))
+
+            assert np.all(rgba[values == 0] == (255, 0, 0, 255))
+            assert np.all(rgba[values == 1] == (0, 0, 255, 255))
+            assert np.all(rgba[values > 1][:, 3] == 0)
@@ -0,0 +1,85 @@
+from functools import partial
+
+import numpy as np
+from pymbtiles import MBtiles
+import rasterio
+
+from datatiles.mbtiles import tif_to_mbtiles
+from datatiles.png import from_png, to_smallest_png
+from datatiles.tiles import read_tiles, tif_to_tiles
+from datatiles.webp import compare_to_png, decode_tile, from_webp, to_smallest_webp
+
+
+def test_to_smallest_webp():
+    data = np.random.randint(0, 2 ** 20, (256, 256)).astype("uint32")
+    webp = to_smallest_webp(data, verify=True)
+    assert webp[8:12] == b"WEBP"
+    assert np.array_equal(from_webp(webp), data)
+
+    data = np.random.randint(0, 200, (128, 128)).astype("uint8")
+    masked = np.ma.masked_array(data, mask=data > 150)
+    decoded = from_webp(to_smallest_webp(masked, verify=True), dtype="uint8")
+    assert np.array_equal(decoded, masked.filled(255))
+
+    # values of larger data types are decoded according to the dtype
+    data = np.random.randint(0, 200, (128, 128)).astype("uint16")
+    decoded = from_webp(to_smallest_webp(data, verify=True), dtype="uint16")
+    assert np.array_equal(decoded, data)
+
+
+def test_decode_tile():
+    data = np.random.randint(0, 2 ** 16, (256, 256)).astype("uint16")
+    assert np.array_equal(decode_tile(to_smallest_png(data)), data)
+    assert np.array_equal(decode_tile(to_smallest_webp(data), "uint16"), data)
+
+
+def test_compare_to_png(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=512)
+
+    with rasterio.open(filename) as src:
+        tiles = [data.copy() for _, data, _ in read_tiles(src, 9, 10)]
+
+    # also include RGB encoded values
+    tiles.append(np.random.randint(0, 2 ** 16, (256, 256)).astype("uint16"))
+
+    results = compare_to_png(tiles)
+    assert results["tiles"] == len(tiles)
+    assert results["exact"]
+    for format in ("png", "webp"):
+        assert results[format]["bytes"] > 0
+        assert results[format]["seconds"] > 0
+
+
+def test_tif_to_mbtiles_webp(tmpdir, write_random_tif):
+    filename = str(tmpdir.join("test.tif"))
+    write_random_tif(filename, width=512, height=512)
+
+    png_filename = str(tmpdir.join("png.mbtiles"))
+    webp_filename = str(tmpdir.join("webp.mbtiles"))
+    tif_to_mbtiles(
+        filename,
+        [
+            (to_smallest_png, png_filename),
+            (partial(to_smallest_webp, verify=True), webp_filename),
+        ],
+        9,
+        10,
+    )
+
+    with MBtiles(png_filename) as png, MBtiles(webp_filename) as webp:
+        assert png.meta["format"] == "png"
+        assert webp.meta["format"] == "webp"
+
+        tiles = png.list_tiles()
+        assert sorted(webp.list_tiles()) == sorted(tiles)
+        for tile in tiles:
+            expected = from_png(png.read_tile(*tile))
+            decoded = from_webp(webp.read_tile(*tile), dtype=expected.dtype)
+            assert np.array_equal(decoded, expected)
+
+    outpath = tmpdir.join("tiles")
+    tif_to_tiles(
+        filename, str(outpath), 10, 10, tile_renderer=to_smallest_webp, ext="webp"
+    )
+    assert outpath.join("10", "512", "512.webp").exists()